@@ -1,38 +1,231 @@
-import arcpy
-import arcpyproduction
+import csv
+import hashlib
 import os
 import sys
 import logging
-import pandas as pd
 import math
+import pickle
+import json
+import multiprocessing
+import shutil
+import tempfile
 
 from argparse import ArgumentParser
+from collections import Counter
 from collections import defaultdict
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime as dt
-from dateutil.relativedelta import relativedelta
+from util.cls_ogma_backend import get_backend
+from util.cls_ogma_candidates import OGMACandidates
+from util.cls_ogma_checkpoint import OGMACheckpoint
+from util.cls_ogma_columns import OGMAColumnStore
+from util.cls_ogma_connections import OGMAConnectionManager
+from util.cls_ogma_incremental import OGMAIncremental
+from util.cls_ogma_lazy import OGMALazyModule
+from util.cls_ogma_parquet import OGMAParquetStore
+from util.cls_ogma_profiler import OGMAProfiler
+from util.cls_ogma_raster import OGMARasterGrid
+from util.cls_ogma_rules import OGMARuleTable
+from util.cls_ogma_scratch import OGMAScratch
+from util.cls_ogma_scheduler import OGMAScheduler
+from util.cls_ogma_spatial import OGMASpatialLayer
 from util.cls_ogma_statistics import OGMAStatistics
 from util.cls_ogma_targets import OGMATarget
 
 sys.path.insert(1, r'W:\FOR\RSI\TOC\Projects\ESRI_Scripts\Python_Repository')
 
-from environment import Environment
-from erase_features import EraseFeatures
-from excel import Excel
+# Heavy and network share modules are imported on first use, see OGMALazyModule
+arcpy = OGMALazyModule('arcpy')
+arcpyproduction = OGMALazyModule('arcpyproduction')
+gpd = OGMALazyModule('geopandas')
+np = OGMALazyModule('numpy')
+pd = OGMALazyModule('pandas')
+relativedelta = OGMALazyModule('dateutil.relativedelta', attribute='relativedelta')
+Environment = OGMALazyModule('environment', attribute='Environment')
+Excel = OGMALazyModule('excel', attribute='Excel')
+
 
 def run_app():
-    tsa, out, un, pw, analyze, report, script_dir, logger = get_input_parameters()
-    ogma = OgmaAnalysis(tsa=tsa, output_location=out, username=un, password=pw,
-                        analyze=analyze, report=report, script_dir=script_dir, logger=logger)
-    if ogma.analyze:
-        ogma.prepare_data()
-        ogma.create_aoi()
-        ogma.identity_aoi()
-        ogma.update_attributes()
-    if ogma.report:
-        ogma.build_statistics()
-        ogma.create_report()
-    del ogma
+    tsa, out, un, pw, analyze, report, script_dir, logger, resume, workers, processes, profile, args = \
+        get_input_parameters()
+    lst_tsas = [t.strip() for t in tsa.split(',') if t.strip()]
+    if args.list_lus:
+        # Resolves the landscape units of each TSA without running the analysis
+        if args.backend != 'arcpy':
+            raise Exception('--list_lus reads the SDE sources and needs --backend arcpy')
+        with OGMAConnectionManager(username=un, password=pw, logger=logger) as connections:
+            for tsa in lst_tsas:
+                with OgmaAnalysis(tsa=tsa, output_location=out, username=un, password=pw, analyze='false',
+                                  report='false', script_dir=script_dir, logger=logger, backend=args.backend,
+                                  connections=connections) as ogma:
+                    ogma.list_landscape_units()
+        return
+
+    if len(lst_tsas) > 1:
+        run_batch(lst_tsas=lst_tsas, out=out, un=un, pw=pw, analyze=analyze, report=report, script_dir=script_dir,
+                  logger=logger, resume=resume, workers=workers, processes=processes, profile=profile, args=args)
+        return
+
+    if args.serve:
+        # Only reads what an earlier report run left in Data, nothing is connected to or rebuilt
+        with OgmaAnalysis(tsa=tsa, output_location=out, username=un, password=pw, analyze='false', report='false',
+                          script_dir=script_dir, logger=logger, projection_years=args.projection_years) as ogma:
+            ogma.serve(port=args.serve)
+        return
+
+    with OGMAConnectionManager(username=un, password=pw, logger=logger) as connections:
+        with OgmaAnalysis(tsa=tsa, output_location=out, username=un, password=pw, analyze=analyze, report=report,
+                          script_dir=script_dir, logger=logger, resume=resume, workers=workers, profile=profile,
+                          backend=args.backend, scratch_mb=args.scratch_mb, scratch_dir=args.scratch_dir,
+                          chunk_size=args.chunk_size, simplify_tolerance=args.simplify_tolerance,
+                          grid_size=args.grid_size, incremental=args.incremental,
+                          projection_years=args.projection_years, scenarios=args.scenarios, parquet=args.parquet,
+                          raster_cell=args.raster_cell, connections=connections) as ogma:
+            ogma.run_stages(lst_stages=get_stages(analyze=analyze, report=report, args=args))
+
+
+def get_stages(analyze, report, args):
+    lst_stages = []
+    if analyze.lower() == 'true':
+        lst_stages += ['prepare_data']
+        if args.simplify_tolerance or args.grid_size:
+            lst_stages += ['simplify_sources']
+        if args.raster_cell:
+            lst_stages += ['raster_statistics']
+        elif args.incremental:
+            lst_stages += ['refresh_resultant']
+        else:
+            lst_stages += ['create_aoi', 'identity_aoi', 'update_attributes']
+    if report.lower() == 'true' and not args.raster_cell:
+        lst_stages += ['build_statistics']
+        if args.scenarios:
+            lst_stages += ['evaluate_scenarios']
+        if args.find_candidates:
+            lst_stages += ['find_candidates']
+        lst_stages += ['create_report']
+    return lst_stages
+
+
+def run_batch(lst_tsas, out, un, pw, analyze, report, script_dir, logger, resume, workers, processes, profile, args):
+    lst_stages = get_stages(analyze=analyze, report=report, args=args)
+    if 'prepare_data' in lst_stages and args.backend != 'arcpy':
+        raise Exception('The shared source cache is extracted with arcpy; analyze a batch with --backend arcpy')
+
+    # One pair of connections serves every TSA; the worker processes only read through them. A report only batch
+    # never reads the sources and does not connect
+    with OGMAConnectionManager(username=un, password=pw, logger=logger) as connections:
+        lrm_db = bcgw_db = None
+        dict_source_cache = {}
+        if 'prepare_data' in lst_stages:
+            lrm_db = connections.acquire('lrm')
+            bcgw_db = connections.acquire('bcgw')
+            dict_source_cache = extract_shared_sources(lst_tsas=lst_tsas, out=out, lrm_db=lrm_db, bcgw_db=bcgw_db,
+                                                       script_dir=script_dir, logger=logger, resume=resume,
+                                                       workers=workers)
+
+        lst_jobs = [{'tsa': tsa, 'output_location': out, 'username': un, 'password': pw, 'analyze': analyze,
+                     'report': report, 'script_dir': script_dir, 'resume': resume, 'workers': workers,
+                     'profile': profile, 'backend': args.backend, 'scratch_mb': args.scratch_mb,
+                     'scratch_dir': args.scratch_dir, 'chunk_size': args.chunk_size,
+                     'simplify_tolerance': args.simplify_tolerance, 'grid_size': args.grid_size,
+                     'incremental': args.incremental, 'projection_years': args.projection_years,
+                     'scenarios': args.scenarios, 'parquet': args.parquet, 'raster_cell': args.raster_cell,
+                     'lrm_db': lrm_db, 'bcgw_db': bcgw_db, 'lst_stages': lst_stages,
+                     'dict_source_cache': dict_source_cache, 'args': args} for tsa in lst_tsas]
+
+        logger.info('Running {} on {} process(es)'.format(', '.join(lst_tsas), processes or len(lst_tsas)))
+        pool = multiprocessing.Pool(processes=processes or len(lst_tsas))
+        try:
+            for tsa, lst_report_files in pool.imap_unordered(run_tsa, lst_jobs):
+                logger.info('{} complete'.format(tsa))
+                for report_file in lst_report_files:
+                    logger.info('  {}'.format(report_file))
+        finally:
+            pool.close()
+            pool.join()
+
+
+def extract_shared_sources(lst_tsas, out, lrm_db, bcgw_db, script_dir, logger, resume, workers):
+    cache_dir = os.path.join(out, 'Batch', 'Data')
+    cache_gdb = os.path.join(cache_dir, 'OGMA_Source_Cache.gdb')
+    cache_manifest = os.path.join(cache_dir, 'source_cache.json')
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    if not arcpy.Exists(cache_gdb):
+        arcpy.CreateFileGDB_management(out_folder_path=cache_dir, out_name=os.path.basename(cache_gdb))
+
+    # Each TSA resolves its own landscape units; the sources are then extracted once over their combined extent
+    dict_sources = OrderedDict()
+    lst_extents = []
+    for tsa in lst_tsas:
+        with OgmaAnalysis(tsa=tsa, output_location=out, username=None, password=None, analyze='false',
+                          report='false', script_dir=script_dir, logger=logger, lrm_db=lrm_db,
+                          bcgw_db=bcgw_db) as ogma:
+            ogma.select_landscape_units()
+            lst_extents.append(arcpy.Describe(value=ogma.fc_lu).extent)
+            for src, ogma_input in ogma.source_data().items():
+                dict_sources[src] = ogma_input
+
+    dict_cache = OrderedDict((src, os.path.join(cache_gdb, src.replace(' ', '_'))) for src in dict_sources)
+    dict_params = {'tsas': sorted(lst_tsas), 'date': dt.now().strftime('%Y-%m-%d'),
+                   'sources': [[src, dict_sources[src].path, dict_sources[src].sql] for src in dict_sources]}
+    if resume and os.path.exists(cache_manifest):
+        with open(cache_manifest, 'r') as f:
+            if json.load(f) == json.loads(json.dumps(dict_params)) and \
+                    all(arcpy.Exists(path) for path in dict_cache.values()):
+                logger.info('Reusing shared source cache {}'.format(cache_gdb))
+                return dict_cache
+
+    arcpy.env.extent = arcpy.Extent(min(e.XMin for e in lst_extents), min(e.YMin for e in lst_extents),
+                                    max(e.XMax for e in lst_extents), max(e.YMax for e in lst_extents))
+
+    def extract(src):
+        logger.info('Extracting shared {}'.format(src))
+        if not dict_sources[src].sql:
+            arcpy.CopyFeatures_management(in_features=dict_sources[src].path, out_feature_class=dict_cache[src])
+        else:
+            arcpy.Select_analysis(in_features=dict_sources[src].path, out_feature_class=dict_cache[src],
+                                  where_clause=dict_sources[src].sql)
+
+    # The extracts are arcpy geoprocessing, which does not support running on several threads of one process
+    scheduler = OGMAScheduler(workers=1, logger=logger)
+    for src in dict_sources:
+        scheduler.add_node('extract {}'.format(src), lambda src=src: extract(src))
+    scheduler.run()
+    scheduler.report(report_file=os.path.join(cache_dir, 'source_cache_critical_path.txt'))
+    arcpy.ClearEnvironment('extent')
+
+    with open(cache_manifest, 'w') as f:
+        json.dump(dict_params, f, indent=2)
+    return dict_cache
+
+
+def copy_source_process(in_features, where_clause, staging_gdb, extent):
+    # Reads one source in a worker process of prepare_data. arcpy keeps one geoprocessing environment per process,
+    # so each source goes to a geodatabase of its own and the parent copies it into OGMA_Data.gdb
+    backend = get_backend(name='arcpy', logger=logging.getLogger(__name__))
+    backend.create_workspace(staging_gdb)
+    arcpy.env.extent = arcpy.Extent(*extent)
+    out_features = os.path.join(staging_gdb, 'source')
+    backend.select(in_features=in_features, out_features=out_features, where_clause=where_clause)
+    return out_features
+
+
+def run_tsa(dict_job):
+    dict_job = dict(dict_job)
+    args = dict_job.pop('args')
+    lst_stages = dict_job.pop('lst_stages')
+    dict_source_cache = dict_job.pop('dict_source_cache')
+    args.tsa = dict_job['tsa']
+    logger = Environment.setup_logger(args)
+
+    with OgmaAnalysis(logger=logger, **dict_job) as ogma:
+        if dict_source_cache:
+            ogma.use_source_cache(dict_source_cache)
+        ogma.run_stages(lst_stages=lst_stages)
+        lst_report_files = list(ogma.lst_report_files)
+    return dict_job['tsa'], lst_report_files
 
 
 def get_input_parameters():
@@ -41,7 +234,8 @@ def get_input_parameters():
                                             'selected TSA to determine OGMA allocation.  It will output reports and '
                                             'maps which include operating areas and tfls within the selected '
                                             'landscape unit')
-        parser.add_argument('tsa', type=str, help='Timber Supply Area Name')
+        parser.add_argument('tsa', type=str, help='Timber Supply Area Name, or a comma separated list of names to '
+                                                  'run as a batch')
         parser.add_argument('out', type=str, help='Output Location')
         parser.add_argument('un', type=str, help='BCGW username')
         parser.add_argument('pw', type=str, help='BCGW password')
@@ -50,6 +244,57 @@ def get_input_parameters():
         parser.add_argument('--log_level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
                             help='Log level')
         parser.add_argument('--log_dir', help='Path to log directory')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip stages whose checkpoint is still current and continue from the first '
+                                 'invalid stage')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of independent data preparation steps to run at once. The shapely '
+                                 'backend runs them on threads; arcpy reads the sources on this many processes and '
+                                 'runs the other steps one at a time')
+        parser.add_argument('--processes', type=int, help='Number of TSAs to run at once in batch mode')
+        parser.add_argument('--profile', action='store_true',
+                            help='Record time, memory and feature counts for each stage and geoprocessing call')
+        parser.add_argument('--backend', default='arcpy', choices=['arcpy', 'shapely'],
+                            help='Geoprocessing backend for the analysis. shapely cannot read the SDE sources or '
+                                 'draw the maps, so prepare_data and create_report have to be left current by an '
+                                 'arcpy run that is then resumed with shapely')
+        parser.add_argument('--scratch_mb', type=float, default=2048,
+                            help='Memory budget in MB for intermediate feature classes before they spill to disk')
+        parser.add_argument('--scratch_dir', help='Local folder for intermediates that spill to disk, defaults to '
+                                                  'the system temp folder')
+        parser.add_argument('--chunk_size', type=int, default=100000,
+                            help='Number of resultant rows read into memory at once')
+        parser.add_argument('--simplify_tolerance', type=float,
+                            help='Simplify the copied sources within this tolerance in metres before the overlay')
+        parser.add_argument('--grid_size', type=float,
+                            help='Snap the copied sources to a precision grid of this size in metres before the '
+                                 'overlay')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Rebuild only the landscape units whose sources changed since the last incremental '
+                                 'run and keep the rest of the resultant and its statistics; the first run is a full '
+                                 'build')
+        parser.add_argument('--projection_years', type=int, nargs='+', default=[],
+                            help='Also project age, age class and age type this many years ahead, e.g. 5 10 20, '
+                                 'and build statistics for each')
+        parser.add_argument('--scenarios', nargs='+', default=[],
+                            help='Alternative target tables, laid out as templates/ogma_targets.csv, to evaluate '
+                                 'against the statistics without rebuilding them')
+        parser.add_argument('--parquet', action='store_true',
+                            help='Also write the resultant as GeoParquet partitioned by landscape unit to '
+                                 'Data/resultant_parquet; needs Python 3 with geopandas and pyarrow')
+        parser.add_argument('--raster_cell', type=float,
+                            help='Approximate the analysis on a grid of this cell size in metres, e.g. 10 to 25, '
+                                 'instead of overlaying the sources, and compare the statistics with the last vector '
+                                 'run; the report is not generated')
+        parser.add_argument('--serve', type=int, metavar='PORT',
+                            help='Answer area and target queries over the statistics of the last report run on this '
+                                 'localhost port instead of running the analysis; needs Python 3')
+        parser.add_argument('--list_lus', action='store_true',
+                            help='List the landscape units each TSA resolves to and stop, without running the '
+                                 'analysis')
+        parser.add_argument('--find_candidates', action='store_true',
+                            help='Select replacement OGMA from the resultant for each landscape unit NDT/BEC/BEO '
+                                 'short of its mature + old or old target')
 
         args = parser.parse_args()
 
@@ -57,13 +302,30 @@ def get_input_parameters():
 
         script_dir = os.path.dirname(sys.argv[0])
 
-        return args.tsa, args.out, args.un, arcpy.GetParameterAsText(3), args.analyze, args.report, script_dir, logger
+        return args.tsa, args.out, args.un, args.pw, args.analyze, args.report, script_dir, \
+            logger, args.resume, args.workers, args.processes, args.profile, args
 
     except Exception as e:
         logging.error('Unexpected exception. Program terminating: {}'.format(e.message))
         raise Exception('Errors exist')
 
 
+def arcpy_installed():
+    try:
+        import arcpy
+        return True
+    except ImportError:
+        return False
+
+
+def get_classes_from_range(nums, lst_breaks, lst_results):
+    # get_value_from_range over an array; negative numbers are nulls and stay -1
+    nums = np.asarray(nums)
+    classes = np.asarray(lst_results)[np.clip(np.searchsorted(lst_breaks, nums, side='left'), 1, len(lst_breaks)) - 1]
+    classes = np.where(nums == 0, 0, classes)
+    return np.where(nums < 0, -1, classes)
+
+
 def get_value_from_range(num, lst_breaks, lst_results):
     if num == 0:
         return 0
@@ -77,11 +339,21 @@ def get_value_from_range(num, lst_breaks, lst_results):
 
 
 class OgmaAnalysis:
-    def __init__(self, tsa, output_location, username, password, analyze, report, script_dir, logger):
+    lst_stage_order = ['prepare_data', 'simplify_sources', 'create_aoi', 'identity_aoi', 'update_attributes',
+                       'refresh_resultant', 'raster_statistics', 'build_statistics', 'evaluate_scenarios',
+                       'find_candidates', 'create_report']
+    # prepare_data reads the SDE sources and create_report draws its maps with arcpy.mapping, neither of which another
+    # backend can do; those runs can only pass them where an arcpy run left them current
+    lst_arcpy_stages = ['prepare_data', 'create_report']
+
+    def __init__(self, tsa, output_location, username, password, analyze, report, script_dir, logger,
+                 resume=False, workers=1, lrm_db=None, bcgw_db=None, profile=False, backend='arcpy',
+                 scratch_mb=2048, scratch_dir=None, chunk_size=100000, simplify_tolerance=None, grid_size=None,
+                 incremental=False, projection_years=None, scenarios=None, parquet=False, raster_cell=None,
+                 connections=None):
         # Assign parameters and workspace variables
         self.tsa = tsa
         self.out_dir = output_location
-        self.sde_folder = 'Database Connections'
         self.script_dir = script_dir
 
         # self.str_lu_name = self.lu_name.split(':')[1].split('(')[0] \
@@ -96,14 +368,45 @@ class OgmaAnalysis:
         self.out_gdb = os.path.join(self.data_dir, 'OGMA_Data.gdb')
         self.analyze = True if analyze.lower() == 'true' else False
         self.report = True if report.lower() == 'true' else False
+        self.resume = resume
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.simplify_tolerance = simplify_tolerance
+        self.grid_size = grid_size
+        self.lst_projection_years = sorted(set(projection_years or []))
+        self.lst_scenarios = list(scenarios or [])
+        self.parquet = parquet
+        self.raster_cell = raster_cell
         self.logger = logger
-
-        # Connect to SDE databases and create output folders
-        self.lrm_db = Environment.create_lrm_connection(location=self.sde_folder, lrm_user_name='map_view_14',
-                                                        lrm_password='interface', logger=self.logger)
-
-        self.bcgw_db = Environment.create_bcgw_connection(location=self.sde_folder, bcgw_user_name=username,
-                                                          bcgw_password=password, logger=self.logger)
+        self.backend = get_backend(name=backend, logger=self.logger)
+        self.profiler = OGMAProfiler(enabled=profile, logger=self.logger, backend=self.backend)
+        # arcpy does not support geoprocessing on several threads of one process, so its steps run one at a time
+        # while the sources are read on that many worker processes, see read_sources. A batch TSA already runs in a
+        # pool process, which cannot start processes of its own, and reads the shared cache instead
+        self.copy_processes = 1
+        if self.workers > 1 and not self.backend.thread_safe:
+            if not multiprocessing.current_process().daemon:
+                self.logger.info('The {} backend reads the sources on {} processes and runs the other steps one at '
+                                 'a time'.format(self.backend.name, self.workers))
+                self.copy_processes = self.workers
+            self.workers = 1
+        self.copy_pool = None
+        self.staging_dir = None
+        self.dict_copies = {}
+        # Intermediates stay off the output share, only deliverables are written to out_gdb
+        self.scratch = OGMAScratch(backend=self.backend, budget_mb=scratch_mb, logger=self.logger,
+                                   local_dir=scratch_dir)
+
+        # Connections are only made once a stage reads from the source databases, see connect. Passed in
+        # connection paths are used as they are and never released here
+        self.username = username
+        self.password = password
+        self.lrm_db = lrm_db
+        self.bcgw_db = bcgw_db
+        self.connections = connections
+        self.bl_own_manager = False
+        self.bl_acquired = False
+        self.bl_connected = False
 
         self.lu_file = os.path.join(self.script_dir, 'templates', 'landscape_units.csv')
         self.target_file = os.path.join(self.script_dir, 'templates', 'ogma_targets.csv')
@@ -111,6 +414,25 @@ class OgmaAnalysis:
 
         self.excel_report_file = os.path.join(self.report_dir, '{}_LU_OGMA_{}.xlsx'
                                               .format(self.tsa, dt.now().strftime('%Y%m%d')))
+        self.scenario_report_file = os.path.join(self.report_dir, '{}_LU_OGMA_Scenarios_{}.csv'
+                                                 .format(self.tsa, dt.now().strftime('%Y%m%d')))
+        self.candidate_report_file = os.path.join(self.report_dir, '{}_LU_OGMA_Candidates_{}.csv'
+                                                  .format(self.tsa, dt.now().strftime('%Y%m%d')))
+        self.raster_report_file = os.path.join(self.report_dir, '{}_LU_OGMA_Raster_{}.csv'
+                                               .format(self.tsa, dt.now().strftime('%Y%m%d')))
+        self.statistics_file = os.path.join(self.data_dir, 'ogma_statistics.pkl')
+        self.raster_statistics_file = os.path.join(self.data_dir, 'ogma_raster_statistics.pkl')
+        self.projected_statistics_file = os.path.join(self.data_dir, 'ogma_projected_statistics.pkl')
+        self.statistics_source_file = os.path.join(self.data_dir, 'ogma_statistics_source.json')
+        self.manifest_file = os.path.join(self.data_dir, 'ogma_manifest.json')
+        self.simplify_report_file = os.path.join(self.data_dir, 'simplify_report.csv')
+        self.snapshot_file = os.path.join(self.data_dir, 'ogma_snapshot.json')
+        self.report_hash_file = os.path.join(self.report_dir, 'ogma_report_hashes.json')
+        self.parquet_dir = os.path.join(self.data_dir, 'resultant_parquet')
+        self.parquet_index_file = os.path.join(self.parquet_dir, OGMAParquetStore.index_name)
+        self.column_dir = os.path.join(self.data_dir, 'resultant_columns')
+        self.corridor_tile_size = 10000
+        self.lst_report_files = []
 
         self.str_ogma_summary_targets = ''
         self.str_ogma_age_class = ''
@@ -125,9 +447,26 @@ class OgmaAnalysis:
         if not os.path.exists(self.report_dir):
             os.makedirs(self.report_dir)
 
-        if not arcpy.Exists(self.out_gdb):
-            arcpy.CreateFileGDB_management(out_folder_path=os.path.dirname(self.out_gdb),
-                                           out_name=os.path.basename(self.out_gdb))
+        if not os.path.exists(self.out_gdb):
+            self.backend.create_workspace(self.out_gdb)
+
+        # Ages are projected to a single reference date so a resumed run matches the run it continues
+        self.checkpoint = OGMACheckpoint(manifest_file=self.manifest_file, lst_stages=self.lst_stage_order,
+                                         content_root=os.path.join(self.out_dir, self.tsa), backend=self.backend,
+                                         logger=self.logger)
+        self.dt_as_of = dt.now()
+        if self.resume and self.checkpoint.manifest['as_of']:
+            self.dt_as_of = dt.strptime(self.checkpoint.manifest['as_of'], '%Y-%m-%d')
+            self.logger.info('Resuming with ages projected to {}'.format(self.checkpoint.manifest['as_of']))
+        self.incremental = None
+        if incremental:
+            self.incremental = OGMAIncremental(backend=self.backend,
+                                               workspace=os.path.join(self.data_dir, 'OGMA_Snapshot.gdb'),
+                                               manifest_file=self.snapshot_file, logger=self.logger)
+        # Landscape unit numbers rebuilt by the last refresh, None when the whole resultant was built, and the id of
+        # the snapshot the resultant matched before it
+        self.lst_dirty_lus = None
+        self.str_snapshot_before = None
 
         # Field names
         self.fld_lu_name = 'LANDSCAPE_UNIT_NAME'
@@ -163,7 +502,77 @@ class OgmaAnalysis:
         self.fld_corridor = 'CORRIDOR'
 
 
-        # Source data
+        # Resultant data
+        self.fc_lu = os.path.join(self.out_gdb, 'landscape_unit')
+        self.fc_aoi = os.path.join(self.out_gdb, 'aoi')
+        self.fc_resultant = os.path.join(self.out_gdb, 'resultant')
+        self.fc_lr_plans = os.path.join(self.out_gdb, 'lr_plans')
+        self.fc_beo = os.path.join(self.out_gdb, 'beo')
+        self.fc_ogma = os.path.join(self.out_gdb, 'ogma')
+        self.fc_candidates = os.path.join(self.out_gdb, 'ogma_candidates')
+        self.dict_resultant_data = defaultdict(OgmaInput)
+
+        # Other Variables
+        self.lst_bio_options = ['Low', 'Intermediate', 'High']
+        self.lst_age_class_breaks = [0, 20, 40, 60, 80, 100, 120, 140, 250]
+        self.lst_age_class = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+        self.lst_lu_names = []
+        self.lst_lu_numbers = []
+
+        self.dict_resource_plans = {
+            'Okanagan Shuswap Land and Resource Management Plan': 'OKANAGAN SHUSWAP',
+            'Revelstoke Higher Level Plan Order': 'REVELSTOKE',
+            'Kootenay Boundary Higher Level Plan Order': 'KOOTENAY BOUNDARY'
+        }
+        self.dict_age_class = {
+            0: 'Harvested',
+            1: '1 to 20',
+            2: '21 to 40',
+            3: '41 to 60',
+            4: '61 to 80',
+            5: '81 to 100',
+            6: '101 to 120',
+            7: '121 to 140',
+            8: '141 to 250',
+            9: '251 +'
+        }
+
+        self.ogma_statistics = None
+        # {years ahead: statistics}, built alongside ogma_statistics for each projection year
+        self.dict_projected_statistics = OrderedDict()
+        # Flattened statistics by projection year, see scenario_aggregate
+        self.dict_scenario_aggregates = {}
+        self.ogma_targets = None
+
+        self.str_forest = 'FORESTED'
+        self.str_reserve = 'RESERVE'
+        self.str_np = 'NON-PRODUCTIVE'
+        self.str_harvest = 'HARVESTED'
+        self.str_operable = 'OPERABLE'
+        self.str_outside_oa = 'Outside Operating Area'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.scratch.close()
+        self.disconnect()
+        return False
+
+    def connect(self):
+        # Acquires the SDE connections unless they were passed in and defines the source data on them
+        if self.bl_connected:
+            return
+        if not (self.lrm_db and self.bcgw_db):
+            if self.connections is None:
+                self.connections = OGMAConnectionManager(username=self.username, password=self.password,
+                                                         logger=self.logger)
+                self.bl_own_manager = True
+            self.lrm_db = self.connections.acquire('lrm')
+            self.bcgw_db = self.connections.acquire('bcgw')
+            self.bl_acquired = True
+        self.bl_connected = True
+
         self.__landscape_unit = os.path.join(self.bcgw_db, 'WHSE_LAND_USE_PLANNING.RMP_LANDSCAPE_UNIT_SVW')
         self.__business_area = os.path.join(self.bcgw_db, 'WHSE_ADMIN_BOUNDARIES.FADM_BCTS_AREA_SP')
         self.__land_resource_plans = os.path.join(self.bcgw_db, 'WHSE_LAND_USE_PLANNING.RMP_STRGC_LAND_RSRCE_PLAN_SVW')
@@ -221,428 +630,1163 @@ class OgmaAnalysis:
                                r'\Slope80.gdb\Slope80_LiDAR_DEM_Merge_TSAOnly')
         }
 
-        # Resultant data
-        self.fc_lu = os.path.join(self.out_gdb, 'landscape_unit')
-        self.fc_aoi = os.path.join(self.out_gdb, 'aoi')
-        self.fc_resultant = os.path.join(self.out_gdb, 'resultant')
-        self.fc_lr_plans = os.path.join(self.out_gdb, 'lr_plans')
-        self.fc_beo = os.path.join(self.out_gdb, 'beo')
-        self.fc_ogma = os.path.join(self.out_gdb, 'ogma')
-        self.dict_resultant_data = defaultdict(OgmaInput)
-
-        # Other Variables
-        self.lst_bio_options = ['Low', 'Intermediate', 'High']
-        self.lst_age_class_breaks = [0, 20, 40, 60, 80, 100, 120, 140, 250]
-        self.lst_age_class = [1, 2, 3, 4, 5, 6, 7, 8, 9]
-        self.lst_lu_names = []
-        self.lst_lu_numbers = []
-
-        self.dict_resource_plans = {
-            'Okanagan Shuswap Land and Resource Management Plan': 'OKANAGAN SHUSWAP',
-            'Revelstoke Higher Level Plan Order': 'REVELSTOKE',
-            'Kootenay Boundary Higher Level Plan Order': 'KOOTENAY BOUNDARY'
-        }
-        self.dict_age_class = {
-            0: 'Harvested',
-            1: '1 to 20',
-            2: '21 to 40',
-            3: '41 to 60',
-            4: '61 to 80',
-            5: '81 to 100',
-            6: '101 to 120',
-            7: '121 to 140',
-            8: '141 to 250',
-            9: '251 +'
-        }
-
-        self.ogma_statistics = None
-        self.ogma_targets = None
-
-        self.str_forest = 'FORESTED'
-        self.str_reserve = 'RESERVE'
-        self.str_np = 'NON-PRODUCTIVE'
-        self.str_harvest = 'HARVESTED'
-        self.str_operable = 'OPERABLE'
-        self.str_outside_oa = 'Outside Operating Area'
-
-    def __del__(self):
-        Environment.delete_lrm_connection(location=self.sde_folder, logger=self.logger)
-        Environment.delete_bcgw_connection(location=self.sde_folder, logger=self.logger)
+    def disconnect(self):
+        if self.bl_acquired:
+            self.connections.release('lrm')
+            self.connections.release('bcgw')
+            self.lrm_db = None
+            self.bcgw_db = None
+            self.bl_acquired = False
+            self.bl_connected = False
+        if self.bl_own_manager:
+            self.connections.close()
+            self.connections = None
+            self.bl_own_manager = False
+
+    def source_data(self):
+        self.connect()
+        return OrderedDict((src, self.__dict_source_data[src]) for src in self.__dict_source_data
+                           if self.bl_corridor or src not in ['connectivity corridors', 'slope'])
+
+    def use_source_cache(self, dict_cache):
+        # Read sources from a shared extract; any where clause has already been applied to it
+        self.connect()
+        for src in dict_cache:
+            if src in self.__dict_source_data:
+                self.__dict_source_data[src] = OgmaInput(path=dict_cache[src],
+                                                         data_type=self.__dict_source_data[src].data_type)
+
+    def run_stages(self, lst_stages):
+        bl_current = self.resume
+        for stage in lst_stages:
+            bl_arcpy_only = self.backend.name != 'arcpy' and stage in self.lst_arcpy_stages
+            if bl_arcpy_only and not (bl_current and arcpy_installed()):
+                raise Exception('{} cannot run on the {} backend; run it with --backend arcpy first and resume'
+                                .format(stage, self.backend.name))
+            lst_inputs = self.stage_inputs(stage)
+            dict_params = self.stage_params(stage)
+            if bl_current and self.checkpoint.is_current(stage=stage, lst_inputs=lst_inputs, dict_params=dict_params):
+                self.logger.info('Skipping {} - checkpoint is current'.format(stage))
+                self.restore_stage(stage=stage, dict_state=self.checkpoint.state(stage))
+                continue
+            if bl_arcpy_only:
+                raise Exception('{} is not current and cannot run on the {} backend; run it with --backend arcpy'
+                                .format(stage, self.backend.name))
+
+            # Everything downstream of a stage that runs has to run again
+            bl_current = False
+            dict_input_fps = self.checkpoint.fingerprints(lst_inputs)
+            self.checkpoint.invalidate(stage)
+            self.checkpoint.manifest['as_of'] = self.dt_as_of.strftime('%Y-%m-%d')
+            try:
+                with self.profiler.trace(stage, category='stage'):
+                    getattr(self, stage)()
+            finally:
+                self.profiler.write(summary_file=os.path.join(self.data_dir, 'ogma_profile.json'),
+                                    trace_file=os.path.join(self.data_dir, 'ogma_profile_trace.json'))
+            self.checkpoint.record(stage=stage, dict_input_fps=dict_input_fps, dict_params=dict_params,
+                                   lst_outputs=self.stage_outputs(stage), dict_state=self.stage_state(stage))
+
+    def stage_inputs(self, stage):
+        if stage == 'prepare_data':
+            self.connect()
+            return [self.__timber_supply_areas, self.__landscape_unit, self.__operating_areas,
+                    self.__land_resource_plans] + [ogma_input.path for ogma_input in self.source_data().values()]
+        elif stage == 'simplify_sources':
+            return [self.fc_lu] + [self.dict_resultant_data[fc].path for fc in self.dict_resultant_data
+                                   if self.dict_resultant_data[fc].data_type in ('ADD', 'REMOVE')]
+        elif stage == 'create_aoi':
+            return [self.fc_lu] + [self.dict_resultant_data[fc].path for fc in self.dict_resultant_data
+                                   if self.dict_resultant_data[fc].data_type == 'REMOVE']
+        elif stage == 'identity_aoi':
+            return [self.fc_aoi] + [self.dict_resultant_data[fc].path for fc in self.dict_resultant_data
+                                    if self.dict_resultant_data[fc].data_type == 'ADD']
+        elif stage == 'update_attributes':
+            return [self.fc_resultant, self.fc_aoi, self.fc_lr_plans, self.target_file]
+        elif stage == 'refresh_resultant':
+            return [self.fc_lu, self.fc_lr_plans, self.target_file] + list(self.overlay_layers().values())
+        elif stage == 'raster_statistics':
+            return [self.fc_lu, self.fc_lr_plans, self.target_file, self.statistics_file] + \
+                list(self.overlay_layers().values())
+        elif stage == 'build_statistics':
+            return [self.fc_resultant, self.target_file]
+        elif stage == 'evaluate_scenarios':
+            return [self.statistics_file, self.target_file] + self.lst_scenarios + \
+                ([self.projected_statistics_file] if self.lst_projection_years else [])
+        elif stage == 'find_candidates':
+            return [self.fc_resultant, self.statistics_file, self.target_file]
+        elif stage == 'create_report':
+            return [self.statistics_file, self.target_file, self.mxd_template, self.fc_lu, self.fc_resultant,
+                    self.fc_beo, self.fc_ogma]
+        return []
+
+    def stage_params(self, stage):
+        if stage == 'prepare_data':
+            self.connect()
+            return {'tsa': self.tsa, 'corridor': self.bl_corridor, 'bio_options': self.lst_bio_options,
+                    'backend': self.backend.name, 'simplify_tolerance': self.simplify_tolerance,
+                    'grid_size': self.grid_size,
+                    'resource_plans': sorted(self.dict_resource_plans.keys()),
+                    'sources': [[src, self.__dict_source_data[src].path, self.__dict_source_data[src].sql,
+                                 self.__dict_source_data[src].data_type] for src in self.__dict_source_data]}
+        elif stage == 'simplify_sources':
+            return {'backend': self.backend.name, 'simplify_tolerance': self.simplify_tolerance,
+                    'grid_size': self.grid_size}
+        elif stage in ('create_aoi', 'identity_aoi'):
+            return {'backend': self.backend.name}
+        elif stage == 'refresh_resultant':
+            return self.refresh_params()
+        elif stage == 'update_attributes':
+            return {'tsa': self.tsa, 'as_of': self.dt_as_of.strftime('%Y-%m-%d'),
+                    'age_class_breaks': self.lst_age_class_breaks, 'projection_years': self.lst_projection_years,
+                    'parquet': self.parquet}
+        elif stage == 'raster_statistics':
+            return {'tsa': self.tsa, 'corridor': self.bl_corridor, 'raster_cell': self.raster_cell,
+                    'as_of': self.dt_as_of.strftime('%Y-%m-%d'), 'age_class_breaks': self.lst_age_class_breaks,
+                    'projection_years': self.lst_projection_years}
+        elif stage == 'build_statistics':
+            return {'tsa': self.tsa, 'corridor': self.bl_corridor, 'projection_years': self.lst_projection_years}
+        elif stage in ('evaluate_scenarios', 'find_candidates', 'create_report'):
+            return {'tsa': self.tsa, 'corridor': self.bl_corridor}
+        return {}
+
+    def stage_outputs(self, stage):
+        if stage == 'prepare_data':
+            return [self.fc_lu, self.fc_lr_plans, self.fc_beo] + [self.dict_resultant_data[fc].path
+                                                                  for fc in self.dict_resultant_data]
+        elif stage == 'simplify_sources':
+            return [self.dict_resultant_data[fc].path for fc in self.dict_resultant_data
+                    if self.dict_resultant_data[fc].data_type in ('ADD', 'REMOVE')] + [self.simplify_report_file]
+        elif stage == 'create_aoi':
+            return [self.fc_aoi]
+        elif stage == 'identity_aoi':
+            return [self.fc_resultant]
+        elif stage == 'update_attributes':
+            return [self.fc_resultant] + ([self.parquet_index_file] if self.parquet else [])
+        elif stage == 'refresh_resultant':
+            return [self.fc_aoi, self.fc_resultant, self.snapshot_file] + \
+                ([self.parquet_index_file] if self.parquet else [])
+        elif stage == 'raster_statistics':
+            return [self.raster_statistics_file, self.raster_report_file]
+        elif stage == 'build_statistics':
+            return [self.statistics_file, self.statistics_source_file] + \
+                ([self.projected_statistics_file] if self.lst_projection_years else [])
+        elif stage == 'evaluate_scenarios':
+            return [self.scenario_report_file]
+        elif stage == 'find_candidates':
+            return [self.fc_candidates, self.candidate_report_file]
+        elif stage == 'create_report':
+            return self.lst_report_files
+        return []
+
+    def stage_state(self, stage):
+        if stage == 'prepare_data':
+            return {'lu_names': self.lst_lu_names, 'lu_numbers': self.lst_lu_numbers,
+                    'resultant_data': [[fc, self.dict_resultant_data[fc].path, self.dict_resultant_data[fc].data_type]
+                                       for fc in self.dict_resultant_data]}
+        elif stage == 'refresh_resultant':
+            return {'dirty_lus': self.lst_dirty_lus, 'snapshot_before': self.str_snapshot_before}
+        return {}
+
+    def restore_stage(self, stage, dict_state):
+        if stage == 'prepare_data':
+            self.lst_lu_names = dict_state['lu_names']
+            self.lst_lu_numbers = dict_state['lu_numbers']
+            self.dict_resultant_data = defaultdict(OgmaInput)
+            for fc, path, data_type in dict_state['resultant_data']:
+                self.dict_resultant_data[fc].path = path
+                self.dict_resultant_data[fc].data_type = data_type
+        elif stage == 'refresh_resultant':
+            self.lst_dirty_lus = dict_state['dirty_lus']
+            self.str_snapshot_before = dict_state.get('snapshot_before')
+        elif stage == 'build_statistics':
+            with open(self.statistics_file, 'rb') as f:
+                self.ogma_statistics = pickle.load(f)
+            if self.lst_projection_years:
+                with open(self.projected_statistics_file, 'rb') as f:
+                    self.dict_projected_statistics = pickle.load(f)
 
     def prepare_data(self):
+        self.connect()
+        # Steps that do not depend on each other run concurrently, up to the configured number of workers
+        scheduler = OGMAScheduler(workers=self.workers, logger=self.logger)
+        scheduler.add_node('landscape units', self.select_landscape_units)
+        lst_copy_deps = ['landscape units']
+        if self.copy_processes > 1:
+            scheduler.add_node('read sources', self.read_sources, lst_deps=['landscape units'])
+            lst_copy_deps.append('read sources')
+        scheduler.add_node('lr plans', self.select_lr_plans)
+        scheduler.add_node('targets', self.build_targets)
+
+        lst_sources = list(self.source_data().keys())
+        # Keys are created up front so overlay order in create_aoi and identity_aoi does not depend on which copy
+        # finishes first
+        self.dict_resultant_data = defaultdict(OgmaInput)
+        for src in lst_sources + ['ogma', 'operability']:
+            self.dict_resultant_data[src].path = None
+        for src in lst_sources:
+            scheduler.add_node('copy {}'.format(src), lambda src=src: self.copy_source(src), lst_deps=lst_copy_deps)
+
+        scheduler.add_node('beo', self.build_beo, lst_deps=['copy bec', 'landscape units'])
+        scheduler.add_node('ogma', self.combine_ogma,
+                           lst_deps=['copy {}'.format(src) for src in lst_sources if 'ogma' in src])
+        scheduler.add_node('operability', self.combine_operability,
+                           lst_deps=['copy {}'.format(src) for src in lst_sources if 'operability' in src])
+        scheduler.add_node('reversions', self.remove_reversions,
+                           lst_deps=['copy private land', 'copy crown reversions'])
+        if self.bl_corridor:
+            scheduler.add_node('corridors', self.erase_corridor_slope,
+                               lst_deps=['copy connectivity corridors', 'copy slope'])
 
+        try:
+            scheduler.run()
+        finally:
+            if self.copy_pool:
+                self.copy_pool.shutdown()
+                self.copy_pool = None
+                shutil.rmtree(self.staging_dir, ignore_errors=True)
+            self.dict_copies = {}
+        scheduler.report(report_file=os.path.join(self.data_dir, 'prepare_data_critical_path.txt'))
+
+    def read_sources(self):
+        # Starts reading every source on the worker processes as soon as the extent is known; the copy steps then
+        # only wait for their source and copy it into out_gdb
+        self.staging_dir = tempfile.mkdtemp(prefix='ogma_sources_', dir=self.scratch.local_dir)
+        extent = arcpy.env.extent
+        self.copy_pool = ProcessPoolExecutor(max_workers=self.copy_processes)
+        for src in self.source_data():
+            self.dict_copies[src] = self.copy_pool.submit(
+                copy_source_process, in_features=self.__dict_source_data[src].path,
+                where_clause=self.__dict_source_data[src].sql,
+                staging_gdb=os.path.join(self.staging_dir, '{}.gdb'.format(src.replace(' ', '_'))),
+                extent=(extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+
+    def select_landscape_units(self):
         self.logger.info('Extracting landscape units')
-        lyr_tsa = arcpy.MakeFeatureLayer_management(in_features=self.__timber_supply_areas, out_layer='lyr_tsa',
-                                                    where_clause='(TSA_NUMBER IN (\'22\', \'27\', \'07\') AND '
-                                                                 'TSB_NUMBER IS NULL OR '
-                                                                 'COMMENTS = \'Cascadia TSA Block 4\') AND '
-                                                                 'TSA_NUMBER_DESCRIPTION = \'{} TSA\''.format(self.tsa))
-
-        lu_where_clause = '{0} IN ({1})'.format(self.fld_lu_bio,
-                                                ','.join('\'{0}\''.format(bio) for bio in self.lst_bio_options))
-
-        lyr_lu = arcpy.MakeFeatureLayer_management(in_features=self.__landscape_unit, out_layer='lyr_lu',
-                                                   where_clause=lu_where_clause)
-
-        lyr_oa = arcpy.MakeFeatureLayer_management(in_features=self.__operating_areas, out_layer='lyr_oa',
-                                                   where_clause='ORG_UNIT_CODE = \'TOC\'')
-
-        arcpy.SelectLayerByLocation_management(in_layer=lyr_oa, overlap_type='HAVE_THEIR_CENTER_IN',
-                                               select_features=lyr_tsa, selection_type='NEW_SELECTION')
-
-        arcpy.SelectLayerByLocation_management(in_layer=lyr_lu, overlap_type='INTERSECT',
-                                               select_features=lyr_oa, selection_type='NEW_SELECTION',
-                                               search_distance='-1000 METERS')
-        arcpy.SelectLayerByLocation_management(in_layer=lyr_lu, overlap_type='CONTAINS',
-                                               select_features=lyr_oa, selection_type='ADD_TO_SELECTION')
-
-        self.lst_lu_names = sorted(list(set([row[0] for row in arcpy.da.SearchCursor(lyr_lu, self.fld_lu_name)])))
-        self.lst_lu_numbers = sorted(list(set(['{}P'.format(row[0])
-                                               for row in arcpy.da.SearchCursor(lyr_lu, self.fld_lu_number)])))
-
-        lu_where_clause = '({0} IN ({1}) AND {2} IN ({3})) OR ({0} = \'NA\' AND {4} IN ({5}))' \
-            .format(self.fld_lu_bio, ','.join('\'{0}\''.format(bio) for bio in self.lst_bio_options), self.fld_lu_name,
-                    ','.join('\'{0}\''.format(lu) for lu in self.lst_lu_names), self.fld_lu_number,
-                    ','.join('\'{0}\''.format(num) for num in self.lst_lu_numbers))
-
-        arcpy.Select_analysis(in_features=self.__landscape_unit, out_feature_class=self.fc_lu,
-                              where_clause=lu_where_clause)
-
-        arcpy.Delete_management(in_data=lyr_lu)
-
-        lyr_lu = arcpy.MakeFeatureLayer_management(in_features=self.fc_lu, out_layer='lyr_lu')
-
-        with arcpy.da.SearchCursor(lyr_tsa, 'SHAPE@') as s_cursor:
-            for row in s_cursor:
-                tsa_geom = row[0]
-
-        with arcpy.da.UpdateCursor(self.fc_lu, 'SHAPE@') as u_cursor:
-            for row in u_cursor:
-                if tsa_geom.disjoint(row[0]):
-                    u_cursor.deleteRow()
-
-        arcpy.RecalculateFeatureClassExtent_management(in_features=self.fc_lu)
-
-        arcpy.Delete_management(in_data=lyr_tsa)
-        arcpy.Delete_management(in_data=lyr_lu)
-        arcpy.Delete_management(in_data=lyr_oa)
-
+        lst_ids = self.resolve_landscape_units()
+        with self.profiler.trace('select landscape units', out_features=self.fc_lu):
+            self.backend.select(in_features=self.__landscape_unit, out_features=self.fc_lu, lst_ids=lst_ids)
+
+        self.backend.set_extent(self.fc_lu)
+
+    def resolve_landscape_units(self):
+        # Feature ids of the landscape units of the TSA: those near or containing an operating area centred in the
+        # TSA, the parks inside them and nothing disjoint from the TSA. All three layers are read once and the
+        # predicates evaluated in bulk on spatial indexes
+        self.connect()
+        tsa_where_clause = '(TSA_NUMBER IN (\'22\', \'27\', \'07\') AND TSB_NUMBER IS NULL OR ' \
+                           'COMMENTS = \'Cascadia TSA Block 4\') AND ' \
+                           'TSA_NUMBER_DESCRIPTION = \'{} TSA\''.format(self.tsa)
+        lst_lu_fields = [self.fld_lu_name, self.fld_lu_number, self.fld_lu_bio]
+
+        with self.profiler.trace('read tsa, operating area and landscape unit geometries'):
+            tsa = OGMASpatialLayer.from_rows(self.backend.geometries(in_features=self.__timber_supply_areas,
+                                                                     lst_fields=[], where_clause=tsa_where_clause),
+                                             lst_fields=[])
+            oa = OGMASpatialLayer.from_rows(self.backend.geometries(in_features=self.__operating_areas,
+                                                                    lst_fields=[],
+                                                                    where_clause='ORG_UNIT_CODE = \'TOC\''),
+                                            lst_fields=[])
+            lu = OGMASpatialLayer.from_rows(self.backend.geometries(in_features=self.__landscape_unit,
+                                                                    lst_fields=lst_lu_fields),
+                                            lst_fields=lst_lu_fields)
+
+        with self.profiler.trace('resolve landscape units'):
+            oa = oa.subset(tsa.hits(oa.centres(), predicate='intersects'))
+            bio = np.isin(lu.values(self.fld_lu_bio), self.lst_bio_options)
+            selected = bio & (oa.buffer(-1000).hits(lu.geoms, predicate='intersects') |
+                              oa.hits(lu.geoms, predicate='contains'))
+            self.lst_lu_names = sorted(set(name for name in lu.values(self.fld_lu_name)[selected] if name))
+            self.lst_lu_numbers = sorted(set('{}P'.format(num) for num in lu.values(self.fld_lu_number)[selected]
+                                             if num))
+
+            # Parks carry the emphasis option NA and the number of their landscape unit with a P suffix
+            selected = (bio & np.isin(lu.values(self.fld_lu_name), self.lst_lu_names)) | \
+                (np.array([value == 'NA' for value in lu.values(self.fld_lu_bio)], dtype=bool) &
+                 np.isin(lu.values(self.fld_lu_number), self.lst_lu_numbers))
+            selected &= tsa.hits(lu.geoms, predicate='intersects')
+        return lu.ids(selected)
+
+    def list_landscape_units(self):
+        # Dry run of the landscape unit selection, nothing is copied or written
+        lst_ids = self.resolve_landscape_units()
+        lst_rows = sorted(set(self.backend.values(in_features=self.__landscape_unit,
+                                                  lst_fields=[self.fld_lu_name, self.fld_lu_number],
+                                                  lst_ids=lst_ids)), key=lambda row: [str(v) for v in row])
+        self.logger.info('{} TSA: {} landscape units'.format(self.tsa, len(lst_rows)))
+        for lu_name, lu_number in lst_rows:
+            self.logger.info('    {} {}'.format(lu_number, lu_name))
+
+    def select_lr_plans(self):
         self.logger.info('Selecting out land resource plans')
         where_clause = '{0} IN ({1})'.format(self.fld_lr_name, ','.join(
             '\'{0}\''.format(lr) for lr in self.dict_resource_plans.keys()))
 
-        arcpy.Select_analysis(in_features=self.__land_resource_plans, out_feature_class=self.fc_lr_plans,
-                              where_clause=where_clause)
+        with self.profiler.trace('select lr plans', out_features=self.fc_lr_plans):
+            self.backend.select(in_features=self.__land_resource_plans, out_features=self.fc_lr_plans,
+                                where_clause=where_clause)
 
-        arcpy.env.extent = arcpy.Describe(value=self.fc_lu).extent
-
-        for src in self.__dict_source_data:
-            if src in ['connectivity corridors', 'slope'] and not self.bl_corridor:
-                continue
-            self.logger.info('Copying {0}'.format(src))
-            fc_out = os.path.join(self.out_gdb, src.replace(' ', '_'))
-            if not self.__dict_source_data[src].sql:
-                arcpy.CopyFeatures_management(in_features=self.__dict_source_data[src].path, out_feature_class=fc_out)
+    def copy_source(self, src):
+        self.logger.info('Copying {0}'.format(src))
+        fc_out = os.path.join(self.out_gdb, src.replace(' ', '_'))
+        with self.profiler.trace('copy {}'.format(src), out_features=fc_out):
+            if src in self.dict_copies:
+                self.backend.copy(in_features=self.dict_copies[src].result(), out_features=fc_out)
             else:
-                arcpy.Select_analysis(in_features=self.__dict_source_data[src].path, out_feature_class=fc_out,
-                                      where_clause=self.__dict_source_data[src].sql)
-            self.dict_resultant_data[src].path = fc_out
-            self.dict_resultant_data[src].data_type = self.__dict_source_data[src].data_type
-            if src == 'bec':
-                beo_temp = '{}_temp'.format(self.fc_beo)
-                # arcpy.CalculateField_management(in_table=fc_out, field=self.fld_zone,
-                #                                 expression="(!{}! if !{}! is not None else '') + (!{}! if !{}! is not None else '') + (!{}! if !{}! is not None else '')".format(self.fld_zone, self.fld_zone, self.fld_subzone, self.fld_subzone, self.fld_variant, self.fld_variant),
-                #                                 expression_type="PYTHON")
-                arcpy.Dissolve_management(in_features=fc_out, out_feature_class=beo_temp,
-                                          dissolve_field=[self.fld_nat_dist, self.fld_zone], multi_part='SINGLE_PART')
-                arcpy.Intersect_analysis(in_features=[beo_temp, self.fc_lu], out_feature_class=self.fc_beo,
-                                         join_attributes='NO_FID')
-                arcpy.Delete_management(in_data=beo_temp)
-
-
+                self.backend.select(in_features=self.__dict_source_data[src].path, out_features=fc_out,
+                                    where_clause=self.__dict_source_data[src].sql)
+        self.dict_resultant_data[src].path = fc_out
+        self.dict_resultant_data[src].data_type = self.__dict_source_data[src].data_type
+
+    def build_beo(self):
+        self.logger.info('Building biodiversity emphasis options')
+        # arcpy.CalculateField_management(in_table=fc_out, field=self.fld_zone,
+        #                                 expression="(!{}! if !{}! is not None else '') + (!{}! if !{}! is not None else '') + (!{}! if !{}! is not None else '')".format(self.fld_zone, self.fld_zone, self.fld_subzone, self.fld_subzone, self.fld_variant, self.fld_variant),
+        #                                 expression_type="PYTHON")
+        bec = self.dict_resultant_data['bec'].path
+        # Dissolved polygons never span two natural disturbance types, so each type is dissolved and intersected with
+        # the landscape units on its own, concurrently, and the parts merged give the same polygons as the whole
+        lst_ndts = sorted(set(row[0] for row in self.backend.values(in_features=bec, lst_fields=[self.fld_nat_dist])),
+                          key=lambda value: (value is not None, value))
+        dict_outputs = OrderedDict((ndt, None) for ndt in lst_ndts)
+        scheduler = OGMAScheduler(workers=self.workers, logger=self.logger)
+        for ndt in lst_ndts:
+            scheduler.add_node('beo {}'.format(ndt), lambda ndt=ndt: dict_outputs.update({ndt: self.build_ndt_beo(
+                bec=bec, ndt=ndt)}))
+        with self.profiler.trace('dissolve bec and intersect landscape units', in_features=[bec, self.fc_lu],
+                                 out_features=self.fc_beo):
+            scheduler.run()
+            if dict_outputs:
+                self.backend.merge(lst_in_features=list(dict_outputs.values()), out_features=self.fc_beo)
+            else:
+                self.backend.intersect(lst_in_features=[bec, self.fc_lu], out_features=self.fc_beo)
+        for path in dict_outputs.values():
+            self.scratch.delete(path)
+
+    def build_ndt_beo(self, bec, ndt):
+        where_clause = '{} IS NULL'.format(self.fld_nat_dist) if ndt is None else \
+            '{} = \'{}\''.format(self.fld_nat_dist, str(ndt).replace('\'', '\'\''))
+        ndt_bec = self.scratch.path('ndt_bec', lst_inputs=[bec])
+        self.backend.select(in_features=bec, out_features=ndt_bec, where_clause=where_clause)
+        beo_temp = self.scratch.path('beo_temp', lst_inputs=[ndt_bec])
+        ndt_beo = self.scratch.path('ndt_beo', lst_inputs=[ndt_bec, self.fc_lu])
+        self.backend.dissolve(in_features=ndt_bec, out_features=beo_temp, lst_fields=[self.fld_nat_dist, self.fld_zone],
+                              multi_part='SINGLE_PART')
+        self.backend.intersect(lst_in_features=[beo_temp, self.fc_lu], out_features=ndt_beo)
+        # Feature id fields would be named after each part's scratch layer and not line up in the merge
+        lst_del_fields = [field for field in self.backend.list_fields(ndt_beo) if field.startswith('FID_')]
+        self.backend.delete_fields(in_features=ndt_beo, lst_fields=lst_del_fields)
+        self.scratch.delete(ndt_bec)
+        self.scratch.delete(beo_temp)
+        return ndt_beo
+
+    def combine_ogma(self):
         self.logger.info('Combining OGMA and MOGMA')
-        ogma_merge = os.path.join(self.out_gdb, 'ogma_merge')
         # ogma_dissolve = os.path.join(self.out_gdb, 'ogma')
         lst_ogmas = []
-        for fc in self.dict_resultant_data:
+        for fc in self.__dict_source_data:
             if 'ogma' in fc:
                 lst_ogmas.append(self.dict_resultant_data[fc].path)
         lst_ogmas.sort(reverse=True)
-        arcpy.Merge_management(inputs=lst_ogmas, output=ogma_merge)
-        arcpy.AddMessage("Dissolving: " + ogma_merge)
-        arcpy.Dissolve_management(in_features=ogma_merge, out_feature_class=self.fc_ogma, multi_part='SINGLE_PART')
-        arcpy.AddField_management(in_table=self.fc_ogma, field_name=self.fld_status, field_type='TEXT',
-                                  field_length=25)
-        with arcpy.da.UpdateCursor(self.fc_ogma, self.fld_status) as u_cursor:
-            for row in u_cursor:
-                row[0] = 'OGMA'
-                u_cursor.updateRow(row)
-
-        for fc in lst_ogmas + [ogma_merge]:
-            arcpy.Delete_management(in_data=fc)
-            if fc in self.dict_resultant_data:
-                del self.dict_resultant_data[fc]
+        ogma_merge = self.scratch.path('ogma_merge', lst_inputs=lst_ogmas)
+        with self.profiler.trace('merge ogma', in_features=lst_ogmas, out_features=ogma_merge):
+            self.backend.merge(lst_in_features=lst_ogmas, out_features=ogma_merge)
+        self.logger.info('Dissolving: {}'.format(ogma_merge))
+        with self.profiler.trace('dissolve ogma', in_features=ogma_merge, out_features=self.fc_ogma):
+            self.backend.dissolve(in_features=ogma_merge, out_features=self.fc_ogma, multi_part='SINGLE_PART')
+        with self.profiler.trace('ogma status', in_features=self.fc_ogma):
+            self.backend.add_field(in_features=self.fc_ogma, field_name=self.fld_status, field_type='TEXT',
+                                   field_length=25, value='OGMA')
+
+        for fc in lst_ogmas:
+            self.backend.delete(fc)
+        self.scratch.delete(ogma_merge)
         self.dict_resultant_data['ogma'].path = self.fc_ogma
         self.dict_resultant_data['ogma'].data_type = 'ADD'
 
+    def combine_operability(self):
         self.logger.info('Combining operability areas')
-        oper_merge = os.path.join(self.out_gdb, 'oper_merge')
         oper_dissolve = os.path.join(self.out_gdb, 'operability')
         lst_oper = []
-        for fc in self.dict_resultant_data:
+        for fc in self.__dict_source_data:
             if 'operability' in fc:
                 lst_oper.append(self.dict_resultant_data[fc].path)
         lst_oper.sort(reverse=True)
-        arcpy.Merge_management(inputs=lst_oper, output=oper_merge)
-        arcpy.Dissolve_management(in_features=oper_merge, out_feature_class=oper_dissolve, multi_part='SINGLE_PART')
-        arcpy.AddField_management(in_table=oper_dissolve, field_name=self.fld_operable,
-                                  field_type='TEXT', field_length=25)
-        with arcpy.da.UpdateCursor(oper_dissolve, self.fld_operable) as u_cursor:
-            for row in u_cursor:
-                row[0] = self.str_operable
-                u_cursor.updateRow(row)
-        for fc in lst_oper + [oper_merge]:
-            arcpy.Delete_management(in_data=fc)
-            if fc in self.dict_resultant_data:
-                del self.dict_resultant_data[fc]
+        oper_merge = self.scratch.path('oper_merge', lst_inputs=lst_oper)
+        with self.profiler.trace('merge operability', in_features=lst_oper, out_features=oper_merge):
+            self.backend.merge(lst_in_features=lst_oper, out_features=oper_merge)
+        with self.profiler.trace('dissolve operability', in_features=oper_merge, out_features=oper_dissolve):
+            self.backend.dissolve(in_features=oper_merge, out_features=oper_dissolve, multi_part='SINGLE_PART')
+        with self.profiler.trace('operable', in_features=oper_dissolve):
+            self.backend.add_field(in_features=oper_dissolve, field_name=self.fld_operable, field_type='TEXT',
+                                   field_length=25, value=self.str_operable)
+        for fc in lst_oper:
+            self.backend.delete(fc)
+        self.scratch.delete(oper_merge)
         self.dict_resultant_data['operability'].path = oper_dissolve
         self.dict_resultant_data['operability'].data_type = 'ADD'
 
+    def remove_reversions(self):
         self.logger.info('Removing reversions from private land')
-        p_lyr = arcpy.MakeFeatureLayer_management(in_features=self.dict_resultant_data['private land'].path,
-                                                  out_layer='p_lyr')
-        r_lyr = arcpy.MakeFeatureLayer_management(in_features=self.dict_resultant_data['crown reversions'].path,
-                                                  out_layer='r_lyr')
-
-        arcpy.SelectLayerByLocation_management(in_layer=p_lyr, overlap_type='HAVE_THEIR_CENTER_IN',
-                                               select_features=r_lyr, selection_type='NEW_SELECTION')
-
-        arcpy.DeleteFeatures_management(in_features=p_lyr)
-        arcpy.Delete_management(p_lyr)
-        arcpy.Delete_management(r_lyr)
-
-        if self.bl_corridor:
-            conn_slope = os.path.join(self.out_gdb, 'conn_slope')
-            e_obj = EraseFeatures(in_features=self.dict_resultant_data['connectivity corridors'].path,
-                                  erase_features=self.dict_resultant_data['slope'].path,
-                                  out_features=conn_slope, logger=self.logger, add_layer=False)
-            e_obj.erase_analysis()
-            del e_obj
-
-            arcpy.AddField_management(in_table=conn_slope, field_name=self.fld_corridor, field_type='TEXT',
-                                      field_length=5)
-            with arcpy.da.UpdateCursor(conn_slope, self.fld_corridor) as u_cursor:
-                for row in u_cursor:
-                    row[0] = 'YES'
-                    u_cursor.updateRow(row)
-
-            self.dict_resultant_data['connectivity corridors'].path = conn_slope
-            self.dict_resultant_data['connectivity corridors'].data_type = 'ADD'
+        private_land = self.dict_resultant_data['private land'].path
+        private_temp = self.scratch.path('private_temp', lst_inputs=[private_land])
+
+        with self.profiler.trace('delete private land in reversions', in_features=private_land):
+            lst_ids = self.backend.select_by_location(in_features=private_land, overlap_type='HAVE_THEIR_CENTER_IN',
+                                                      select_features=self.dict_resultant_data['crown reversions'].path)
+            self.backend.select(in_features=private_land, out_features=private_temp, lst_ids=lst_ids, invert=True)
+            self.backend.copy(in_features=private_temp, out_features=private_land)
+        self.scratch.delete(private_temp)
+
+    def erase_corridor_slope(self):
+        self.logger.info('Removing slopes over 80% from connectivity corridors')
+        corridors = self.dict_resultant_data['connectivity corridors'].path
+        slope = self.dict_resultant_data['slope'].path
+        conn_slope = self.scratch.path('conn_slope', lst_inputs=[corridors])
+
+        # Corridors are grouped into square tiles by their centre and each tile is erased against only the slope
+        # polygons touching its corridors. Corridors are not cut at tile edges and each one loses exactly the slope
+        # over it, so the merged tiles hold the same polygons a single erase of the whole layer gives
+        dict_tiles = defaultdict(list)
+        for batch in self.backend.batches(in_features=corridors, lst_fields=['OID@', 'SHAPE@X', 'SHAPE@Y'],
+                                          chunk_size=self.chunk_size):
+            for oid, x, y in zip(batch['OID@'].tolist(), batch['SHAPE@X'].tolist(), batch['SHAPE@Y'].tolist()):
+                dict_tiles[(int(math.floor(x / self.corridor_tile_size)),
+                            int(math.floor(y / self.corridor_tile_size)))].append(oid)
+        self.logger.info('Erasing slope from {:,} corridor tiles of {:,.0f} m'.format(len(dict_tiles),
+                                                                                        self.corridor_tile_size))
+
+        dict_outputs = OrderedDict((tile, None) for tile in sorted(dict_tiles))
+        scheduler = OGMAScheduler(workers=self.workers, logger=self.logger)
+        for tile in dict_outputs:
+            scheduler.add_node('corridor tile {} {}'.format(*tile),
+                               lambda tile=tile: dict_outputs.update({tile: self.erase_corridor_tile(
+                                   corridors=corridors, slope=slope, lst_ids=dict_tiles[tile])}))
+        with self.profiler.trace('erase slope from corridors', in_features=[corridors, slope],
+                                 out_features=conn_slope):
+            scheduler.run()
+            lst_outputs = [path for path in dict_outputs.values() if path]
+            if lst_outputs:
+                self.backend.merge(lst_in_features=lst_outputs, out_features=conn_slope)
+            else:
+                self.backend.erase(in_features=corridors, erase_features=slope, out_features=conn_slope)
+        for path in lst_outputs:
+            self.scratch.delete(path)
+
+        with self.profiler.trace('corridor', in_features=conn_slope):
+            self.backend.add_field(in_features=conn_slope, field_name=self.fld_corridor, field_type='TEXT',
+                                   field_length=5, value='YES')
+
+        # The erased corridors replace the copied ones so only one corridor layer is kept in the output
+        self.backend.copy(in_features=conn_slope, out_features=corridors)
+        self.scratch.delete(conn_slope)
+        self.dict_resultant_data['connectivity corridors'].data_type = 'ADD'
+
+    def erase_corridor_tile(self, corridors, slope, lst_ids):
+        tile_corridors = self.scratch.path('tile_corridors', lst_inputs=[], feature_count=len(lst_ids))
+        self.backend.select(in_features=corridors, out_features=tile_corridors, lst_ids=lst_ids)
+        lst_slope_ids = self.backend.select_by_location(in_features=slope, overlap_type='INTERSECT',
+                                                        select_features=tile_corridors)
+        tile_slope = self.scratch.path('tile_slope', lst_inputs=[], feature_count=len(lst_slope_ids))
+        tile_out = self.scratch.path('tile_conn_slope', lst_inputs=[tile_corridors], feature_count=len(lst_slope_ids))
+        if lst_slope_ids:
+            self.backend.select(in_features=slope, out_features=tile_slope, lst_ids=lst_slope_ids)
+            self.backend.erase(in_features=tile_corridors, erase_features=tile_slope, out_features=tile_out)
+        else:
+            self.backend.copy(in_features=tile_corridors, out_features=tile_out)
+        self.scratch.delete(tile_corridors)
+        self.scratch.delete(tile_slope)
+        return tile_out
+
+    def simplify_sources(self):
+        self.logger.info('Simplifying sources, tolerance {} m, grid {} m'.format(self.simplify_tolerance,
+                                                                                 self.grid_size))
+        lst_rows = []
+        # Only layers that take part in the overlay; the rest were merged away or consumed in prepare_data
+        for fc in [fc for fc in self.dict_resultant_data if self.dict_resultant_data[fc].data_type in ('ADD',
+                                                                                                       'REMOVE')]:
+            path = self.dict_resultant_data[fc].path
+            simplified = self.scratch.path('simplified', lst_inputs=[path])
+            with self.profiler.trace('simplify {}'.format(fc), in_features=path, out_features=simplified):
+                self.backend.simplify(in_features=path, out_features=simplified,
+                                      tolerance=self.simplify_tolerance, grid_size=self.grid_size)
+
+            # Vertices and area are compared per landscape unit on the part of the source inside each one
+            dict_summary = {}
+            for key, features in [('before', path), ('after', simplified)]:
+                lu_fc = self.scratch.path('simplify_lu', lst_inputs=[features])
+                with self.profiler.trace('summarize {} {}'.format(key, fc), in_features=features):
+                    self.backend.intersect(lst_in_features=[features, self.fc_lu], out_features=lu_fc)
+                    dict_summary[key] = self.backend.geometry_summary(in_features=lu_fc,
+                                                                      group_field=self.fld_lu_name)
+                self.scratch.delete(lu_fc)
+            for lu in sorted(set(dict_summary['before']) | set(dict_summary['after'])):
+                vertices_before, area_before = dict_summary['before'].get(lu, (0, 0))
+                vertices_after, area_after = dict_summary['after'].get(lu, (0, 0))
+                lst_rows.append([fc, lu, vertices_before, vertices_after,
+                                 round(100.0 * (vertices_before - vertices_after) / vertices_before, 2)
+                                 if vertices_before else 0,
+                                 round(area_before / 10000, 4), round(area_after / 10000, 4),
+                                 round(100.0 * (area_after - area_before) / area_before, 4) if area_before else 0])
+
+            vertices_before = sum(v[0] for v in dict_summary['before'].values())
+            vertices_after = sum(v[0] for v in dict_summary['after'].values())
+            self.logger.info('{}: {:,} to {:,} vertices'.format(fc, vertices_before, vertices_after))
+            self.backend.copy(in_features=simplified, out_features=path)
+            self.scratch.delete(simplified)
+
+        with open(self.simplify_report_file, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['SOURCE', 'LANDSCAPE_UNIT', 'VERTICES_BEFORE', 'VERTICES_AFTER', 'VERTEX_REDUCTION_PCT',
+                             'AREA_BEFORE_HA', 'AREA_AFTER_HA', 'AREA_DEVIATION_PCT'])
+            writer.writerows(lst_rows)
+        self.logger.info('Simplification report written to {}'.format(self.simplify_report_file))
 
     def create_aoi(self):
-        self.logger.info('Creating aoi')
-        temp_fc = os.path.join(self.out_gdb, 'temp_fc')
-
-        arcpy.CopyFeatures_management(in_features=self.fc_lu, out_feature_class=self.fc_aoi)
+        self.build_aoi(lu_features=self.fc_lu, out_features=self.fc_aoi)
 
+    def build_aoi(self, lu_features, out_features):
+        self.logger.info('Creating aoi')
+        # Each erase works from the previous one in scratch; only the finished aoi is written to the output
+        aoi = lu_features
         for fc in self.dict_resultant_data:
             if self.dict_resultant_data[fc].data_type == 'REMOVE':
                 # self.logger.info('Removing {}'.format(fc))
-                e_obj = EraseFeatures(in_features=self.fc_aoi, erase_features=self.dict_resultant_data[fc].path,
-                                      out_features=temp_fc, logger=self.logger, add_layer=False)
-                e_obj.erase_analysis()
-                del e_obj
-                arcpy.CopyFeatures_management(in_features=temp_fc, out_feature_class=self.fc_aoi)
-        arcpy.Delete_management(in_data=temp_fc)
+                temp_fc = self.scratch.path('aoi', lst_inputs=[aoi])
+                with self.profiler.trace('erase {}'.format(fc),
+                                         in_features=[aoi, self.dict_resultant_data[fc].path],
+                                         out_features=temp_fc):
+                    self.backend.erase(in_features=aoi, erase_features=self.dict_resultant_data[fc].path,
+                                       out_features=temp_fc)
+                if aoi != lu_features:
+                    self.scratch.delete(aoi)
+                aoi = temp_fc
+        self.backend.copy(in_features=aoi, out_features=out_features)
+        if aoi != lu_features:
+            self.scratch.delete(aoi)
 
     def identity_aoi(self):
-        self.logger.info('Adding features to aoi')
-        temp_fc = os.path.join(self.out_gdb, 'temp_fc')
-
-        arcpy.CopyFeatures_management(in_features=self.fc_aoi, out_feature_class=self.fc_resultant)
+        self.build_resultant(aoi=self.fc_aoi, out_features=self.fc_resultant)
 
+    def build_resultant(self, aoi, out_features):
+        self.logger.info('Adding features to aoi')
+        resultant = aoi
         for fc in self.dict_resultant_data:
             if self.dict_resultant_data[fc].data_type == 'ADD':
                 self.logger.info('Adding {}'.format(fc))
-                arcpy.Union_analysis(in_features=[self.fc_resultant, self.dict_resultant_data[fc].path],
-                                     out_feature_class=temp_fc)
-                arcpy.Select_analysis(in_features=temp_fc, out_feature_class=self.fc_resultant,
-                                      where_clause='FID_{} <> -1'.format(os.path.basename(self.fc_resultant)))
-                lst_del_fields = [field.name for field in arcpy.ListFields(self.fc_resultant)
-                                  if field.name.startswith('FID_')]
-                arcpy.Delete_management(in_data=temp_fc)
-                arcpy.DeleteField_management(in_table=self.fc_resultant, drop_field=lst_del_fields)
+                temp_fc = self.scratch.path('union', lst_inputs=[resultant, self.dict_resultant_data[fc].path])
+                with self.profiler.trace('union {}'.format(fc),
+                                         in_features=[resultant, self.dict_resultant_data[fc].path],
+                                         out_features=temp_fc):
+                    self.backend.union(lst_in_features=[resultant, self.dict_resultant_data[fc].path],
+                                       out_features=temp_fc)
+                union_fc = self.scratch.path('resultant', lst_inputs=[temp_fc])
+                with self.profiler.trace('select union {}'.format(fc), out_features=union_fc):
+                    self.backend.select(in_features=temp_fc, out_features=union_fc,
+                                        where_clause='FID_{} <> -1'.format(os.path.basename(resultant)))
+                lst_del_fields = [field for field in self.backend.list_fields(union_fc) if field.startswith('FID_')]
+                self.scratch.delete(temp_fc)
+                if resultant != aoi:
+                    self.scratch.delete(resultant)
+                self.backend.delete_fields(in_features=union_fc, lst_fields=lst_del_fields)
+                resultant = union_fc
+        with self.profiler.trace('copy resultant', in_features=resultant, out_features=out_features):
+            self.backend.copy(in_features=resultant, out_features=out_features)
+        if resultant != aoi:
+            self.scratch.delete(resultant)
+
+        # Slivers are merged into their neighbours and empty natural disturbance rows removed in place, only the
+        # affected polygons are rewritten
         self.logger.info('Cleaning up slivers')
-        result_lyr = arcpy.MakeFeatureLayer_management(in_features=self.fc_resultant, out_layer='result_lyr')
-        arcpy.SelectLayerByAttribute_management(in_layer_or_view=result_lyr, selection_type='NEW_SELECTION',
-                                                where_clause='Shape_Area <= 5')
-        arcpy.Eliminate_management(in_features=result_lyr, out_feature_class=temp_fc)
-        arcpy.CopyFeatures_management(in_features=temp_fc, out_feature_class=self.fc_resultant)
-        with arcpy.da.UpdateCursor(self.fc_resultant, self.fld_nat_dist) as u_cursor:
-            for row in u_cursor:
-                if row[0] == '':
-                    u_cursor.deleteRow()
-
-        arcpy.Delete_management(in_data=temp_fc)
-        arcpy.Delete_management(in_data=result_lyr)
-
-    def update_attributes(self):
+        with self.profiler.trace('merge slivers', in_features=out_features, out_features=out_features):
+            merged, dropped = self.backend.merge_slivers(in_features=out_features,
+                                                         where_clause='Shape_Area <= 5',
+                                                         drop_where_clause='{} = \'\''.format(self.fld_nat_dist))
+        self.logger.info('Merged {:,} slivers, removed {:,} polygons with empty {}'
+                         .format(merged, dropped, self.fld_nat_dist))
+
+    def read_resultant(self, lst_fields, where_clause=None, lst_lus=None, chunk_size=None):
+        # Streams the fields of resultant as NumPy record batches so memory stays bounded by the chunk size.
+        # lst_lus limits the read to those landscape unit names
+        if lst_lus:
+            lu_where_clause = '{} IN ({})'.format(self.fld_lu_name, ','.join('\'{}\''.format(lu.replace('\'', '\'\''))
+                                                                          for lu in lst_lus))
+            where_clause = '({}) AND {}'.format(where_clause, lu_where_clause) if where_clause else lu_where_clause
+        return self.backend.batches(in_features=self.fc_resultant, lst_fields=lst_fields,
+                                    chunk_size=chunk_size or self.chunk_size, where_clause=where_clause)
+
+    def update_attributes(self, in_features=None):
+        # An incremental refresh attributes only the rebuilt part of the resultant before it is spliced in
+        in_features = in_features or self.fc_resultant
         self.logger.info('Updating age and age class attributes')
-        arcpy.AddField_management(in_table=self.fc_resultant, field_name=self.fld_age, field_type='SHORT')
-        arcpy.AddField_management(in_table=self.fc_resultant, field_name=self.fld_age_class, field_type='SHORT')
-        arcpy.AddField_management(in_table=self.fc_resultant, field_name=self.fld_land_type, field_type='TEXT')
+        self.add_fields(in_features=in_features, lst_fields=[(self.fld_age, 'SHORT', None),
+                                                             (self.fld_age_class, 'SHORT', None),
+                                                             (self.fld_land_type, 'TEXT', None)])
         lst_fields = [self.fld_proj_age, self.fld_proj_date, self.fld_age, self.fld_age_class,
                       self.fld_cc_status, self.fld_cc_harvest_date]
-        str_lrp_name = ''
 
-        with arcpy.da.UpdateCursor(self.fc_resultant, lst_fields) as u_cursor:
-            for row in u_cursor:
-                if row[lst_fields.index(self.fld_proj_age)]:
-                    now = dt.now()
-                    proj_age = int(row[lst_fields.index(self.fld_proj_age)])
-                    proj_date = row[lst_fields.index(self.fld_proj_date)]
-                    cc_status = row[lst_fields.index(self.fld_cc_status)]
-                    cc_harvest_date = row[lst_fields.index(self.fld_cc_harvest_date)]
-                    if cc_status not in ('', self.str_reserve) and cc_harvest_date:
-                        try:
-                            proj_date = dt.strptime(cc_harvest_date, '%Y-%m-%d')
-                        except:
-                            proj_date = dt.strptime(cc_harvest_date, '%m/%d/%Y')
-                        proj_age = 0
-                    date_diff = relativedelta(now, proj_date)
-                    if date_diff.years < 0:
-                        date_diff.years = 0
-                        row[lst_fields.index(self.fld_age)] = date_diff.years
-                    else:
-                        row[lst_fields.index(self.fld_age)] = proj_age + date_diff.years
-                    row[lst_fields.index(self.fld_age_class)] = get_value_from_range(
-                        row[lst_fields.index(self.fld_age)],
-                        self.lst_age_class_breaks,
-                        self.lst_age_class)
-                u_cursor.updateRow(row)
-
-        self.logger.info('Determining land resource plan')
-        lu_lyr = arcpy.MakeFeatureLayer_management(in_features=self.fc_aoi, out_layer='lu_lyr')
-        lrp_lyr = arcpy.MakeFeatureLayer_management(in_features=self.fc_lr_plans, out_layer='lrp_lyr')
+        def update_age(fid, row):
+            if row[lst_fields.index(self.fld_proj_age)]:
+                now = self.dt_as_of
+                proj_age = int(row[lst_fields.index(self.fld_proj_age)])
+                proj_date = row[lst_fields.index(self.fld_proj_date)]
+                cc_status = row[lst_fields.index(self.fld_cc_status)]
+                cc_harvest_date = row[lst_fields.index(self.fld_cc_harvest_date)]
+                if cc_status not in ('', self.str_reserve) and cc_harvest_date:
+                    try:
+                        proj_date = dt.strptime(cc_harvest_date, '%Y-%m-%d')
+                    except:
+                        proj_date = dt.strptime(cc_harvest_date, '%m/%d/%Y')
+                    proj_age = 0
+                date_diff = relativedelta(now, proj_date)
+                if date_diff.years < 0:
+                    date_diff.years = 0
+                    row[lst_fields.index(self.fld_age)] = date_diff.years
+                else:
+                    row[lst_fields.index(self.fld_age)] = proj_age + date_diff.years
+                row[lst_fields.index(self.fld_age_class)] = get_value_from_range(
+                    row[lst_fields.index(self.fld_age)],
+                    self.lst_age_class_breaks,
+                    self.lst_age_class)
+            return row
 
-        arcpy.SelectLayerByLocation_management(in_layer=lrp_lyr, overlap_type='CONTAINS',
-                                               select_features=lu_lyr, selection_type='NEW_SELECTION')
-        lst_lr_names = [row[0] for row in arcpy.da.SearchCursor(lrp_lyr, self.fld_lr_name)]
-        for lr in lst_lr_names:
-            str_lrp_name = lr
+        with self.profiler.trace('cursor age', category='cursor', in_features=in_features):
+            self.backend.update_rows(in_features=in_features, lst_fields=lst_fields, update_row=update_age)
 
-        if self.fld_lr_name not in [field.name for field in arcpy.ListFields(self.fc_resultant)]:
-            arcpy.AddField_management(in_table=self.fc_resultant, field_name=self.fld_lr_name,
-                                      field_type='TEXT', field_length=75)
+        str_lrp_name = self.resource_plan_name(self.fc_aoi)
+        self.add_fields(in_features=in_features, lst_fields=[(self.fld_lr_name, 'TEXT', 75)])
 
         self.logger.info('Updating land type attributes')
-        str_np_query = '{0} = \'N\' OR ({0} = \'V\' AND {1} = \'N\')'.format(self.fld_bclcs_1, self.fld_bclcs_2)
-        lst_cursor_fields = [self.fld_land_type, self.fld_bclcs_1, self.fld_bclcs_2, self.fld_bclcs_3,
-                             self.fld_bclcs_4, self.fld_fmlb_ind, self.fld_line_7b, self.fld_crown_closure,
-                             self.fld_cc_status, self.fld_age, self.fld_line_activity, self.fld_status,
-                             self.fld_operable, self.fld_age_class, self.fld_lr_name]
-
-        with arcpy.da.UpdateCursor(self.fc_resultant, lst_cursor_fields) as u_cursor:
-            for row in u_cursor:
-                index_ltype = lst_cursor_fields.index(self.fld_land_type)
-                bclcs_1 = row[lst_cursor_fields.index(self.fld_bclcs_1)]
-                bclcs_2 = row[lst_cursor_fields.index(self.fld_bclcs_2)]
-                bclcs_3 = row[lst_cursor_fields.index(self.fld_bclcs_3)]
-                bclcs_4 = row[lst_cursor_fields.index(self.fld_bclcs_4)]
-                fmlb_ind = row[lst_cursor_fields.index(self.fld_fmlb_ind)]
-                line7b = row[lst_cursor_fields.index(self.fld_line_7b)]
-                crown_closure = row[lst_cursor_fields.index(self.fld_crown_closure)]
-                age = row[lst_cursor_fields.index(self.fld_age)]
-                cc_status = row[lst_cursor_fields.index(self.fld_cc_status)]
-                line_activity = row[lst_cursor_fields.index(self.fld_line_activity)]
-                status = row[lst_cursor_fields.index(self.fld_status)]
-                operable = row[lst_cursor_fields.index(self.fld_operable)]
-
-                # Extract harvested
-                if (age == 0 and cc_status != self.str_reserve) or (not age and line_activity == '$'):
-                    row[index_ltype] = self.str_harvest
-                    row[lst_cursor_fields.index(self.fld_age)] = 0
-                    row[lst_cursor_fields.index(self.fld_age_class)] = 0
-
-                # Extract non productive
-                elif bclcs_1 == 'N' or \
-                        (bclcs_2 == 'N' and bclcs_4 not in ('ST', 'SL')) or \
-                        (bclcs_2 == 'N' and bclcs_3 == 'W') or \
-                        bclcs_3 == 'A' or \
-                        (fmlb_ind == 'N' and (line7b and not line7b.startswith('L'))) or \
-                        (bclcs_2 == 'T' and bclcs_3 == 'W') or \
-                        (bclcs_4 in ('ST', 'SL') and not (line7b and not line7b.startswith('L'))):
-                    row[index_ltype] = self.str_np
-
-                # Extract forested
-                elif age > 0 or cc_status == self.str_reserve:
-                    row[index_ltype] = self.str_forest
-
-                if status == '':
-                    row[lst_cursor_fields.index(self.fld_status)] = 'NON-OGMA'
-                if operable == '':
-                    row[lst_cursor_fields.index(self.fld_operable)] = 'INOPERABLE'
-
-                row[lst_cursor_fields.index(self.fld_lr_name)] = str_lrp_name
-
-                u_cursor.updateRow(row)
-
-        try:
-            arcpy.AddField_management(in_table=self.fc_resultant, field_name=self.fld_age_type,
-                                      field_type='TEXT', field_length=10)
-        except Exception as e:
-            pass
+        # Land types are classified a batch at a time from the rule table, the cursor only writes them back
+        land_type_rules = self.land_type_rules()
+        dict_land_type = {}
+        with self.profiler.trace('classify land type', category='cursor', in_features=in_features):
+            for batch in self.backend.batches(in_features=in_features, lst_fields=['OID@'] + land_type_rules.lst_fields,
+                                              chunk_size=self.chunk_size):
+                dict_land_type.update(zip(batch['OID@'].tolist(), land_type_rules.classify(batch).tolist()))
+
+        lst_update_fields = [self.fld_land_type, self.fld_age, self.fld_age_class, self.fld_status, self.fld_operable,
+                             self.fld_lr_name]
+
+        def update_land_type(fid, row):
+            # The backend joins on the same feature ids its batches read
+            land_type = dict_land_type[fid]
+            if land_type:
+                row[lst_update_fields.index(self.fld_land_type)] = land_type
+            if land_type == self.str_harvest:
+                row[lst_update_fields.index(self.fld_age)] = 0
+                row[lst_update_fields.index(self.fld_age_class)] = 0
+
+            if row[lst_update_fields.index(self.fld_status)] == '':
+                row[lst_update_fields.index(self.fld_status)] = 'NON-OGMA'
+            if row[lst_update_fields.index(self.fld_operable)] == '':
+                row[lst_update_fields.index(self.fld_operable)] = 'INOPERABLE'
+
+            row[lst_update_fields.index(self.fld_lr_name)] = str_lrp_name
+            return row
+
+        with self.profiler.trace('cursor land type', category='cursor', in_features=in_features):
+            self.backend.update_rows(in_features=in_features, lst_fields=lst_update_fields,
+                                     update_row=update_land_type)
+
+        lst_year_fields = [field for years in self.lst_projection_years for field in self.projection_fields(years)]
+        self.add_fields(in_features=in_features, lst_fields=[(self.fld_age_type, 'TEXT', 10)] + [
+            (field, field_type, field_length) for years in self.lst_projection_years
+            for field, field_type, field_length in zip(self.projection_fields(years), ['SHORT', 'SHORT', 'TEXT'],
+                                                       [None, None, 10])])
 
         if not self.ogma_targets:
             self.build_targets()
 
+        # The age type now and the age, age class and age type in each projection year are computed a batch at a
+        # time; the cursor only writes them back
         self.logger.info('Calculating age class type')
-        lst_fields = [self.fld_nat_dist, self.fld_zone, self.fld_lu_bio, self.fld_age_class,
-                      self.fld_age_type, self.fld_land_type, self.fld_lu_number]
         lr_plan = self.dict_resource_plans[str_lrp_name]
-        with arcpy.da.UpdateCursor(self.fc_resultant, lst_fields) as u_cursor:
-            for row in u_cursor:
-                mature_age_class = None
-                old_age_class = None
-                ac_type = None
-                ndt = row[lst_fields.index(self.fld_nat_dist)]
-                bec = row[lst_fields.index(self.fld_zone)]
-                beo = str(row[lst_fields.index(self.fld_lu_bio)]).upper()
-                if beo == 'NA':
-                    beo = 'HIGH'
-                ac = row[lst_fields.index(self.fld_age_class)]
-                land_type = row[lst_fields.index(self.fld_land_type)]
-                lu_number = row[lst_fields.index(self.fld_lu_number)]
-                beo_target = self.ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[bec].bio_opt[beo]
-                if beo_target.mature.age:
-                    mature_age_class = get_value_from_range(num=beo_target.mature.age + 1,
-                                                            lst_breaks=self.lst_age_class_breaks,
-                                                            lst_results=self.lst_age_class)
-                if self.tsa == 'Golden' and 'G27' not in lu_number:
-                    mature_age_class = None
-
-                if beo_target.old.age:
-                    old_age_class = get_value_from_range(num=beo_target.old.age + 1,
-                                                         lst_breaks=self.lst_age_class_breaks,
-                                                         lst_results=self.lst_age_class)
-
-                if land_type in [self.str_forest, self.str_harvest]:
-                    if ac < 3:
-                        ac_type = 'EARLY'
-                    elif mature_age_class and (3 <= ac < mature_age_class):
-                        ac_type = 'MID'
-                    elif not mature_age_class and (3 <= ac < old_age_class):
-                        ac_type = 'MID'
-                    elif (mature_age_class and old_age_class) and (mature_age_class <= ac < old_age_class):
-                        ac_type = 'MATURE'
-                    elif old_age_class and ac >= old_age_class:
-                        ac_type = 'OLD'
-                    else:
-                        ac_type = None
-
-                row[lst_fields.index(self.fld_age_type)] = ac_type
-
-                u_cursor.updateRow(row)
+        age_type_rules = self.age_type_rules()
+        lst_read_fields = ['OID@', self.fld_nat_dist, self.fld_zone, self.fld_lu_bio, self.fld_age, self.fld_age_class,
+                           self.fld_land_type, self.fld_lu_number]
+        dict_values = {}
+        with self.profiler.trace('classify age type', category='cursor', in_features=in_features):
+            for batch in self.backend.batches(in_features=in_features, lst_fields=lst_read_fields,
+                                              chunk_size=self.chunk_size):
+                mature, old = self.target_age_classes(batch=batch, lr_plan=lr_plan)
+                dict_columns = {'land_type': batch[self.fld_land_type], 'age_class': batch[self.fld_age_class],
+                                'mature': mature, 'old': old}
+                lst_columns = [age_type_rules.classify(dict_columns)]
+                for years in self.lst_projection_years:
+                    age = np.where(batch[self.fld_age] >= 0, batch[self.fld_age] + years, -1)
+                    dict_columns['age_class'] = get_classes_from_range(nums=age, lst_breaks=self.lst_age_class_breaks,
+                                                                       lst_results=self.lst_age_class)
+                    lst_columns += [age, dict_columns['age_class'], age_type_rules.classify(dict_columns)]
+                dict_values.update(zip(batch['OID@'].tolist(), zip(*[column.tolist() for column in lst_columns])))
+
+        with self.profiler.trace('cursor age type', category='cursor', in_features=in_features):
+            # -1 is a null age or age class
+            self.backend.update_rows(in_features=in_features, lst_fields=[self.fld_age_type] + lst_year_fields,
+                                     update_row=lambda fid, row: [None if value == -1 else value
+                                                                  for value in dict_values[fid]])
+
+        # A refresh exports the landscape units it rebuilt once they are spliced into the resultant
+        if self.parquet and in_features == self.fc_resultant:
+            self.export_resultant()
+
+    def resource_plan_name(self, aoi):
+        self.logger.info('Determining land resource plan')
+        str_lrp_name = ''
+        lst_ids = self.backend.select_by_location(in_features=self.fc_lr_plans, overlap_type='CONTAINS',
+                                                  select_features=aoi)
+        lst_lr_names = [row[0] for row in self.backend.values(in_features=self.fc_lr_plans,
+                                                              lst_fields=[self.fld_lr_name], lst_ids=lst_ids)]
+        for lr in lst_lr_names:
+            str_lrp_name = lr
+        return str_lrp_name
+
+    def add_fields(self, in_features, lst_fields):
+        # Adds those of the (name, type, length) fields the layer does not have yet
+        lst_existing = self.backend.list_fields(in_features)
+        for field_name, field_type, field_length in lst_fields:
+            if field_name not in lst_existing:
+                self.backend.add_field(in_features=in_features, field_name=field_name, field_type=field_type,
+                                       field_length=field_length)
+
+    def export_resultant(self, lst_lu_numbers=None):
+        # Each landscape unit, and each park, is read and written on its own so memory stays bounded by the
+        # largest one. Without lst_lu_numbers every partition is rewritten
+        store = OGMAParquetStore(path=self.parquet_dir, partition_field=self.fld_lu_name, logger=self.logger)
+        where_clause = None
+        if lst_lu_numbers is None:
+            store.clear()
+        else:
+            where_clause = self.lu_where_clause(lst_lu_numbers)
+        lst_lus = sorted(set(row[0] for row in self.backend.values(in_features=self.fc_resultant,
+                                                                   lst_fields=[self.fld_lu_name],
+                                                                   where_clause=where_clause)))
+        self.logger.info('Exporting {} landscape units to {}'.format(len(lst_lus), self.parquet_dir))
+        for lu in lst_lus:
+            with self.profiler.trace('parquet {}'.format(lu), in_features=self.fc_resultant):
+                gdf = gpd.read_file(os.path.dirname(self.fc_resultant), layer=os.path.basename(self.fc_resultant),
+                                    where='{} = \'{}\''.format(self.fld_lu_name, lu.replace('\'', '\'\'')))
+                store.write(gdf=gdf, value=lu)
+        store.save()
+
+    def projection_fields(self, years):
+        return ['{}_{}'.format(field, years) for field in [self.fld_age, self.fld_age_class, self.fld_age_type]]
+
+    def target_age_classes(self, batch, lr_plan):
+        # Age classes at which each row's targets consider a stand mature and old, 0 where the targets set none.
+        # The targets are looked up once per natural disturbance, zone and emphasis option in the batch
+        ndt = np.asarray(batch[self.fld_nat_dist]).astype(np.str_)
+        bec = np.asarray(batch[self.fld_zone]).astype(np.str_)
+        beo = np.char.upper(np.asarray(batch[self.fld_lu_bio]).astype(np.str_))
+        beo[beo == 'NA'] = 'HIGH'
+        keys, inverse = np.unique(np.stack([ndt, bec, beo], axis=1), axis=0, return_inverse=True)
+        mature = np.zeros(len(keys), dtype=int)
+        old = np.zeros(len(keys), dtype=int)
+        for i, (key_ndt, key_bec, key_beo) in enumerate(keys.tolist()):
+            beo_target = self.ogma_targets.lr_plan[lr_plan].ndt[key_ndt].bec_zone[key_bec].bio_opt[key_beo]
+            if beo_target.mature.age:
+                mature[i] = get_value_from_range(num=beo_target.mature.age + 1, lst_breaks=self.lst_age_class_breaks,
+                                                 lst_results=self.lst_age_class)
+            if beo_target.old.age:
+                old[i] = get_value_from_range(num=beo_target.old.age + 1, lst_breaks=self.lst_age_class_breaks,
+                                              lst_results=self.lst_age_class)
+        mature = mature[inverse.reshape(-1)]
+        old = old[inverse.reshape(-1)]
+        if self.tsa == 'Golden':
+            mature[np.char.find(np.asarray(batch[self.fld_lu_number]).astype(np.str_), 'G27') < 0] = 0
+        return mature, old
+
+    def age_type_rules(self):
+        # Only forested and harvested land has an age type
+        def early(c):
+            return c['age_class'] < 3
+
+        def mid(c):
+            return (3 <= c['age_class']) & (((c['mature'] > 0) & (c['age_class'] < c['mature'])) |
+                                            ((c['mature'] == 0) & (c['age_class'] < c['old'])))
+
+        def mature(c):
+            return (c['mature'] > 0) & (c['old'] > 0) & (c['mature'] <= c['age_class']) & \
+                (c['age_class'] < c['old'])
+
+        def old(c):
+            return (c['old'] > 0) & (c['age_class'] >= c['old'])
+
+        rules = OGMARuleTable(lst_fields=['land_type', 'age_class', 'mature', 'old'])
+        rules.add_rule(None, lambda c: ~np.isin(c['land_type'], [self.str_forest, self.str_harvest]))
+        rules.add_rule('EARLY', early)
+        rules.add_rule('MID', mid)
+        rules.add_rule('MATURE', mature)
+        rules.add_rule('OLD', old)
+        return rules
+
+    def land_type_rules(self):
+        # Rules are tried in order and the first match decides the land type; rows no rule matches are left as they
+        # are. Columns are arrays, null text reads as '' and a null age as -1
+        def disturbed(c):
+            return (c[self.fld_line_7b] != '') & ~np.char.startswith(c[self.fld_line_7b], 'L')
+
+        def harvested(c):
+            return ((c[self.fld_age] == 0) & (c[self.fld_cc_status] != self.str_reserve)) | \
+                ((c[self.fld_age] <= 0) & (c[self.fld_line_activity] == '$'))
+
+        def non_productive(c):
+            shrub = np.isin(c[self.fld_bclcs_4], ['ST', 'SL'])
+            return (c[self.fld_bclcs_1] == 'N') | \
+                ((c[self.fld_bclcs_2] == 'N') & ~shrub) | \
+                ((c[self.fld_bclcs_2] == 'N') & (c[self.fld_bclcs_3] == 'W')) | \
+                (c[self.fld_bclcs_3] == 'A') | \
+                ((c[self.fld_fmlb_ind] == 'N') & disturbed(c)) | \
+                ((c[self.fld_bclcs_2] == 'T') & (c[self.fld_bclcs_3] == 'W')) | \
+                (shrub & ~disturbed(c))
+
+        def forested(c):
+            return (c[self.fld_age] > 0) | (c[self.fld_cc_status] == self.str_reserve)
+
+        rules = OGMARuleTable(lst_fields=[self.fld_bclcs_1, self.fld_bclcs_2, self.fld_bclcs_3, self.fld_bclcs_4,
+                                          self.fld_fmlb_ind, self.fld_line_7b, self.fld_cc_status, self.fld_age,
+                                          self.fld_line_activity])
+        rules.add_rule(self.str_harvest, harvested)
+        rules.add_rule(self.str_np, non_productive)
+        rules.add_rule(self.str_forest, forested)
+        return rules
+
+    def overlay_layers(self):
+        return OrderedDict((fc, self.dict_resultant_data[fc].path) for fc in self.dict_resultant_data
+                           if self.dict_resultant_data[fc].data_type in ('ADD', 'REMOVE'))
+
+    def refresh_params(self):
+        return {'tsa': self.tsa, 'backend': self.backend.name, 'corridor': self.bl_corridor,
+                'simplify_tolerance': self.simplify_tolerance, 'grid_size': self.grid_size,
+                'age_class_breaks': self.lst_age_class_breaks, 'projection_years': self.lst_projection_years,
+                'parquet': self.parquet, 'overlay': list(self.overlay_layers().keys()),
+                'targets': self.checkpoint.fingerprint(self.target_file), 'as_of_year': self.dt_as_of.year}
+
+    def lu_where_clause(self, lst_lu_numbers):
+        # Parks inside a landscape unit carry its number with a P suffix
+        lst_values = [value for num in lst_lu_numbers for value in (num, '{}P'.format(num))]
+        return '{} IN ({})'.format(self.fld_lu_number,
+                                   ','.join('\'{}\''.format(value) for value in lst_values) or '\'\'')
+
+    def refresh_resultant(self):
+        # Landscape units touched by a feature that was added, removed or edited since the snapshot are rebuilt and
+        # spliced into the resultant; everything else is kept as the last run left it
+        dict_layers = self.overlay_layers()
+        dict_params = self.refresh_params()
+        self.str_snapshot_before = self.incremental.manifest['id']
+        lst_dirty = self.dirty_landscape_units(dict_layers=dict_layers, dict_params=dict_params)
+
+        if lst_dirty is None:
+            self.logger.info('Building the whole resultant')
+            self.lst_dirty_lus = None
+            self.create_aoi()
+            self.identity_aoi()
+            self.update_attributes()
+        else:
+            # Untouched landscape units keep their ages, so the rebuilt ones are projected to the same date. The
+            # parameters hold the year, so a refresh in a later year rebuilds everything to the new date
+            self.dt_as_of = dt.strptime(self.incremental.manifest['as_of'], '%Y-%m-%d')
+            self.checkpoint.manifest['as_of'] = self.incremental.manifest['as_of']
+            self.lst_dirty_lus = lst_dirty
+            if lst_dirty:
+                self.splice_landscape_units(lst_dirty)
+            else:
+                self.logger.info('No source changed since the snapshot, the resultant is current')
+
+        dict_snapshot = OrderedDict([('landscape units', self.fc_lu), ('lr plans', self.fc_lr_plans)])
+        dict_snapshot.update(dict_layers)
+        with self.profiler.trace('snapshot sources'):
+            self.incremental.save(dict_layers=dict_snapshot, dict_params=dict_params,
+                                  as_of=self.dt_as_of.strftime('%Y-%m-%d'))
+
+    def dirty_landscape_units(self, dict_layers, dict_params):
+        # Returns the numbers of the landscape units to rebuild, or None when the whole resultant has to be built
+        if not (self.backend.exists(self.fc_resultant) and self.backend.exists(self.fc_aoi)):
+            return None
+        if not self.incremental.available(dict_params=dict_params,
+                                          lst_names=['landscape units', 'lr plans'] + list(dict_layers.keys())):
+            return None
+        for name, path in [('landscape units', self.fc_lu), ('lr plans', self.fc_lr_plans)]:
+            lst_new, lst_old = self.incremental.changed(name, path)
+            if lst_new or lst_old:
+                self.logger.info('{} changed since the snapshot'.format(name))
+                return None
+
+        lst_lu_ids = []
+        for name, path in dict_layers.items():
+            with self.profiler.trace('diff {}'.format(name), in_features=path):
+                lst_new, lst_old = self.incremental.changed(name, path)
+                self.logger.info('{}: {:,} added and {:,} removed features'.format(name, len(lst_new), len(lst_old)))
+                for features, lst_ids in [(path, lst_new), (self.incremental.snapshot(name), lst_old)]:
+                    if lst_ids:
+                        lst_lu_ids += self.backend.select_by_location(in_features=self.fc_lu, overlap_type='INTERSECT',
+                                                                      select_features=features, select_ids=lst_ids)
+
+        # Parks are rebuilt with the landscape unit they are in
+        lst_all = sorted(set(str(row[0]).rstrip('P') for row in
+                             self.backend.values(in_features=self.fc_lu, lst_fields=[self.fld_lu_number])))
+        lst_dirty = sorted(set(str(row[0]).rstrip('P') for row in
+                               self.backend.values(in_features=self.fc_lu, lst_fields=[self.fld_lu_number],
+                                                   lst_ids=sorted(set(lst_lu_ids)))))
+        self.logger.info('{} of {} landscape units changed'.format(len(lst_dirty), len(lst_all)))
+        if lst_dirty == lst_all:
+            return None
+        return lst_dirty
+
+    def splice_landscape_units(self, lst_lu_numbers):
+        self.logger.info('Rebuilding landscape units {}'.format(', '.join(lst_lu_numbers)))
+        where_clause = self.lu_where_clause(lst_lu_numbers)
+        lu_dirty = self.scratch.path('lu_dirty', lst_inputs=[self.fc_lu])
+        with self.profiler.trace('select changed landscape units', out_features=lu_dirty):
+            self.backend.select(in_features=self.fc_lu, out_features=lu_dirty, where_clause=where_clause)
+
+        # The overlay only needs the sources around the changed landscape units
+        self.backend.set_extent(lu_dirty)
+        aoi_dirty = self.scratch.path('aoi_dirty', lst_inputs=[lu_dirty])
+        # The rebuilt part of the resultant is taken to hold the changed landscape units' share of its features
+        share = self.backend.count(lu_dirty) / float(max(self.backend.count(self.fc_lu), 1))
+        resultant_dirty = self.scratch.path('resultant_dirty', lst_inputs=[],
+                                            feature_count=int(self.backend.count(self.fc_resultant) * share))
+        try:
+            self.build_aoi(lu_features=lu_dirty, out_features=aoi_dirty)
+            self.build_resultant(aoi=aoi_dirty, out_features=resultant_dirty)
+        finally:
+            self.backend.set_extent(self.fc_lu)
+
+        with self.profiler.trace('splice aoi', in_features=aoi_dirty, out_features=self.fc_aoi):
+            self.backend.replace_rows(in_features=self.fc_aoi, where_clause=where_clause, new_features=aoi_dirty)
+        self.update_attributes(in_features=resultant_dirty)
+        with self.profiler.trace('splice resultant', in_features=resultant_dirty, out_features=self.fc_resultant):
+            self.backend.replace_rows(in_features=self.fc_resultant, where_clause=where_clause,
+                                      new_features=resultant_dirty)
+        if self.parquet:
+            self.export_resultant(lst_lu_numbers)
+        for path in [lu_dirty, aoi_dirty, resultant_dirty]:
+            self.scratch.delete(path)
+
+    def raster_statistics(self):
+        # Approximate statistics from the sources burned onto a grid instead of overlaid. Each cell takes the
+        # attributes of the features covering its centre and is classified with the rules used on the resultant, so
+        # the cubes are those build_statistics makes, up to the cell size
+        self.logger.info('Building statistics on a {:g} m grid'.format(self.raster_cell))
+        if not self.ogma_targets:
+            self.build_targets()
+        lr_name = self.resource_plan_name(self.fc_lu)
+
+        lst_dates = [self.fld_proj_date, self.fld_cc_harvest_date]
+        lst_numbers = [self.fld_proj_age]
+        lst_text = [self.fld_lu_name, self.fld_lu_number, self.fld_nat_dist, self.fld_zone, self.fld_lu_bio,
+                    self.fld_status, self.fld_operable, self.fld_op_area, self.fld_cc_status, self.fld_bclcs_1,
+                    self.fld_bclcs_2, self.fld_bclcs_3, self.fld_bclcs_4, self.fld_fmlb_ind, self.fld_line_7b,
+                    self.fld_line_activity] + ([self.fld_corridor] if self.bl_corridor else [])
+        # Cells carry text as codes into the distinct values of each field, code 0 being ''. Only the distinct
+        # combinations of a tile are decoded, so no per cell array holds strings
+        dict_nulls = dict([(f, 0) for f in lst_text] + [(f, -1) for f in lst_numbers] +
+                          [(f, np.nan) for f in lst_dates])
+        dict_lookups = dict((f, np.array([''])) for f in lst_text)
+
+        # A field is taken from the first layer that has it, as the union keeps the first layer's field and
+        # suffixes the others
+        lst_layers = []
+        lst_remove = []
+        set_taken = set()
+        for name, path in [('landscape units', self.fc_lu)] + list(self.overlay_layers().items()):
+            if name in self.dict_resultant_data and self.dict_resultant_data[name].data_type == 'REMOVE':
+                lst_remove.append(self.read_layer(path, []))
+                continue
+            lst_existing = self.backend.list_fields(path)
+            lst_fields = [f for f in dict_nulls if f not in set_taken and f in lst_existing]
+            if not lst_fields and lst_layers:
+                continue
+            with self.profiler.trace('read {}'.format(name), in_features=path):
+                gdf = self.read_layer(path, lst_fields)
+                lst_layers.append((gdf, self.raster_values(gdf, lst_fields, lst_dates, lst_numbers, dict_lookups)))
+            set_taken.update(lst_fields)
+
+        grid = OGMARasterGrid(bounds=tuple(lst_layers[0][0].total_bounds), cell_size=self.raster_cell)
+        self.logger.info('{:,} by {:,} cells'.format(grid.width, grid.height))
+        dict_counts = OrderedDict((years, Counter()) for years in [None] + self.lst_projection_years)
+        with self.profiler.trace('rasterize and classify'):
+            for tile in grid.tiles():
+                lst_ids = [grid.burn(gdf, tile) for gdf, _ in lst_layers]
+                inside = lst_ids[0] >= 0
+                for gdf in lst_remove:
+                    inside &= grid.burn(gdf, tile) < 0
+                if not inside.any():
+                    continue
+                dict_columns = dict((f, np.full(int(inside.sum()), null)) for f, null in dict_nulls.items())
+                for (gdf, dict_values), ids in zip(lst_layers, lst_ids):
+                    for field, values in dict_values.items():
+                        dict_columns[field] = grid.gather(values, ids[inside], dict_nulls[field])
+                del lst_ids, inside
+                dict_columns, weights = self.distinct_cells(dict_columns=dict_columns, dict_lookups=dict_lookups,
+                                                            lst_dates=lst_dates, lst_numbers=lst_numbers)
+                self.count_cells(dict_columns=dict_columns, lr_name=lr_name, dict_counts=dict_counts,
+                                 weights=weights)
+
+        dict_cubes = OrderedDict()
+        lst_key_fields = [self.fld_lu_name, self.fld_lu_number, self.fld_nat_dist, self.fld_zone, self.fld_lu_bio,
+                          self.fld_status, self.fld_age_class, self.fld_land_type, self.fld_operable,
+                          self.fld_age_type, self.fld_op_area, self.fld_corridor]
+        for years, counts in dict_counts.items():
+            lst_rows = []
+            for key, count in sorted(counts.items()):
+                dict_row = dict(zip(lst_key_fields, key))
+                dict_row[self.fld_age_class] = int(dict_row[self.fld_age_class])
+                dict_row[self.fld_age_type] = dict_row[self.fld_age_type] or None
+                dict_row[self.fld_area] = count * grid.cell_area
+                dict_row[self.fld_lr_name] = lr_name
+                lst_rows.append(dict_row)
+            dict_cubes[years] = self.statistics_cube(lst_rows=lst_rows, fld_age_class=self.fld_age_class,
+                                                     fld_age_type=self.fld_age_type)
+
+        with open(self.raster_statistics_file, 'wb') as f:
+            pickle.dump(dict_cubes, f, pickle.HIGHEST_PROTOCOL)
+        self.raster_deviation(dict_cubes[None])
+
+    def read_layer(self, path, lst_fields):
+        return gpd.read_file(os.path.dirname(path), layer=os.path.basename(path), columns=lst_fields)
+
+    def raster_values(self, gdf, lst_fields, lst_dates, lst_numbers, dict_lookups):
+        # Attribute arrays indexed by feature position, with null numbers as the batches read them. Dates become whole
+        # years to the as of date, worked out once per distinct date. Text becomes int32 codes into the distinct
+        # values, which go in dict_lookups
+        dict_values = {}
+        for field in lst_fields:
+            if field in lst_dates:
+                dict_years = {}
+                for value in gdf[field].tolist():
+                    if value not in dict_years:
+                        dict_years[value] = self.years_since(value)
+                dict_values[field] = np.array([dict_years[value] for value in gdf[field].tolist()], dtype=float)
+            elif field in lst_numbers:
+                dict_values[field] = pd.to_numeric(gdf[field], errors='coerce').fillna(-1).astype(int).to_numpy()
+            else:
+                text = gdf[field].fillna('').astype(str).to_numpy().astype(np.str_)
+                # '' sorts first, so it is code 0
+                dict_lookups[field] = np.unique(np.append(text, ''))
+                dict_values[field] = np.searchsorted(dict_lookups[field], text).astype('int32')
+        return dict_values
+
+    @staticmethod
+    def distinct_cells(dict_columns, dict_lookups, lst_dates, lst_numbers):
+        # The distinct combinations of the cells' values, decoded, and the number of cells with each
+        lst_fields = list(dict_columns.keys())
+        # Missing dates are NaN, which np.unique would never consider equal
+        null_date = -1e9
+        values = np.column_stack([np.nan_to_num(dict_columns[f], nan=null_date) if f in lst_dates else
+                                  dict_columns[f] for f in lst_fields]).astype('float64')
+        keys, counts = np.unique(values, axis=0, return_counts=True)
+        dict_distinct = {}
+        for i, field in enumerate(lst_fields):
+            if field in lst_dates:
+                dict_distinct[field] = np.where(keys[:, i] == null_date, np.nan, keys[:, i])
+            elif field in lst_numbers:
+                dict_distinct[field] = keys[:, i].astype(int)
+            else:
+                dict_distinct[field] = dict_lookups[field][keys[:, i].astype(int)]
+        return dict_distinct, counts
+
+    def years_since(self, value):
+        if value is None or value != value or value == '':
+            return np.nan
+        if isinstance(value, str):
+            try:
+                value = dt.strptime(value, '%Y-%m-%d')
+            except:
+                value = dt.strptime(value, '%m/%d/%Y')
+        elif hasattr(value, 'to_pydatetime'):
+            value = value.to_pydatetime()
+        return relativedelta(self.dt_as_of, value).years
+
+    def count_cells(self, dict_columns, lr_name, dict_counts, weights):
+        # Ages, land types and age types of a tile's cells as update_attributes works them out for the resultant,
+        # counted by the statistics keys for now and each projection year. Each entry of the columns stands for
+        # weights cells
+        c = dict_columns
+        harvested = (c[self.fld_cc_status] != '') & (c[self.fld_cc_status] != self.str_reserve) & \
+            ~np.isnan(c[self.fld_cc_harvest_date])
+        years = np.where(harvested, c[self.fld_cc_harvest_date], c[self.fld_proj_date])
+        age = np.where(years < 0, 0, np.where(harvested, 0, c[self.fld_proj_age]) + np.nan_to_num(years))
+        c[self.fld_age] = np.where((c[self.fld_proj_age] > 0) & ~np.isnan(years), age, -1).astype(int)
+
+        land_type = self.land_type_rules().classify(c)
+        land_type = np.where(np.equal(land_type, None), '', land_type).astype(np.str_)
+        c[self.fld_age][land_type == self.str_harvest] = 0
+        mature, old = self.target_age_classes(batch=c, lr_plan=self.dict_resource_plans[lr_name])
+        status = np.where(c[self.fld_status] == '', 'NON-OGMA', c[self.fld_status])
+        operable = np.where(c[self.fld_operable] == '', 'INOPERABLE', c[self.fld_operable])
+        corridor = c[self.fld_corridor] if self.bl_corridor else np.full(len(land_type), '')
+        keep = np.isin(land_type, [self.str_forest, self.str_harvest])
+        age_type_rules = self.age_type_rules()
+
+        for years in dict_counts:
+            age = c[self.fld_age] if years is None else np.where(c[self.fld_age] >= 0, c[self.fld_age] + years, -1)
+            age_class = get_classes_from_range(nums=age, lst_breaks=self.lst_age_class_breaks,
+                                               lst_results=self.lst_age_class)
+            age_type = age_type_rules.classify({'land_type': land_type, 'age_class': age_class, 'mature': mature,
+                                                'old': old})
+            age_type = np.where(np.equal(age_type, None), '', age_type).astype(np.str_)
+            mask = keep & (age_class >= 0)
+            if not mask.any():
+                continue
+            keys, inverse = np.unique(np.stack([column[mask].astype(np.str_) for column in [
+                c[self.fld_lu_name], c[self.fld_lu_number], np.char.upper(c[self.fld_nat_dist]),
+                np.char.upper(c[self.fld_zone]), np.char.upper(c[self.fld_lu_bio]), status, age_class, land_type,
+                operable, age_type, c[self.fld_op_area], corridor]], axis=1), axis=0, return_inverse=True)
+            counts = np.bincount(inverse.reshape(-1), weights=weights[mask]).astype(int)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                dict_counts[years][tuple(key)] += count
+
+    def raster_deviation(self, raster_statistics):
+        # Area by landscape unit against the last vector statistics, when there are any
+        vector_statistics = None
+        if os.path.exists(self.statistics_file):
+            with open(self.statistics_file, 'rb') as f:
+                vector_statistics = pickle.load(f)
+        else:
+            self.logger.info('No vector statistics to compare against')
+
+        lst_measures = ['AREA', self.str_forest, self.str_harvest, 'OGMA', 'MATURE', 'OLD', self.str_operable]
+
+        def lu_totals(statistics):
+            dict_totals = defaultdict(lambda: OrderedDict((measure, 0) for measure in lst_measures))
+            lst_fields, lst_records = self.statistics_records(statistics)
+            for record in lst_records:
+                dict_record = dict(zip(lst_fields, record))
+                totals = dict_totals[dict_record['lu']]
+                totals['AREA'] += dict_record['area']
+                totals[dict_record['land_type']] += dict_record['area']
+                if dict_record['status'] == 'OGMA':
+                    totals['OGMA'] += dict_record['area']
+                if dict_record['age_type'] in ('MATURE', 'OLD'):
+                    totals[dict_record['age_type']] += dict_record['area']
+                if dict_record['operable'] == self.str_operable:
+                    totals[self.str_operable] += dict_record['area']
+            return dict_totals
+
+        dict_raster = lu_totals(raster_statistics)
+        dict_vector = lu_totals(vector_statistics) if vector_statistics is not None else {}
+        lst_rows = []
+        for lu in sorted(set(dict_raster) | set(dict_vector)):
+            for measure in lst_measures:
+                raster_ha = dict_raster[lu][measure] if lu in dict_raster else 0
+                if vector_statistics is None:
+                    lst_rows.append([lu, measure, round(raster_ha, 2), '', '', ''])
+                    continue
+                vector_ha = dict_vector[lu][measure] if lu in dict_vector else 0
+                lst_rows.append([lu, measure, round(raster_ha, 2), round(vector_ha, 2), round(raster_ha - vector_ha, 2),
+                                 round((raster_ha - vector_ha) / vector_ha * 100, 2) if vector_ha else ''])
+                if measure == 'AREA':
+                    self.logger.info('{}: {:,.1f} ha on the grid against {:,.1f} ha from the resultant'
+                                     .format(lu, raster_ha, vector_ha))
+
+        with open(self.raster_report_file, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['LANDSCAPE_UNIT', 'MEASURE', 'RASTER_HA', 'VECTOR_HA', 'DIFFERENCE_HA', 'DIFFERENCE_PCT'])
+            writer.writerows(lst_rows)
+        self.lst_report_files.append(self.raster_report_file)
+        self.logger.info('Raster statistics compared in {}'.format(self.raster_report_file))
 
     def build_statistics(self):
         lst_fields = [self.fld_lu_name, self.fld_lu_number, self.fld_nat_dist, self.fld_zone, self.fld_lu_bio,
@@ -650,104 +1794,186 @@ class OgmaAnalysis:
                       self.fld_lr_name, self.fld_age_type, self.fld_op_area]
         if self.bl_corridor:
             lst_fields.append(self.fld_corridor)
+        lst_key_fields = [field for field in lst_fields if field not in (self.fld_area, self.fld_age_class,
+                                                                         self.fld_age_type)]
 
-        self.logger.info('Building statistics')
-        self.ogma_statistics = defaultdict(OGMAStatistics)
-        lst_parks = []
+        # One statistics cube now and one per projection year, all grouped from the same columns
+        lst_cubes = [(None, self.fld_age_class, self.fld_age_type)]
+        for years in self.lst_projection_years:
+            fld_age, fld_age_class, fld_age_type = self.projection_fields(years)
+            lst_cubes.append((years, fld_age_class, fld_age_type))
+            lst_fields += [fld_age_class, fld_age_type]
 
-        with arcpy.da.SearchCursor(self.fc_resultant, lst_fields) as s_cursor:
-            for row in s_cursor:
-                lu_name = row[lst_fields.index(self.fld_lu_name)]
-                lu_number = str(row[lst_fields.index(self.fld_lu_number)])
-                nat_dist = str(row[lst_fields.index(self.fld_nat_dist)]).upper()
-                zone = str(row[lst_fields.index(self.fld_zone)]).upper()
-                lu_bio = str(row[lst_fields.index(self.fld_lu_bio)]).upper()
-                status = row[lst_fields.index(self.fld_status)]
-                age_class = row[lst_fields.index(self.fld_age_class)]
-                land_type = row[lst_fields.index(self.fld_land_type)]
-                operable = row[lst_fields.index(self.fld_operable)]
-                area = row[lst_fields.index(self.fld_area)] / 10000
-                lr_name = row[lst_fields.index(self.fld_lr_name)]
-                ac_type = row[lst_fields.index(self.fld_age_type)]
-                op_area = row[lst_fields.index(self.fld_op_area)]
-                corridor = row[lst_fields.index(self.fld_corridor)] if self.bl_corridor else None
-
-                op_area = self.str_outside_oa if not op_area else op_area
-
-                if lu_number.endswith('P'):
-                    if lu_number not in lst_parks:
-                        lst_parks.append(lu_number)
-                    continue
-
-                if self.ogma_statistics[lu_name].lr_plan == '':
-                    self.ogma_statistics[lu_name].lr_plan = lr_name
-
-                if self.ogma_statistics[lu_name].lu_number == '':
-                    self.ogma_statistics[lu_name].lu_number = lu_number
-
-                if (age_class or age_class >= 0) and land_type in [self.str_forest, self.str_harvest]:
-                    # if ac_type:
-                    self.ogma_statistics[lu_name].nat_disturbance[nat_dist].zone[zone].bio_opt[lu_bio].status[
-                        status].age_class[age_class].op_areas[op_area].land_type[land_type].operable[
-                        operable].area += area
-                    self.ogma_statistics[lu_name].nat_disturbance[nat_dist].zone[zone].bio_opt[lu_bio].status[
-                        status].age_class[age_class].ac_type = ac_type
-                    if corridor == 'YES':
-                        self.ogma_statistics[lu_name].nat_disturbance[nat_dist].zone[zone].bio_opt[lu_bio].status[
-                            status].age_class[age_class].op_areas[op_area].conn_area += area
-
-        if len(lst_parks) > 0:
-            for park in lst_parks:
-                for lu in self.ogma_statistics:
-                    if self.ogma_statistics[lu].lu_number == park[:-1]:
-                        self.ogma_statistics[lu].lu_park = OGMAStatistics()
-
-                        with arcpy.da.SearchCursor(self.fc_resultant, lst_fields,
-                                                   '{} = \'{}\''.format(self.fld_lu_number, park)) as s_cursor:
-                            for row in s_cursor:
-                                lu_name = row[lst_fields.index(self.fld_lu_name)]
-                                lu_number = str(row[lst_fields.index(self.fld_lu_number)])
-                                nat_dist = str(row[lst_fields.index(self.fld_nat_dist)]).upper()
-                                zone = str(row[lst_fields.index(self.fld_zone)]).upper()
-                                lu_bio = str(row[lst_fields.index(self.fld_lu_bio)]).upper()
-                                status = row[lst_fields.index(self.fld_status)]
-                                age_class = row[lst_fields.index(self.fld_age_class)]
-                                land_type = row[lst_fields.index(self.fld_land_type)]
-                                operable = row[lst_fields.index(self.fld_operable)]
-                                area = row[lst_fields.index(self.fld_area)] / 10000
-                                ac_type = row[lst_fields.index(self.fld_age_type)]
-                                op_area = row[lst_fields.index(self.fld_op_area)]
-                                corridor = row[lst_fields.index(self.fld_corridor)] if self.bl_corridor else None
-
-                                op_area = self.str_outside_oa if not op_area else op_area
-
-                                if not self.ogma_statistics[lu].park_name:
-                                    self.ogma_statistics[lu].park_name = lu_name
-
-                                if not self.ogma_statistics[lu].park_number:
-                                    self.ogma_statistics[lu].park_number = lu_number
-
-                                if (age_class or age_class >= 0) and land_type in [self.str_forest, self.str_harvest]:
-                                    # if ac_type:
-                                    self.ogma_statistics[lu].nat_disturbance[nat_dist].zone[zone].bio_opt[
-                                        lu_bio].status[status].age_class[age_class].op_areas[op_area].land_type[
-                                        land_type].operable[operable].area += area
-                                    self.ogma_statistics[lu].nat_disturbance[nat_dist].zone[zone].bio_opt[
-                                        lu_bio].status[status].age_class[age_class].ac_type = ac_type
-                                    if corridor == 'YES':
-                                        self.ogma_statistics[lu].nat_disturbance[nat_dist].zone[zone].bio_opt[
-                                            lu_bio].status[
-                                            status].age_class[age_class].op_areas[op_area].conn_area += area
-
-        for lu in self.ogma_statistics:
-            self.ogma_statistics[lu].total()
+        self.logger.info('Building statistics')
+        dict_cubes = OrderedDict()
+
+        # After an incremental refresh only the rebuilt landscape units are counted, the rest come from the last run
+        # as long as it was built from the resultant that refresh started from
+        bl_dirty_only = False
+        dict_previous = None
+        str_source = None
+        if os.path.exists(self.statistics_source_file):
+            with open(self.statistics_source_file, 'r') as f:
+                str_source = json.load(f).get('snapshot')
+        if self.lst_dirty_lus is not None and str_source and str_source == self.str_snapshot_before and \
+                os.path.exists(self.statistics_file):
+            dict_previous = {}
+            with open(self.statistics_file, 'rb') as f:
+                dict_previous[None] = pickle.load(f)
+            if self.lst_projection_years and os.path.exists(self.projected_statistics_file):
+                with open(self.projected_statistics_file, 'rb') as f:
+                    dict_previous.update(pickle.load(f))
+            if all(years in dict_previous for years, _, _ in lst_cubes):
+                bl_dirty_only = True
+            else:
+                dict_previous = None
+
+        # Attributes come from the column store, rebuilt only when a stage has written the resultant since. The
+        # fingerprint that stage recorded is compared, so checking the store never reads the resultant itself. After
+        # an incremental refresh of a resultant the store matched, only the rebuilt landscape units are read again
+        store = OGMAColumnStore(path=self.column_dir, logger=self.logger)
+        fingerprint = self.checkpoint.produced(self.fc_resultant)
+        snapshot = self.incremental.manifest['id'] if self.incremental else None
+        if not store.current(fingerprint, lst_fields):
+            with self.profiler.trace('column store', category='cursor', in_features=self.fc_resultant):
+                if self.lst_dirty_lus is not None and store.built_after(self.str_snapshot_before, lst_fields):
+                    store.update(batches=self.read_resultant(lst_fields=lst_fields,
+                                                             where_clause=self.lu_where_clause(self.lst_dirty_lus)),
+                                 lst_fields=lst_fields, fingerprint=fingerprint, snapshot=snapshot,
+                                 field=self.fld_lu_number,
+                                 lst_values=[value for num in self.lst_dirty_lus
+                                             for value in (str(num), '{}P'.format(num))])
+                else:
+                    store.build(batches=self.read_resultant(lst_fields=lst_fields), lst_fields=lst_fields,
+                                fingerprint=fingerprint, snapshot=snapshot)
+        elif snapshot is not None:
+            store.mark(snapshot)
+
+        with self.profiler.trace('column statistics', category='statistics', in_features=self.fc_resultant):
+            dict_columns = OrderedDict((field, store.column(field)) for field in lst_fields)
+            mask = np.isin(dict_columns[self.fld_land_type],
+                           store.codes(self.fld_land_type, [self.str_forest, self.str_harvest]))
+            if bl_dirty_only:
+                lst_numbers = [value for num in self.lst_dirty_lus for value in (str(num), '{}P'.format(num))]
+                mask &= np.isin(dict_columns[self.fld_lu_number], store.codes(self.fld_lu_number, lst_numbers))
+            for years, fld_age_class, fld_age_type in lst_cubes:
+                # The store reads a null age class as -1, the cursor read it as None and add_statistics skipped it
+                lst_rows = self.group_rows(store=store, dict_columns=dict_columns,
+                                           mask=mask & (np.asarray(dict_columns[fld_age_class]) >= 0),
+                                           lst_key_fields=lst_key_fields + [fld_age_class, fld_age_type],
+                                           fld_age_type=fld_age_type)
+                dict_cubes[years] = self.statistics_cube(lst_rows=lst_rows, fld_age_class=fld_age_class,
+                                                         fld_age_type=fld_age_type)
+
+        if dict_previous is not None:
+            for years in dict_cubes:
+                lst_kept = [lu for lu in dict_previous[years] if lu not in dict_cubes[years] and
+                            dict_previous[years][lu].lu_number not in self.lst_dirty_lus]
+                for lu in lst_kept:
+                    dict_cubes[years][lu] = dict_previous[years][lu]
+            self.logger.info('Statistics carried over for {} landscape units'.format(len(lst_kept)))
+
+        self.ogma_statistics = dict_cubes.pop(None)
+        self.dict_projected_statistics = dict_cubes
+        with open(self.statistics_file, 'wb') as f:
+            pickle.dump(self.ogma_statistics, f, pickle.HIGHEST_PROTOCOL)
+        with open(self.statistics_source_file, 'w') as f:
+            json.dump({'snapshot': self.incremental.manifest['id'] if self.incremental else None}, f, indent=2)
+        if self.lst_projection_years:
+            with open(self.projected_statistics_file, 'wb') as f:
+                pickle.dump(self.dict_projected_statistics, f, pickle.HIGHEST_PROTOCOL)
+            self.logger.info('Projected statistics for {} years written to {}'
+                             .format(', '.join(str(years) for years in self.lst_projection_years),
+                                     self.projected_statistics_file))
 
         if not self.ogma_targets:
             self.build_targets()
 
+    def group_rows(self, store, dict_columns, mask, lst_key_fields, fld_age_type):
+        # Area of the selected rows summed over each distinct combination of lst_key_fields, decoded back to one
+        # dict_row per combination
+        lst_rows = []
+        if not mask.any():
+            return lst_rows
+        keys = np.column_stack([np.asarray(dict_columns[f])[mask].astype('float64') for f in lst_key_fields])
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        areas = np.bincount(inverse.reshape(-1), weights=np.asarray(dict_columns[self.fld_area])[mask])
+        for group, area in zip(groups.tolist(), areas.tolist()):
+            dict_row = {}
+            for field, value in zip(lst_key_fields, group):
+                lst_values = store.values(field)
+                dict_row[field] = lst_values[int(value)] if lst_values is not None else \
+                    dict_columns[field].dtype.type(value).item()
+            dict_row[fld_age_type] = dict_row[fld_age_type] or None
+            dict_row[self.fld_area] = area
+            lst_rows.append(dict_row)
+        return lst_rows
+
+    def statistics_cube(self, lst_rows, fld_age_class, fld_age_type):
+        # {landscape unit: OGMAStatistics} of the rows, parks counted with the landscape unit they are in
+        statistics = defaultdict(OGMAStatistics)
+        lst_parks = []
+        for dict_row in lst_rows:
+            lu_number = str(dict_row[self.fld_lu_number])
+            if lu_number.endswith('P'):
+                lst_parks.append(dict_row)
+                continue
+            lu_statistics = statistics[dict_row[self.fld_lu_name]]
+            if lu_statistics.lr_plan == '':
+                lu_statistics.lr_plan = dict_row[self.fld_lr_name]
+            if lu_statistics.lu_number == '':
+                lu_statistics.lu_number = lu_number
+            self.add_statistics(lu_statistics=lu_statistics, dict_row=dict_row, fld_age_class=fld_age_class,
+                                fld_age_type=fld_age_type)
+
+        for dict_row in lst_parks:
+            park = str(dict_row[self.fld_lu_number])
+            for lu in list(statistics.keys()):
+                if statistics[lu].lu_number == park[:-1]:
+                    lu_statistics = statistics[lu]
+                    if not hasattr(lu_statistics, 'lu_park'):
+                        lu_statistics.lu_park = OGMAStatistics()
+                    if not lu_statistics.park_name:
+                        lu_statistics.park_name = dict_row[self.fld_lu_name]
+                    if not lu_statistics.park_number:
+                        lu_statistics.park_number = park
+                    self.add_statistics(lu_statistics=lu_statistics, dict_row=dict_row, fld_age_class=fld_age_class,
+                                        fld_age_type=fld_age_type)
+
+        for lu in statistics:
+            statistics[lu].total()
+        return statistics
+
+    def add_statistics(self, lu_statistics, dict_row, fld_age_class, fld_age_type):
+        nat_dist = str(dict_row[self.fld_nat_dist]).upper()
+        zone = str(dict_row[self.fld_zone]).upper()
+        lu_bio = str(dict_row[self.fld_lu_bio]).upper()
+        status = dict_row[self.fld_status]
+        age_class = dict_row[fld_age_class]
+        land_type = dict_row[self.fld_land_type]
+        operable = dict_row[self.fld_operable]
+        area = dict_row[self.fld_area] / 10000
+        ac_type = dict_row[fld_age_type]
+        op_area = dict_row[self.fld_op_area]
+        corridor = dict_row[self.fld_corridor] if self.bl_corridor else None
+
+        op_area = self.str_outside_oa if not op_area else op_area
+
+        if (age_class or age_class >= 0) and land_type in [self.str_forest, self.str_harvest]:
+            # if ac_type:
+            ac_statistics = lu_statistics.nat_disturbance[nat_dist].zone[zone].bio_opt[lu_bio].status[
+                status].age_class[age_class]
+            ac_statistics.op_areas[op_area].land_type[land_type].operable[operable].area += area
+            ac_statistics.ac_type = ac_type
+            if corridor == 'YES':
+                ac_statistics.op_areas[op_area].conn_area += area
+
     def build_targets(self):
         self.logger.info('Building targets')
-        df = pd.read_csv(filepath_or_buffer=self.target_file, delimiter=',').fillna(value='')
+        self.ogma_targets = self.read_targets(self.target_file)
+
+    def read_targets(self, target_file):
+        df = pd.read_csv(filepath_or_buffer=target_file, delimiter=',').fillna(value='')
 
         lst_rows = [list(row) for row in df.values]
         lst_columns = df.columns.tolist()
@@ -760,7 +1986,7 @@ class OgmaAnalysis:
         i_target_mature = lst_columns.index('TARGET_MATURE_OLD')
         i_target_old = lst_columns.index('TARGET_OLD')
 
-        self.ogma_targets = OGMATarget()
+        ogma_targets = OGMATarget()
 
         for row in lst_rows:
             lr_plan = row[i_lr_plan]
@@ -772,13 +1998,293 @@ class OgmaAnalysis:
             target_mature = float(row[i_target_mature]) if row[i_target_mature] != '' else None
             target_old = float(row[i_target_old]) if row[i_target_old] != '' else None
 
-            self.ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].mature.age = mature
-            self.ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].mature.target = target_mature
-            self.ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].old.age = old
-            self.ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].old.target = target_old
+            ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].mature.age = mature
+            ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].mature.target = target_mature
+            ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].old.age = old
+            ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo].old.target = target_old
+        return ogma_targets
+
+    def scenario_aggregate(self, years=None):
+        # Forested area, and harvested area in age class 0, by landscape unit, operating area, NDT/BEC/BEO, status,
+        # age class and land type. Only the age types depend on the targets, so any number of target tables are
+        # evaluated from these arrays without reading resultant again
+        if years in self.dict_scenario_aggregates:
+            return self.dict_scenario_aggregates[years]
+        statistics = self.ogma_statistics if years is None else self.dict_projected_statistics[years]
+        lst_names = ['lu', 'lu_number', 'lr_plan', 'op_area', 'ndt', 'zone', 'beo', 'ogma', 'age_class', 'land_type',
+                     'area']
+        lst_rows = []
+        for lu in sorted(statistics.keys()):
+            lu_statistics = statistics[lu]
+            lr_plan = self.dict_resource_plans.get(lu_statistics.lr_plan, '')
+            for ndt, ndt_statistics in lu_statistics.nat_disturbance.items():
+                for zone, zone_statistics in ndt_statistics.zone.items():
+                    for bio, bio_statistics in zone_statistics.bio_opt.items():
+                        for status, status_statistics in bio_statistics.status.items():
+                            for ac, ac_statistics in status_statistics.age_class.items():
+                                for oa, oa_statistics in ac_statistics.op_areas.items():
+                                    for land_type in [self.str_forest, self.str_harvest]:
+                                        if land_type not in oa_statistics.land_type or \
+                                                (land_type == self.str_harvest and ac != 0):
+                                            continue
+                                        lst_rows.append((lu, lu_statistics.lu_number, lr_plan, oa, ndt, zone,
+                                                         'HIGH' if bio == 'NA' else bio, status == 'OGMA', ac,
+                                                         land_type, oa_statistics.land_type[land_type].area))
+        self.dict_scenario_aggregates[years] = OrderedDict(
+            (name, np.asarray(column)) for name, column in zip(lst_names, zip(*lst_rows) if lst_rows else
+                                                                [[]] * len(lst_names)))
+        return self.dict_scenario_aggregates[years]
+
+    def evaluate_scenario(self, ogma_targets, years=None):
+        # Mature + old and old surplus or deficit per landscape unit and per operating area for each NDT/BEC/BEO,
+        # counted as create_report counts them: all OGMA area is mature + old, and all of it but the mature is old
+        dict_agg = self.scenario_aggregate(years)
+        if not len(dict_agg['area']):
+            return []
+        keys, inverse = np.unique(np.stack([dict_agg['lr_plan'], dict_agg['ndt'], dict_agg['zone'], dict_agg['beo']],
+                                            axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        mature = np.zeros(len(keys), dtype=int)
+        old = np.zeros(len(keys), dtype=int)
+        mature_target = np.full(len(keys), np.nan)
+        old_target = np.full(len(keys), np.nan)
+        for i, (lr_plan, ndt, zone, beo) in enumerate(keys.tolist()):
+            beo_target = ogma_targets.lr_plan[lr_plan].ndt[ndt].bec_zone[zone].bio_opt[beo]
+            if beo_target.mature.age:
+                mature[i] = get_value_from_range(num=beo_target.mature.age + 1, lst_breaks=self.lst_age_class_breaks,
+                                                 lst_results=self.lst_age_class)
+            if beo_target.old.age:
+                old[i] = get_value_from_range(num=beo_target.old.age + 1, lst_breaks=self.lst_age_class_breaks,
+                                              lst_results=self.lst_age_class)
+            if beo_target.mature.target:
+                mature_target[i] = beo_target.mature.target
+            if beo_target.old.target:
+                old_target[i] = beo_target.old.target
+
+        row_mature = mature[inverse]
+        if self.tsa == 'Golden':
+            row_mature[np.char.find(dict_agg['lu_number'].astype(np.str_), 'G27') < 0] = 0
+        ac_type = self.age_type_rules().classify({'land_type': dict_agg['land_type'],
+                                                  'age_class': dict_agg['age_class'], 'mature': row_mature,
+                                                  'old': old[inverse]})
+        mat_old_area = np.where(dict_agg['ogma'], dict_agg['area'], 0)
+        old_area = np.where(ac_type != 'MATURE', mat_old_area, 0)
+
+        lst_results = []
+        for level, lst_group, mask in [('LANDSCAPE_UNIT', ['lu', 'ndt', 'zone', 'beo'], None),
+                                       ('OPERATING_AREA', ['lu', 'op_area', 'ndt', 'zone', 'beo'],
+                                        dict_agg['op_area'] != self.str_outside_oa)]:
+            rows = np.arange(len(dict_agg['area'])) if mask is None else np.nonzero(mask)[0]
+            if not len(rows):
+                continue
+            groups, group_idx = np.unique(np.stack([dict_agg[name][rows].astype(np.str_) for name in lst_group],
+                                                   axis=1), axis=0, return_inverse=True)
+            group_idx = group_idx.reshape(-1)
+            # Any row of a group gives its targets, they are the same for the whole group
+            first = np.zeros(len(groups), dtype=int)
+            first[group_idx] = rows
+            area, group_mat_old, group_old = [np.bincount(group_idx, weights=values[rows], minlength=len(groups))
+                                              for values in (dict_agg['area'], mat_old_area, old_area)]
+            group_mature_target = mature_target[inverse[first]]
+            group_old_target = old_target[inverse[first]]
+            if self.tsa == 'Golden':
+                group_mature_target[dict_agg['lu'][first] != 'Moose'] = np.nan
+            r3_low = (dict_agg['lu_number'][first].astype(np.str_) == 'R3') & (dict_agg['beo'][first] == 'LOW')
+            group_old_target[r3_low] = np.round(group_old_target[r3_low] * 3)
+
+            for i in np.nonzero(~np.isnan(group_mature_target) | ~np.isnan(group_old_target))[0]:
+                dict_group = dict(zip(lst_group, groups[i].tolist()))
+                row = [level, dict_group['lu'], dict_group.get('op_area', ''), dict_group['ndt'], dict_group['zone'],
+                       dict_group['beo'], round(area[i], 4)]
+                for value, target in [(group_mat_old[i], group_mature_target[i]), (group_old[i], group_old_target[i])]:
+                    if np.isnan(target):
+                        row += [round(value, 4), '', '', '']
+                    else:
+                        target_ha = area[i] * target / 100
+                        row += [round(value, 4), target, round(target_ha, 4), round(value - target_ha, 4)]
+                lst_results.append(row)
+        return lst_results
+
+    def evaluate_scenarios(self):
+        # The current targets are evaluated first as the baseline the scenarios are compared to
+        self.logger.info('Evaluating target scenarios')
+        lst_rows = []
+        for target_file in [self.target_file] + self.lst_scenarios:
+            scenario = os.path.splitext(os.path.basename(target_file))[0]
+            ogma_targets = self.read_targets(target_file)
+            for years in [None] + list(self.dict_projected_statistics.keys()):
+                with self.profiler.trace('scenario {} in {} years'.format(scenario, years or 0)):
+                    lst_results = self.evaluate_scenario(ogma_targets=ogma_targets, years=years)
+                deficits = sum(1 for row in lst_results if row[0] == 'LANDSCAPE_UNIT' and
+                               any(value != '' and value < 0 for value in (row[10], row[14])))
+                self.logger.info('{} in {} years: {} landscape unit NDT/BEC/BEO deficits'
+                                 .format(scenario, years or 0, deficits))
+                lst_rows += [[scenario, years or 0] + row for row in lst_results]
+
+        with open(self.scenario_report_file, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['SCENARIO', 'YEARS', 'LEVEL', 'LANDSCAPE_UNIT', 'OPERATING_AREA', 'NDT', 'BEC', 'BEO',
+                             'AREA_HA', 'MATURE_OLD_HA', 'MATURE_OLD_TARGET_PCT', 'MATURE_OLD_TARGET_HA',
+                             'MATURE_OLD_PLUS_MINUS', 'OLD_HA', 'OLD_TARGET_PCT', 'OLD_TARGET_HA', 'OLD_PLUS_MINUS'])
+            writer.writerows(lst_rows)
+        self.lst_report_files.append(self.scenario_report_file)
+        self.logger.info('Scenario report written to {}'.format(self.scenario_report_file))
+
+    def statistics_records(self, statistics):
+        # One (lu, ..., area) record per leaf of the statistics cube, in the order of the fields returned with them
+        lst_fields = ['lu', 'lu_number', 'lr_plan', 'op_area', 'ndt', 'zone', 'beo', 'status', 'age_class', 'age_type',
+                      'land_type', 'operable', 'area']
+        lst_records = []
+        for lu in sorted(statistics.keys()):
+            lu_statistics = statistics[lu]
+            lr_plan = self.dict_resource_plans.get(lu_statistics.lr_plan, '')
+            for ndt, ndt_statistics in lu_statistics.nat_disturbance.items():
+                for zone, zone_statistics in ndt_statistics.zone.items():
+                    for bio, bio_statistics in zone_statistics.bio_opt.items():
+                        for status, status_statistics in bio_statistics.status.items():
+                            for ac, ac_statistics in status_statistics.age_class.items():
+                                for oa, oa_statistics in ac_statistics.op_areas.items():
+                                    for land_type, lt_statistics in oa_statistics.land_type.items():
+                                        for operable, op_statistics in lt_statistics.operable.items():
+                                            lst_records.append((lu, lu_statistics.lu_number, lr_plan, oa, ndt, zone,
+                                                                bio, status, ac, ac_statistics.ac_type, land_type,
+                                                                operable, op_statistics.area))
+        return lst_fields, lst_records
+
+    def serve(self, port, cache_size=256):
+        from util.cls_ogma_service import OGMAQueryService
+
+        if not os.path.exists(self.statistics_file):
+            raise Exception('No statistics in {}, run the report first'.format(self.data_dir))
+        self.restore_stage(stage='build_statistics', dict_state={})
+        self.build_targets()
+
+        dict_records = OrderedDict()
+        for years, statistics in [(0, self.ogma_statistics)] + list(self.dict_projected_statistics.items()):
+            lst_fields, dict_records[years] = self.statistics_records(statistics)
+        lst_names = ['level', 'lu', 'op_area', 'ndt', 'zone', 'beo', 'area_ha', 'mature_old_ha',
+                     'mature_old_target_pct', 'mature_old_target_ha', 'mature_old_plus_minus', 'old_ha',
+                     'old_target_pct', 'old_target_ha', 'old_plus_minus']
+
+        def summarize(years):
+            return [OrderedDict(zip(lst_names, row))
+                    for row in self.evaluate_scenario(ogma_targets=self.ogma_targets, years=years or None)]
+
+        service = OGMAQueryService(dict_records=dict_records, lst_fields=lst_fields, summarize=summarize,
+                                   logger=self.logger, cache_size=cache_size)
+        service.serve(port=port)
+
+    def find_candidates(self):
+        # Replacement OGMA for each landscape unit NDT/BEC/BEO short of a target, with the deficits counted as the
+        # report counts them. Old deficits are filled first from old stands, and what they add also counts towards
+        # mature + old, which is then filled from mature and old stands
+        self.logger.info('Finding OGMA candidates')
+        if not self.ogma_targets:
+            self.build_targets()
+        dict_deficits = OrderedDict()
+        for row in self.evaluate_scenario(ogma_targets=self.ogma_targets):
+            mat_old_plus_minus, old_plus_minus = row[10], row[14]
+            if row[0] == 'LANDSCAPE_UNIT' and any(value != '' and value < 0
+                                                  for value in (mat_old_plus_minus, old_plus_minus)):
+                dict_deficits[tuple(row[1:2] + row[3:6])] = [-value if value != '' and value < 0 else 0
+                                                              for value in (mat_old_plus_minus, old_plus_minus)]
+        self.logger.info('{} landscape unit NDT/BEC/BEO deficits'.format(len(dict_deficits)))
+
+        lst_rows = []
+        lst_selected = []
+        if dict_deficits:
+            lst_lus = sorted(set(key[0] for key in dict_deficits))
+            lu_where_clause = '{} IN ({})'.format(self.fld_lu_name, ','.join('\'{}\''.format(lu.replace('\'', '\'\''))
+                                                                          for lu in lst_lus))
+            candidate_where_clause = '{} = \'NON-OGMA\' AND {} = \'{}\' AND {} IN (\'MATURE\', \'OLD\')'.format(
+                self.fld_status, self.fld_land_type, self.str_forest, self.fld_age_type)
+            with self.profiler.trace('candidate neighbours', in_features=self.fc_resultant):
+                lst_pairs = self.backend.neighbours(in_features=self.fc_resultant,
+                                                    where_clause='{} AND ({} = \'OGMA\' OR ({}))'.format(
+                                                        lu_where_clause, self.fld_status, candidate_where_clause))
+
+            lst_fields = ['OID@', self.fld_lu_name, self.fld_nat_dist, self.fld_zone, self.fld_lu_bio, self.fld_status,
+                          self.fld_age_class, self.fld_age_type, self.fld_operable, self.fld_area]
+            lst_ogma = []
+            dict_candidates = defaultdict(dict)
+            dict_attributes = {}
+            with self.profiler.trace('cursor candidates', category='cursor', in_features=self.fc_resultant):
+                for batch in self.read_resultant(lst_fields=lst_fields, where_clause='{} = \'OGMA\' OR ({})'.format(
+                        self.fld_status, candidate_where_clause), lst_lus=lst_lus):
+                    for fid, lu, ndt, zone, bio, status, ac, ac_type, operable, area in \
+                            zip(*[batch[field].tolist() for field in lst_fields]):
+                        if status == 'OGMA':
+                            lst_ogma.append(fid)
+                            continue
+                        bio = str(bio).upper()
+                        key = (lu, str(ndt).upper(), str(zone).upper(), 'HIGH' if bio == 'NA' else bio)
+                        if key in dict_deficits:
+                            dict_candidates[key][fid] = (operable != self.str_operable, area / 10000, ac_type)
+                            dict_attributes[fid] = (ac, ac_type, operable)
+
+            candidates = OGMACandidates(lst_pairs=lst_pairs, lst_ogma=lst_ogma)
+            for key, (mat_old_need, old_need) in dict_deficits.items():
+                dict_key = dict_candidates[key]
+                lst_passes = [('OLD', old_need, ['OLD']), ('MATURE_OLD', mat_old_need, ['MATURE', 'OLD'])]
+                for deficit, need, lst_types in lst_passes:
+                    if deficit == 'MATURE_OLD':
+                        need -= sum(row[11] for row in lst_rows if tuple(row[1:5]) == key and row[5] == 'OLD')
+                    if need <= 0:
+                        continue
+                    lst_fill = candidates.fill(dict_candidates=dict((fid, value[:2]) for fid, value in dict_key.items()
+                                                                    if value[2] in lst_types), need=need)
+                    total = 0
+                    for fid, shared in lst_fill:
+                        total += dict_key[fid][1]
+                        lst_selected.append(fid)
+                        lst_rows.append([len(lst_selected)] + list(key) + [deficit, round(need, 4), fid] +
+                                        list(dict_attributes[fid]) + [round(dict_key[fid][1], 4), round(shared, 2),
+                                                                      round(total, 4)])
+                    if total < need:
+                        self.logger.warning('{} {} {} {}: candidates cover {:.1f} of the {:.1f} ha {} deficit'
+                                            .format(key[0], key[1], key[2], key[3], total, need, deficit))
+            self.logger.info('{} candidate polygons selected'.format(len(lst_selected)))
+
+        # The feature class keeps the resultant attributes and order, the rank and deficit are written onto it
+        if self.backend.exists(self.fc_candidates):
+            self.backend.delete(self.fc_candidates)
+        if lst_selected:
+            with self.profiler.trace('select candidates', in_features=self.fc_resultant,
+                                     out_features=self.fc_candidates):
+                self.backend.select(in_features=self.fc_resultant, out_features=self.fc_candidates,
+                                    lst_ids=sorted(lst_selected))
+            self.add_fields(in_features=self.fc_candidates, lst_fields=[('CANDIDATE_RANK', 'LONG', None),
+                                                                        ('CANDIDATE_FOR', 'TEXT', 10),
+                                                                        ('SHARED_OGMA_M', 'DOUBLE', None)])
+            dict_rows = dict((row[7], row) for row in lst_rows)
+            # The selection keeps the resultant order, so the n-th candidate feature is the n-th selected id
+            lst_fids = sorted(lst_selected)
+            lst_feature_ids = sorted(fid for batch in self.backend.batches(in_features=self.fc_candidates,
+                                                                           lst_fields=['OID@'], chunk_size=100000)
+                                     for fid in batch['OID@'].tolist())
+            dict_source = dict(zip(lst_feature_ids, lst_fids))
+
+            def update_candidate(fid, row):
+                source = dict_rows[dict_source[fid]]
+                return [source[0], source[5], source[12]]
+
+            self.backend.update_rows(in_features=self.fc_candidates,
+                                     lst_fields=['CANDIDATE_RANK', 'CANDIDATE_FOR', 'SHARED_OGMA_M'],
+                                     update_row=update_candidate)
+
+        with open(self.candidate_report_file, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['RANK', 'LANDSCAPE_UNIT', 'NDT', 'BEC', 'BEO', 'DEFICIT', 'DEFICIT_HA', 'RESULTANT_OID',
+                             'AGE_CLASS', 'AGE_TYPE', 'OPERABLE', 'AREA_HA', 'SHARED_OGMA_M', 'CUMULATIVE_HA'])
+            writer.writerows(lst_rows)
+        self.lst_report_files.append(self.candidate_report_file)
+        self.logger.info('Candidate table written to {}'.format(self.candidate_report_file))
 
     def create_report(self):
         self.logger.info('Generating report')
+        # build_statistics may have been restored from its checkpoint without reading the targets
+        if not self.ogma_targets:
+            self.build_targets()
 
         xl = Excel()
 
@@ -822,6 +2328,18 @@ class OgmaAnalysis:
 
         self.lst_lu_names = sorted(self.ogma_statistics.keys())
 
+        # A landscape unit whose statistics and report inputs hash as they did last time keeps its map
+        dict_previous_hashes = {}
+        if os.path.exists(self.report_hash_file):
+            try:
+                with open(self.report_hash_file, 'r') as f:
+                    dict_previous_hashes = json.load(f)
+            except ValueError:
+                self.logger.warning('Report hashes {} are unreadable, rendering every map'
+                                    .format(self.report_hash_file))
+        dict_hashes = OrderedDict()
+        carried = 0
+
         for str_lu_name in self.lst_lu_names:
             lu_statistics = self.ogma_statistics[str_lu_name]
             sheet_name = str_lu_name
@@ -1415,6 +2933,19 @@ class OgmaAnalysis:
                 i_summary_row += 1
 
             xl.autofit_columns(start_col=1, end_col=s_old_corr_col, start_row=i_subtitle_row, end_row=i_row)
+            xl.save_workbook(file_path=self.excel_report_file)
+
+            lu_hash = self.report_hash(lu_statistics)
+            pdf_map_file = self.map_file(str_lu_name)
+            dict_hashes[str_lu_name] = {'hash': lu_hash, 'map': pdf_map_file}
+            dict_previous = dict_previous_hashes.get(str_lu_name, {})
+            if dict_previous.get('hash') == lu_hash and os.path.exists(dict_previous.get('map', '')):
+                self.logger.info('{} is unchanged, carrying its map forward'.format(str_lu_name))
+                if os.path.normcase(dict_previous['map']) != os.path.normcase(pdf_map_file):
+                    shutil.copyfile(dict_previous['map'], pdf_map_file)
+                self.lst_report_files.append(pdf_map_file)
+                carried += 1
+                continue
 
             self.str_ogma_age_class = os.path.join(os.path.dirname(self.excel_report_file), 'ogma_age_class.png')
             self.str_ogma_summary_targets = os.path.join(os.path.dirname(self.excel_report_file),
@@ -1425,7 +2956,6 @@ class OgmaAnalysis:
 
             xl.select_range(i_row=i_subtitle_row - 1, j_row=i_summary_end_row, i_col=s_ndt_col, j_col=s_old_corr_col)
             xl.export_range(self.str_ogma_summary_targets)
-            xl.save_workbook(file_path=self.excel_report_file)
 
             if lu_statistics.park_number:
                 self.create_map(str_lu_name=str_lu_name, str_park_number=lu_statistics.park_number)
@@ -1438,6 +2968,23 @@ class OgmaAnalysis:
         xl.close_workbook(save=True, file_path=self.excel_report_file)
         xl.quit()
         # del xl
+        self.lst_report_files.append(self.excel_report_file)
+
+        # Only written once every map is out, an interrupted report renders the remaining maps next time
+        with open(self.report_hash_file, 'w') as f:
+            json.dump(dict_hashes, f, indent=2)
+        self.logger.info('{} of {} maps carried forward'.format(carried, len(dict_hashes)))
+
+    def report_hash(self, lu_statistics):
+        # A map shows the landscape unit's statistics against the targets, laid out by the map template
+        md5 = hashlib.md5()
+        for value in [lu_statistics.digest(), self.checkpoint.fingerprint(self.target_file),
+                      self.checkpoint.fingerprint(self.mxd_template), self.tsa, self.bl_corridor]:
+            md5.update(str(value).encode('utf-8'))
+        return md5.hexdigest()
+
+    def map_file(self, str_lu_name):
+        return os.path.join(self.plot_dir, '{}_LU_OGMA_{}.pdf'.format(str_lu_name, dt.now().strftime('%Y%m%d')))
 
     def create_map(self, str_lu_name, str_park_number=None):
         from arcpy import mapping as mp
@@ -1515,9 +3062,9 @@ class OgmaAnalysis:
         arcpy.CheckInExtension('Foundation')
 
         self.logger.info('Exporting to pdf')
-        pdf_map_file = os.path.join(self.plot_dir, '{}_LU_OGMA_{}.pdf'
-                                    .format(str_lu_name, dt.now().strftime('%Y%m%d')))
+        pdf_map_file = self.map_file(str_lu_name)
         mp.ExportToPDF(map_document=mxd, out_pdf=pdf_map_file, image_quality='BETTER', image_compression='JPEG')
+        self.lst_report_files.append(pdf_map_file)
         # mxd.saveACopy(file_name='{}mxd'.format(pdf_map_file[:-3]))
         del mxd
 
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from datetime import datetime as dt
+from ogma_analysis import OgmaAnalysis
+from util.cls_ogma_lazy import OGMALazyModule
+
+sys.path.insert(1, r'W:\FOR\RSI\TOC\Projects\ESRI_Scripts\Python_Repository')
+
+arcpy = OGMALazyModule('arcpy')
+Environment = OGMALazyModule('environment', attribute='Environment')
+OGMASynthetic = OGMALazyModule('util.cls_ogma_synthetic', attribute='OGMASynthetic')
+
+
+def run_app():
+    args, logger = get_input_parameters()
+    lst_results = []
+    bl_heavy_imports = False
+    if args.startup:
+        lst_startup, bl_heavy_imports = run_startup(repeat=args.repeat, logger=logger)
+        lst_results += lst_startup
+    for scale in args.scales:
+        lst_results += run_benchmark(out=args.out, scale=scale, seed=args.seed, lst_stages=args.stages,
+                                     repeat=args.repeat, profile=args.profile, logger=logger)
+
+    history_file = os.path.join(args.out, 'benchmark_history.jsonl')
+    with open(history_file, 'a') as f:
+        for result in lst_results:
+            f.write(json.dumps(result) + '\n')
+    logger.info('Results appended to {}'.format(history_file))
+
+    baseline_file = args.baseline or os.path.join(args.out, 'benchmark_baseline.json')
+    if args.save_baseline:
+        save_baseline(baseline_file=baseline_file, lst_results=lst_results, logger=logger)
+    elif os.path.exists(baseline_file):
+        if check_regressions(baseline_file=baseline_file, lst_results=lst_results, tolerance=args.tolerance,
+                             logger=logger):
+            sys.exit(1)
+    else:
+        logger.info('No baseline at {}, run with --save_baseline to create one'.format(baseline_file))
+    if bl_heavy_imports:
+        sys.exit(1)
+
+
+def get_input_parameters():
+    parser = ArgumentParser(description='Times the OGMA analysis stages against deterministic synthetic data so '
+                                        'performance can be tracked without a BCGW connection')
+    parser.add_argument('out', type=str, help='Benchmark workspace and history location')
+    parser.add_argument('--scales', type=int, nargs='*', default=[10000],
+                        help='Number of synthetic resultant polygons, e.g. 10000 100000 1000000 5000000, or none '
+                             'to only time startup')
+    parser.add_argument('--stages', nargs='+',
+                        default=['update_attributes', 'build_statistics', 'build_targets', 'create_report'],
+                        choices=['update_attributes', 'build_statistics', 'build_targets', 'create_report'],
+                        help='Stages to time')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the synthetic data')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of timed runs per stage, the fastest is kept')
+    parser.add_argument('--baseline', help='Baseline file, defaults to benchmark_baseline.json in the workspace')
+    parser.add_argument('--save_baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline before a stage is flagged, as a fraction')
+    parser.add_argument('--profile', action='store_true', help='Also write the per call profile for each run')
+    parser.add_argument('--startup', action='store_true',
+                        help='Also time ogma_analysis.py --help and the module import in a fresh interpreter')
+    parser.add_argument('--log_level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Log level')
+    parser.add_argument('--log_dir', help='Path to log directory')
+
+    args = parser.parse_args()
+    logger = Environment.setup_logger(args)
+    return args, logger
+
+
+def run_startup(repeat, logger):
+    # Startup is timed in a fresh interpreter each run, nothing imported here is reused
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    dict_commands = OrderedDict([
+        ('startup_help', [sys.executable, os.path.join(script_dir, 'ogma_analysis.py'), '--help']),
+        ('startup_import', [sys.executable, '-c', 'import ogma_analysis'])
+    ])
+    lst_results = []
+    for name, lst_command in dict_commands.items():
+        lst_times = []
+        for i in range(repeat):
+            start = time.time()
+            subprocess.check_call(lst_command, cwd=script_dir, stdout=subprocess.DEVNULL)
+            lst_times.append(time.time() - start)
+            logger.info('{} run {}: {:.2f}s'.format(name, i + 1, lst_times[-1]))
+        lst_results.append({'timestamp': dt.now().strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+                            'python': platform.python_version(), 'scale': 0, 'seed': None, 'stage': name,
+                            'seconds': round(min(lst_times), 3), 'rows_per_sec': None})
+
+    # Importing the module must not pull in arcpy or the network share modules
+    lst_heavy = ['arcpy', 'arcpyproduction', 'pandas', 'environment', 'excel']
+    bl_heavy_imports = subprocess.call([sys.executable, '-c', 'import sys, ogma_analysis; '
+                                        'sys.exit(any(m in sys.modules for m in {!r}))'.format(lst_heavy)],
+                                       cwd=script_dir)
+    if bl_heavy_imports:
+        logger.warning('REGRESSION importing ogma_analysis loads one of {}'.format(', '.join(lst_heavy)))
+    return lst_results, bl_heavy_imports != 0
+
+
+def run_benchmark(out, scale, seed, lst_stages, repeat, profile, logger):
+    synthetic = OGMASynthetic(workspace=os.path.join(out, 'synthetic'), n_polygons=scale, seed=seed, logger=logger)
+    synthetic.generate()
+
+    # The synthetic workspace stands in for both connections; no source is read from them
+    ogma = OgmaAnalysis(tsa='Okanagan', output_location=os.path.join(out, 'runs', str(scale)), username=None,
+                        password=None, analyze='true', report='true', script_dir=os.path.dirname(__file__),
+                        logger=logger, lrm_db=synthetic.gdb, bcgw_db=synthetic.gdb, profile=profile)
+    ogma.target_file = synthetic.target_file
+    ogma.fc_lu = synthetic.fc_lu
+    ogma.fc_aoi = synthetic.fc_aoi
+    ogma.fc_lr_plans = synthetic.fc_lr_plans
+    ogma.fc_beo = synthetic.fc_beo
+    ogma.fc_ogma = synthetic.fc_ogma
+    ogma.fc_resultant = os.path.join(ogma.out_gdb, 'resultant')
+
+    lst_results = []
+    for stage in lst_stages:
+        lst_times = []
+        for i in range(repeat):
+            # update_attributes adds fields and rewrites values, so every run starts from the pristine resultant
+            if stage == 'update_attributes' or not arcpy.Exists(ogma.fc_resultant):
+                arcpy.CopyFeatures_management(in_features=synthetic.fc_resultant, out_feature_class=ogma.fc_resultant)
+                if stage != 'update_attributes':
+                    ogma.update_attributes()
+            if stage == 'create_report' and not ogma.ogma_statistics:
+                ogma.build_statistics()
+            if stage == 'build_targets':
+                ogma.ogma_targets = None
+
+            start = time.time()
+            with ogma.profiler.trace(stage, category='stage'):
+                getattr(ogma, stage)()
+            lst_times.append(time.time() - start)
+            logger.info('{:,} polygons {} run {}: {:.2f}s'.format(scale, stage, i + 1, lst_times[-1]))
+
+        lst_results.append({'timestamp': dt.now().strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+                            'python': platform.python_version(), 'scale': scale, 'seed': seed, 'stage': stage,
+                            'seconds': round(min(lst_times), 3),
+                            'rows_per_sec': round(scale / min(lst_times), 1) if min(lst_times) > 0 else None})
+
+    ogma.profiler.write(summary_file=os.path.join(ogma.data_dir, 'ogma_profile.json'),
+                        trace_file=os.path.join(ogma.data_dir, 'ogma_profile_trace.json'))
+    del ogma
+    return lst_results
+
+
+def save_baseline(baseline_file, lst_results, logger):
+    dict_baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as f:
+            dict_baseline = json.load(f)
+    for result in lst_results:
+        dict_baseline.setdefault(str(result['scale']), {})[result['stage']] = result['seconds']
+    with open(baseline_file, 'w') as f:
+        json.dump(dict_baseline, f, indent=2, sort_keys=True)
+    logger.info('Baseline saved to {}'.format(baseline_file))
+
+
+def check_regressions(baseline_file, lst_results, tolerance, logger):
+    with open(baseline_file, 'r') as f:
+        dict_baseline = json.load(f)
+
+    bl_regression = False
+    for result in lst_results:
+        baseline = dict_baseline.get(str(result['scale']), {}).get(result['stage'])
+        if baseline is None:
+            logger.info('{:,} polygons {}: {:.2f}s (no baseline)'.format(result['scale'], result['stage'],
+                                                                          result['seconds']))
+            continue
+        change = (result['seconds'] - baseline) / baseline if baseline else 0
+        if result['seconds'] > baseline * (1 + tolerance):
+            bl_regression = True
+            logger.warning('REGRESSION {:,} polygons {}: {:.2f}s against {:.2f}s baseline ({:+.0%})'
+                           .format(result['scale'], result['stage'], result['seconds'], baseline, change))
+        else:
+            logger.info('{:,} polygons {}: {:.2f}s against {:.2f}s baseline ({:+.0%})'
+                        .format(result['scale'], result['stage'], result['seconds'], baseline, change))
+    return bl_regression
+
+
+if __name__ == '__main__':
+    try:
+        run_app()
+    except Exception as e:
+        logging.exception('Benchmark failed: {}'.format(e))
+        raise
@@ -0,0 +1,934 @@
+import hashlib
+import os
+import uuid
+
+from util.cls_ogma_lazy import OGMALazyModule
+
+
+def get_backend(name, logger):
+    if name == 'arcpy':
+        return ArcpyBackend(logger=logger)
+    elif name == 'shapely':
+        return ShapelyBackend(logger=logger)
+    raise Exception('Unknown geoprocessing backend {}'.format(name))
+
+
+def parse_distance(search_distance):
+    # '-1000 METERS' -> -1000.0, data is expected in a metre based projection
+    if not search_distance:
+        return 0
+    return float(str(search_distance).split()[0])
+
+
+class OGMABackend:
+    # Spatial operations used by the analyze path. Feature ids returned by select_by_location are only meaningful
+    # to the backend that produced them and are passed back through select(lst_ids=...)
+    name = None
+    # Workspace for intermediates held in memory, and the name of the workspace they spill to on local disk
+    memory_workspace = None
+    scratch_workspace = None
+    # Whether operations may run on several threads of one process at once
+    thread_safe = False
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def select(self, in_features, out_features, where_clause=None, lst_ids=None, invert=False):
+        raise NotImplementedError
+
+    def dissolve(self, in_features, out_features, lst_fields=None, multi_part='SINGLE_PART'):
+        raise NotImplementedError
+
+    def intersect(self, lst_in_features, out_features):
+        raise NotImplementedError
+
+    def union(self, lst_in_features, out_features):
+        raise NotImplementedError
+
+    def eliminate(self, in_features, out_features, where_clause):
+        raise NotImplementedError
+
+    def merge_slivers(self, in_features, where_clause, drop_where_clause=None):
+        # In place: each polygon matching where_clause is merged into the non matching neighbour it shares the
+        # longest boundary with, and polygons matching drop_where_clause are deleted in the same pass. Only the
+        # affected features are edited. Returns the number merged and the number dropped
+        raise NotImplementedError
+
+    def neighbours(self, in_features, where_clause=None):
+        # [(id, neighbour id, shared boundary length)] for the features matching where_clause that share a boundary
+        # with another matching feature, listed both ways round
+        raise NotImplementedError
+
+    def merge(self, lst_in_features, out_features):
+        raise NotImplementedError
+
+    def select_by_location(self, in_features, overlap_type, select_features, where_clause=None,
+                           select_where_clause=None, select_ids=None, search_distance=None):
+        raise NotImplementedError
+
+    def erase(self, in_features, erase_features, out_features):
+        raise NotImplementedError
+
+    def simplify(self, in_features, out_features, tolerance=None, grid_size=None):
+        # Snaps coordinates to a grid_size precision grid, then removes vertices within tolerance without
+        # introducing self intersections. Both are in metres
+        raise NotImplementedError
+
+    def geometry_summary(self, in_features, group_field):
+        # {value of group_field: (vertex count, area)}
+        raise NotImplementedError
+
+    # Housekeeping needed to chain the operations together
+    def create_workspace(self, path):
+        raise NotImplementedError
+
+    def exists(self, path):
+        raise NotImplementedError
+
+    def delete(self, path):
+        raise NotImplementedError
+
+    def count(self, in_features):
+        raise NotImplementedError
+
+    def copy(self, in_features, out_features):
+        self.select(in_features=in_features, out_features=out_features)
+
+    def add_field(self, in_features, field_name, field_type, field_length=None, value=None):
+        raise NotImplementedError
+
+    def delete_fields(self, in_features, lst_fields):
+        raise NotImplementedError
+
+    def list_fields(self, in_features):
+        raise NotImplementedError
+
+    def values(self, in_features, lst_fields, where_clause=None, lst_ids=None):
+        raise NotImplementedError
+
+    def geometries(self, in_features, lst_fields, where_clause=None):
+        # [(feature id, geometry as WKB, *lst_fields)] of the features matching where_clause
+        raise NotImplementedError
+
+    def batches(self, in_features, lst_fields, chunk_size, where_clause=None):
+        # Yields the fields as NumPy record arrays of at most chunk_size rows. OID@, SHAPE@AREA, SHAPE@LENGTH and the
+        # centroid as SHAPE@X and SHAPE@Y are accepted as fields; null text reads as '' and null numbers as -1
+        raise NotImplementedError
+
+    def digests(self, in_features):
+        # {feature id: digest of the attributes and geometry}, equal features give equal digests across layers
+        raise NotImplementedError
+
+    def update_rows(self, in_features, lst_fields, update_row):
+        # Replaces the values of lst_fields of every feature with update_row(feature id, values), where the feature
+        # ids are those batches reads as OID@ and null values are None
+        raise NotImplementedError
+
+    def replace_rows(self, in_features, where_clause, new_features):
+        # Deletes the features matching where_clause and appends new_features, which has the same schema
+        raise NotImplementedError
+
+    def set_extent(self, in_features):
+        raise NotImplementedError
+
+    def clear_extent(self):
+        raise NotImplementedError
+
+
+class ArcpyBackend(OGMABackend):
+    name = 'arcpy'
+    memory_workspace = 'in_memory'
+    scratch_workspace = 'OGMA_Scratch.gdb'
+
+    def __init__(self, logger):
+        OGMABackend.__init__(self, logger)
+        self.arcpy = OGMALazyModule('arcpy')
+
+    def __where(self, in_features, where_clause=None, lst_ids=None):
+        if lst_ids is None:
+            return where_clause
+        str_ids = '{} IN ({})'.format(self.arcpy.Describe(in_features).OIDFieldName,
+                                      ','.join(str(i) for i in lst_ids) or '-1')
+        return '({}) AND {}'.format(where_clause, str_ids) if where_clause else str_ids
+
+    def __layer(self, in_features, where_clause=None, lst_ids=None):
+        # Layer names are unique so steps running on other threads never share a selection
+        return self.arcpy.MakeFeatureLayer_management(in_features=in_features,
+                                                      out_layer='lyr_{}'.format(uuid.uuid4().hex[:12]),
+                                                      where_clause=self.__where(in_features, where_clause,
+                                                                                lst_ids))[0]
+
+    def select(self, in_features, out_features, where_clause=None, lst_ids=None, invert=False):
+        if not invert:
+            if where_clause or lst_ids is not None:
+                self.arcpy.Select_analysis(in_features=in_features, out_feature_class=out_features,
+                                           where_clause=self.__where(in_features, where_clause, lst_ids))
+            else:
+                self.arcpy.CopyFeatures_management(in_features=in_features, out_feature_class=out_features)
+            return
+        lyr = self.__layer(in_features=in_features)
+        self.arcpy.SelectLayerByAttribute_management(in_layer_or_view=lyr, selection_type='NEW_SELECTION',
+                                                     where_clause=self.__where(in_features, where_clause, lst_ids))
+        self.arcpy.SelectLayerByAttribute_management(in_layer_or_view=lyr, selection_type='SWITCH_SELECTION')
+        self.arcpy.CopyFeatures_management(in_features=lyr, out_feature_class=out_features)
+        self.arcpy.Delete_management(in_data=lyr)
+
+    def dissolve(self, in_features, out_features, lst_fields=None, multi_part='SINGLE_PART'):
+        self.arcpy.Dissolve_management(in_features=in_features, out_feature_class=out_features,
+                                       dissolve_field=lst_fields, multi_part=multi_part)
+
+    def intersect(self, lst_in_features, out_features):
+        self.arcpy.Intersect_analysis(in_features=lst_in_features, out_feature_class=out_features,
+                                      join_attributes='NO_FID')
+
+    def union(self, lst_in_features, out_features):
+        self.arcpy.Union_analysis(in_features=lst_in_features, out_feature_class=out_features)
+
+    def eliminate(self, in_features, out_features, where_clause):
+        lyr = self.__layer(in_features=in_features)
+        self.arcpy.SelectLayerByAttribute_management(in_layer_or_view=lyr, selection_type='NEW_SELECTION',
+                                                     where_clause=where_clause)
+        self.arcpy.Eliminate_management(in_features=lyr, out_feature_class=out_features)
+        self.arcpy.Delete_management(in_data=lyr)
+
+    def merge_slivers(self, in_features, where_clause, drop_where_clause=None):
+        oid = self.arcpy.Describe(in_features).OIDFieldName
+        dict_slivers = dict((row[0], row[1]) for row in self.arcpy.da.SearchCursor(in_features, ['OID@', 'SHAPE@'],
+                                                                                 where_clause))
+        set_drop = set()
+        if drop_where_clause:
+            set_drop = set(row[0] for row in self.arcpy.da.SearchCursor(in_features, 'OID@', drop_where_clause))
+
+        # The adjacency table is built only for the slivers and the polygons touching them
+        dict_targets = {}
+        if dict_slivers:
+            lyr = self.__layer(in_features=in_features)
+            self.arcpy.SelectLayerByAttribute_management(in_layer_or_view=lyr, selection_type='NEW_SELECTION',
+                                                         where_clause=where_clause)
+            self.arcpy.SelectLayerByLocation_management(in_layer=lyr, overlap_type='BOUNDARY_TOUCHES',
+                                                        select_features=lyr, selection_type='ADD_TO_SELECTION')
+            neighbours = 'in_memory\\nbr_{}'.format(uuid.uuid4().hex[:12])
+            self.arcpy.PolygonNeighbors_analysis(in_features=lyr, out_table=neighbours, both_sides='BOTH_SIDES')
+            dict_best = {}
+            with self.arcpy.da.SearchCursor(neighbours, ['src_{}'.format(oid), 'nbr_{}'.format(oid),
+                                                         'LENGTH']) as s_cursor:
+                for src, nbr, length in s_cursor:
+                    if src in dict_slivers and nbr not in dict_slivers and length > 0 and \
+                            length > dict_best.get(src, (None, 0))[1]:
+                        dict_best[src] = (nbr, length)
+            self.arcpy.Delete_management(in_data=neighbours)
+            self.arcpy.Delete_management(in_data=lyr)
+            for sliver, (target, _) in dict_best.items():
+                dict_targets.setdefault(target, []).append(sliver)
+
+        set_merged = set(sliver for lst_slivers in dict_targets.values() for sliver in lst_slivers)
+        lst_edit = sorted(set_merged | set(dict_targets) | set_drop)
+        if not lst_edit:
+            return 0, 0
+        dropped = 0
+        with self.arcpy.da.UpdateCursor(in_features, ['OID@', 'SHAPE@'],
+                                        self.__where(in_features, lst_ids=lst_edit)) as u_cursor:
+            for row in u_cursor:
+                if row[0] in set_merged or row[0] in set_drop:
+                    if row[0] not in set_merged:
+                        dropped += 1
+                    u_cursor.deleteRow()
+                    continue
+                geom = row[1]
+                for sliver in dict_targets[row[0]]:
+                    geom = geom.union(dict_slivers[sliver])
+                row[1] = geom
+                u_cursor.updateRow(row)
+        return len(set_merged), dropped
+
+    def neighbours(self, in_features, where_clause=None):
+        oid = self.arcpy.Describe(in_features).OIDFieldName
+        lyr = self.__layer(in_features=in_features, where_clause=where_clause)
+        table = 'in_memory\\nbr_{}'.format(uuid.uuid4().hex[:12])
+        self.arcpy.PolygonNeighbors_analysis(in_features=lyr, out_table=table, both_sides='BOTH_SIDES')
+        lst_pairs = [(src, nbr, length) for src, nbr, length in
+                     self.arcpy.da.SearchCursor(table, ['src_{}'.format(oid), 'nbr_{}'.format(oid), 'LENGTH'])
+                     if length > 0]
+        self.arcpy.Delete_management(in_data=table)
+        self.arcpy.Delete_management(in_data=lyr)
+        return lst_pairs
+
+    def merge(self, lst_in_features, out_features):
+        self.arcpy.Merge_management(inputs=lst_in_features, output=out_features)
+
+    def select_by_location(self, in_features, overlap_type, select_features, where_clause=None,
+                           select_where_clause=None, select_ids=None, search_distance=None):
+        in_lyr = self.__layer(in_features=in_features, where_clause=where_clause)
+        select_lyr = self.__layer(in_features=select_features, where_clause=select_where_clause, lst_ids=select_ids)
+        self.arcpy.SelectLayerByLocation_management(in_layer=in_lyr, overlap_type=overlap_type,
+                                                    select_features=select_lyr, search_distance=search_distance,
+                                                    selection_type='NEW_SELECTION')
+        lst_ids = [row[0] for row in self.arcpy.da.SearchCursor(in_lyr, 'OID@')]
+        self.arcpy.Delete_management(in_data=in_lyr)
+        self.arcpy.Delete_management(in_data=select_lyr)
+        return lst_ids
+
+    def erase(self, in_features, erase_features, out_features):
+        from erase_features import EraseFeatures
+        e_obj = EraseFeatures(in_features=in_features, erase_features=erase_features, out_features=out_features,
+                              logger=self.logger, add_layer=False)
+        e_obj.erase_analysis()
+        del e_obj
+
+    def simplify(self, in_features, out_features, tolerance=None, grid_size=None):
+        grid_features = in_features
+        if grid_size:
+            grid_features = '{}_grid'.format(out_features) if tolerance else out_features
+            # New feature classes store their coordinates on the environment's XY resolution
+            xy_resolution = self.arcpy.env.XYResolution
+            xy_tolerance = self.arcpy.env.XYTolerance
+            self.arcpy.env.XYResolution = '{} Meters'.format(grid_size)
+            self.arcpy.env.XYTolerance = '{} Meters'.format(grid_size)
+            try:
+                self.arcpy.CopyFeatures_management(in_features=in_features, out_feature_class=grid_features)
+            finally:
+                self.arcpy.env.XYResolution = xy_resolution
+                self.arcpy.env.XYTolerance = xy_tolerance
+        if tolerance:
+            self.arcpy.cartography.SimplifyPolygon(in_features=grid_features, out_feature_class=out_features,
+                                                   algorithm='POINT_REMOVE', tolerance='{} Meters'.format(tolerance),
+                                                   minimum_area='0 SquareMeters', error_option='RESOLVE_ERRORS',
+                                                   collapsed_point_option='NO_KEEP')
+            if grid_features != in_features:
+                self.arcpy.Delete_management(in_data=grid_features)
+        elif not grid_size:
+            self.copy(in_features=in_features, out_features=out_features)
+
+    def geometry_summary(self, in_features, group_field):
+        dict_summary = {}
+        with self.arcpy.da.SearchCursor(in_features, [group_field, 'SHAPE@']) as s_cursor:
+            for value, geom in s_cursor:
+                if geom is None:
+                    continue
+                vertices, area = dict_summary.get(value, (0, 0))
+                dict_summary[value] = (vertices + geom.pointCount, area + geom.area)
+        return dict_summary
+
+    def create_workspace(self, path):
+        if not self.arcpy.Exists(path):
+            self.arcpy.CreateFileGDB_management(out_folder_path=os.path.dirname(path),
+                                                out_name=os.path.basename(path))
+
+    def exists(self, path):
+        return self.arcpy.Exists(path)
+
+    def delete(self, path):
+        self.arcpy.Delete_management(in_data=path)
+
+    def count(self, in_features):
+        return int(self.arcpy.GetCount_management(in_features)[0])
+
+    def copy(self, in_features, out_features):
+        self.arcpy.CopyFeatures_management(in_features=in_features, out_feature_class=out_features)
+
+    def add_field(self, in_features, field_name, field_type, field_length=None, value=None):
+        self.arcpy.AddField_management(in_table=in_features, field_name=field_name, field_type=field_type,
+                                       field_length=field_length)
+        if value is not None:
+            with self.arcpy.da.UpdateCursor(in_features, field_name) as u_cursor:
+                for row in u_cursor:
+                    row[0] = value
+                    u_cursor.updateRow(row)
+
+    def delete_fields(self, in_features, lst_fields):
+        if lst_fields:
+            self.arcpy.DeleteField_management(in_table=in_features, drop_field=lst_fields)
+
+    def list_fields(self, in_features):
+        return [field.name for field in self.arcpy.ListFields(in_features)]
+
+    def values(self, in_features, lst_fields, where_clause=None, lst_ids=None):
+        return [row for row in self.arcpy.da.SearchCursor(in_features, lst_fields,
+                                                          self.__where(in_features, where_clause, lst_ids))]
+
+    def geometries(self, in_features, lst_fields, where_clause=None):
+        with self.arcpy.da.SearchCursor(in_features, ['OID@', 'SHAPE@WKB'] + lst_fields, where_clause) as s_cursor:
+            return [tuple(row) for row in s_cursor]
+
+    def batches(self, in_features, lst_fields, chunk_size, where_clause=None):
+        # Only the object ids are read up front; each batch is then a bounded object id range
+        oid = self.arcpy.Describe(in_features).OIDFieldName
+        oids = self.arcpy.da.FeatureClassToNumPyArray(in_features, ['OID@'], where_clause)['OID@']
+        oids.sort()
+        dict_nulls = {}
+        for field in self.arcpy.ListFields(in_features):
+            if field.name in lst_fields:
+                if field.type == 'String':
+                    dict_nulls[field.name] = ''
+                elif field.type in ('SmallInteger', 'Integer', 'Single', 'Double'):
+                    dict_nulls[field.name] = -1
+        for start in range(0, len(oids), chunk_size):
+            chunk = oids[start:start + chunk_size]
+            chunk_where = '{0} >= {1} AND {0} <= {2}'.format(oid, chunk[0], chunk[-1])
+            if where_clause:
+                chunk_where = '({}) AND {}'.format(where_clause, chunk_where)
+            yield self.arcpy.da.FeatureClassToNumPyArray(in_features, lst_fields, chunk_where, null_value=dict_nulls)
+
+    def digests(self, in_features):
+        lst_fields = [field.name for field in self.arcpy.ListFields(in_features)
+                      if field.type not in ('OID', 'Geometry', 'Blob', 'Raster', 'GlobalID')
+                      and field.name not in ('Shape_Area', 'Shape_Length')]
+        dict_digests = {}
+        with self.arcpy.da.SearchCursor(in_features, ['OID@', 'SHAPE@WKB'] + lst_fields) as s_cursor:
+            for row in s_cursor:
+                md5 = hashlib.md5(repr(row[2:]).encode('utf-8'))
+                md5.update(bytes(row[1] or b''))
+                dict_digests[row[0]] = md5.hexdigest()
+        return dict_digests
+
+    def update_rows(self, in_features, lst_fields, update_row):
+        with self.arcpy.da.UpdateCursor(in_features, ['OID@'] + lst_fields) as u_cursor:
+            for row in u_cursor:
+                u_cursor.updateRow([row[0]] + list(update_row(row[0], list(row[1:]))))
+
+    def replace_rows(self, in_features, where_clause, new_features):
+        lyr = self.__layer(in_features=in_features, where_clause=where_clause)
+        self.arcpy.DeleteFeatures_management(in_features=lyr)
+        self.arcpy.Delete_management(in_data=lyr)
+        self.arcpy.Append_management(inputs=new_features, target=in_features, schema_type='NO_TEST')
+
+    def set_extent(self, in_features):
+        # Extents of in memory feature classes are always current
+        if os.path.dirname(in_features) != self.memory_workspace:
+            self.arcpy.RecalculateFeatureClassExtent_management(in_features=in_features)
+        self.arcpy.env.extent = self.arcpy.Describe(value=in_features).extent
+
+    def clear_extent(self):
+        self.arcpy.ClearEnvironment('extent')
+
+
+class ShapelyBackend(OGMABackend):
+    # Vectorized shapely 2 / GEOS operations with STRtree indexes. Layers are read from and written to a GeoPackage
+    # (OGMA_Data.gpkg/resultant), a file geodatabase through GDAL (OGMA_Data.gdb/resultant) or a folder of GeoParquet
+    # files (OGMA_Data/resultant.parquet). SDE connections cannot be read, so sources have to be local extracts
+    name = 'shapely'
+    memory_workspace = 'memory'
+    scratch_workspace = 'OGMA_Scratch.gpkg'
+    thread_safe = True
+
+    def __init__(self, logger):
+        OGMABackend.__init__(self, logger)
+        import geopandas
+        import numpy
+        import pandas
+        import pyogrio
+        import shapely
+        self.gpd = geopandas
+        self.np = numpy
+        self.pd = pandas
+        self.pyogrio = pyogrio
+        self.shapely = shapely
+        self.bbox = None
+        self.dict_memory = {}
+
+    @staticmethod
+    def __location(path):
+        # Layers inside a GeoPackage or file geodatabase, otherwise a single file, GeoParquet by default
+        path = str(path)
+        for ext in ('.gpkg', '.gdb'):
+            if ext in path:
+                container, _, layer = path.partition(ext)
+                return container + ext, layer.strip('/\\') or None
+        if os.path.splitext(path)[1]:
+            return path, None
+        return '{}.parquet'.format(path), None
+
+    def __name(self, path):
+        file_path, layer = self.__location(path)
+        return layer or os.path.splitext(os.path.basename(file_path))[0]
+
+    def __in_memory(self, path):
+        return os.path.dirname(str(path)) == self.memory_workspace
+
+    def read(self, path, bbox=None):
+        if self.__in_memory(path):
+            return self.dict_memory[path].copy()
+        file_path, layer = self.__location(path)
+        if file_path.endswith('.parquet'):
+            gdf = self.gpd.read_parquet(file_path, bbox=bbox)
+        else:
+            gdf = self.gpd.read_file(file_path, layer=layer, bbox=bbox)
+        # Area and length are derived from the geometry and recalculated on write
+        gdf = gdf.drop(columns=[f for f in gdf.columns if f in ('Shape_Area', 'Shape_Length')])
+        return gdf.reset_index(drop=True)
+
+    def write(self, gdf, path):
+        gdf = gdf.reset_index(drop=True)
+        if self.__in_memory(path):
+            self.dict_memory[path] = gdf
+            return
+        file_path, layer = self.__location(path)
+        if file_path.endswith('.parquet'):
+            gdf.to_parquet(file_path)
+        elif layer:
+            gdf.to_file(file_path, layer=layer, driver='GPKG' if file_path.endswith('.gpkg') else 'OpenFileGDB')
+        else:
+            gdf.to_file(file_path)
+
+    @staticmethod
+    def __geoms(gdf):
+        return gdf.geometry.to_numpy()
+
+    def __tree(self, gdf):
+        return self.shapely.STRtree(self.__geoms(gdf))
+
+    def __polygons(self, geoms):
+        # Keep only the polygonal part of overlay results, as the GIS tools do for polygon outputs
+        geoms = self.np.asarray(geoms)
+        types = self.shapely.get_type_id(geoms)
+        mixed = types == 7
+        if mixed.any():
+            geoms = geoms.copy()
+            for i in self.np.nonzero(mixed)[0]:
+                parts = [g for g in self.shapely.get_parts(geoms[i]) if self.shapely.get_type_id(g) in (3, 6)]
+                geoms[i] = self.shapely.union_all(parts) if parts else self.shapely.from_wkt('POLYGON EMPTY')
+            types = self.shapely.get_type_id(geoms)
+        return geoms, ((types == 3) | (types == 6)) & ~self.shapely.is_empty(geoms)
+
+    def __query(self, gdf, where_clause):
+        # Where clauses are evaluated by SQLite, which accepts the same SQL the file geodatabase does
+        import sqlite3
+        table = self.pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        table['Shape_Area'] = self.shapely.area(self.__geoms(gdf))
+        table['Shape_Length'] = self.shapely.length(self.__geoms(gdf))
+        table['_fid'] = self.np.arange(len(gdf))
+        for col in table.columns:
+            if str(table[col].dtype).startswith('datetime'):
+                table[col] = table[col].astype(str)
+        with sqlite3.connect(':memory:') as conn:
+            table.to_sql('t', conn, index=False)
+            return [row[0] for row in conn.execute('SELECT _fid FROM t WHERE {}'.format(where_clause))]
+
+    def select(self, in_features, out_features, where_clause=None, lst_ids=None, invert=False):
+        # Feature ids are positions in the whole layer, so only plain selections are clipped to the extent
+        gdf = self.read(in_features, bbox=self.bbox if lst_ids is None else None)
+        mask = self.np.ones(len(gdf), dtype=bool)
+        if where_clause:
+            mask[:] = False
+            mask[self.__query(gdf, where_clause)] = True
+        if lst_ids is not None:
+            id_mask = self.np.zeros(len(gdf), dtype=bool)
+            id_mask[list(lst_ids)] = True
+            mask &= id_mask
+        if invert:
+            mask = ~mask
+        self.write(gdf[mask], out_features)
+
+    def dissolve(self, in_features, out_features, lst_fields=None, multi_part='SINGLE_PART'):
+        gdf = self.read(in_features)
+        lst_fields = [lst_fields] if isinstance(lst_fields, str) else lst_fields
+        if lst_fields:
+            keys = gdf[lst_fields].astype(object).where(gdf[lst_fields].notnull(), None)
+            groups = gdf.groupby([keys[f] for f in lst_fields], dropna=False).indices
+            lst_keys = list(groups.keys())
+            in_geoms = self.__geoms(gdf)
+            geoms = [self.shapely.union_all(in_geoms[groups[k]]) for k in lst_keys]
+            data = dict((f, [k[i] if isinstance(k, tuple) else k for k in lst_keys])
+                        for i, f in enumerate(lst_fields))
+            out = self.gpd.GeoDataFrame(data, geometry=geoms, crs=gdf.crs)
+        else:
+            out = self.gpd.GeoDataFrame(geometry=[self.shapely.union_all(self.__geoms(gdf))], crs=gdf.crs)
+        if multi_part == 'SINGLE_PART':
+            out = out.explode(index_parts=False)
+        self.write(out, out_features)
+
+    def __pairs(self, left, right, predicate='intersects'):
+        i_left, i_right = self.__tree(right).query(self.__geoms(left), predicate=predicate)
+        return i_left, i_right
+
+    def __difference(self, left, right):
+        # Each left geometry minus the union of the right geometries that overlap it
+        i_left, i_right = self.__pairs(left, right)
+        geoms = self.__geoms(left).copy()
+        if len(i_left):
+            order = self.np.argsort(i_left, kind='stable')
+            i_left = i_left[order]
+            i_right = i_right[order]
+            lst_starts = self.np.flatnonzero(self.np.r_[True, i_left[1:] != i_left[:-1]])
+            lst_ends = self.np.r_[lst_starts[1:], len(i_left)]
+            u_left = i_left[lst_starts]
+            right_geoms = self.__geoms(right)
+            cover = [self.shapely.union_all(right_geoms[i_right[s:e]]) for s, e in zip(lst_starts, lst_ends)]
+            geoms[u_left] = self.shapely.difference(geoms[u_left], self.np.asarray(cover, dtype=object))
+        return geoms
+
+    def __join_columns(self, left, right):
+        # Duplicate field names get a _1 suffix, as the GIS overlay tools do
+        dict_rename = {}
+        for col in right.columns:
+            if col != right.geometry.name and col in left.columns:
+                dict_rename[col] = '{}_1'.format(col)
+        return right.rename(columns=dict_rename)
+
+    def __intersect_pair(self, left, right, fid_left=None, fid_right=None):
+        i_left, i_right = self.__pairs(left, right)
+        geoms, keep = self.__polygons(self.shapely.intersection(self.__geoms(left)[i_left],
+                                                                self.__geoms(right)[i_right]))
+        right = self.__join_columns(left, right)
+        lst_data = [left.drop(columns=left.geometry.name).iloc[i_left].reset_index(drop=True),
+                    right.drop(columns=right.geometry.name).iloc[i_right].reset_index(drop=True)]
+        if fid_left:
+            lst_data = [self.pd.DataFrame({fid_left: i_left}), lst_data[0],
+                        self.pd.DataFrame({fid_right: i_right}), lst_data[1]]
+        data = self.pd.concat(lst_data, axis=1)
+        return self.gpd.GeoDataFrame(data[keep], geometry=geoms[keep], crs=left.crs)
+
+    def intersect(self, lst_in_features, out_features):
+        out = self.read(lst_in_features[0])
+        for in_features in lst_in_features[1:]:
+            out = self.__intersect_pair(out, self.read(in_features))
+        self.write(out, out_features)
+
+    def union(self, lst_in_features, out_features):
+        left_name, right_name = [self.__name(in_features) for in_features in lst_in_features[:2]]
+        fid_left = 'FID_{}'.format(left_name)
+        fid_right = 'FID_{}'.format(right_name)
+        left = self.read(lst_in_features[0])
+        right = self.read(lst_in_features[1])
+
+        both = self.__intersect_pair(left, right, fid_left=fid_left, fid_right=fid_right)
+        lst_parts = [both]
+        for gdf, other, fid, other_fid, bl_left in [(left, right, fid_left, fid_right, True),
+                                                    (right, left, fid_right, fid_left, False)]:
+            geoms, keep = self.__polygons(self.__difference(gdf, other))
+            rest = self.pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+            if not bl_left:
+                rest = self.__join_columns(left, self.gpd.GeoDataFrame(rest, geometry=self.__geoms(gdf)))
+                rest = self.pd.DataFrame(rest.drop(columns=rest.geometry.name))
+            rest[fid] = self.np.arange(len(gdf))
+            rest[other_fid] = -1
+            # Attributes of the other input are blank where it has no feature, '' for text and 0 for numbers, as
+            # the GIS union writes them
+            for col in both.columns:
+                if col != both.geometry.name and col not in rest.columns:
+                    rest[col] = 0 if self.pd.api.types.is_numeric_dtype(both[col]) else ''
+            lst_parts.append(self.gpd.GeoDataFrame(rest[keep].reset_index(drop=True), geometry=geoms[keep],
+                                                   crs=left.crs))
+        out = self.pd.concat(lst_parts, ignore_index=True)
+        self.write(self.gpd.GeoDataFrame(out[both.columns], geometry=both.geometry.name, crs=left.crs), out_features)
+
+    def __eliminate(self, gdf, lst_slivers):
+        # Merge each sliver into the non sliver neighbour it shares the longest boundary with. Returns the new
+        # geometries and the positions of the merged slivers
+        geoms = self.__geoms(gdf).copy()
+        lst_merged = []
+        if not lst_slivers:
+            return geoms, lst_merged
+        is_sliver = self.np.zeros(len(gdf), dtype=bool)
+        is_sliver[lst_slivers] = True
+        slivers = gdf.iloc[lst_slivers]
+        i_sliver, i_other = self.__pairs(slivers, gdf, predicate='intersects')
+        keep = ~is_sliver[i_other]
+        i_sliver, i_other = i_sliver[keep], i_other[keep]
+        shared = self.shapely.length(self.shapely.intersection(
+            self.shapely.boundary(self.__geoms(slivers)[i_sliver]),
+            self.shapely.boundary(geoms[i_other])))
+        dict_target = {}
+        for s, o, length in zip(i_sliver, i_other, shared):
+            if length > 0 and length > dict_target.get(s, (None, 0))[1]:
+                dict_target[s] = (o, length)
+        dict_merge = {}
+        for s, (o, _) in dict_target.items():
+            dict_merge.setdefault(o, []).append(lst_slivers[s])
+        for o, lst_merge in dict_merge.items():
+            geoms[o] = self.shapely.union_all(self.np.concatenate([[geoms[o]], geoms[lst_merge]]))
+            lst_merged += lst_merge
+        return geoms, lst_merged
+
+    def eliminate(self, in_features, out_features, where_clause):
+        gdf = self.read(in_features)
+        geoms, lst_merged = self.__eliminate(gdf, self.__query(gdf, where_clause))
+        mask = self.np.ones(len(gdf), dtype=bool)
+        mask[lst_merged] = False
+        out = self.gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=geoms, crs=gdf.crs)
+        self.write(out[mask], out_features)
+
+    def merge_slivers(self, in_features, where_clause, drop_where_clause=None):
+        # The layer formats used here cannot be edited in place, so the layer is written back once
+        gdf = self.read(in_features)
+        geoms, lst_merged = self.__eliminate(gdf, self.__query(gdf, where_clause))
+        mask = self.np.ones(len(gdf), dtype=bool)
+        mask[lst_merged] = False
+        dropped = 0
+        if drop_where_clause:
+            lst_drop = [i for i in self.__query(gdf, drop_where_clause) if mask[i]]
+            mask[lst_drop] = False
+            dropped = len(lst_drop)
+        if lst_merged or dropped:
+            out = self.gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=geoms, crs=gdf.crs)
+            self.write(out[mask], in_features)
+        return len(lst_merged), dropped
+
+    def neighbours(self, in_features, where_clause=None):
+        gdf = self.read(in_features)
+        lst_ids = self.__query(gdf, where_clause) if where_clause else list(range(len(gdf)))
+        if not lst_ids:
+            return []
+        subset = gdf.iloc[lst_ids]
+        i_left, i_right = self.__pairs(subset, subset, predicate='intersects')
+        keep = i_left != i_right
+        i_left, i_right = i_left[keep], i_right[keep]
+        boundaries = self.shapely.boundary(self.__geoms(subset))
+        shared = self.shapely.length(self.shapely.intersection(boundaries[i_left], boundaries[i_right]))
+        return [(lst_ids[i], lst_ids[j], length) for i, j, length in zip(i_left.tolist(), i_right.tolist(),
+                                                                         shared.tolist()) if length > 0]
+
+    def merge(self, lst_in_features, out_features):
+        lst_gdfs = [self.read(in_features) for in_features in lst_in_features]
+        self.write(self.gpd.GeoDataFrame(self.pd.concat(lst_gdfs, ignore_index=True), crs=lst_gdfs[0].crs),
+                   out_features)
+
+    def select_by_location(self, in_features, overlap_type, select_features, where_clause=None,
+                           select_where_clause=None, select_ids=None, search_distance=None):
+        gdf = self.read(in_features)
+        lst_candidates = self.__query(gdf, where_clause) if where_clause else list(range(len(gdf)))
+        select = self.read(select_features)
+        lst_select = self.__query(select, select_where_clause) if select_where_clause else list(range(len(select)))
+        if select_ids is not None:
+            lst_select = sorted(set(lst_select) & set(select_ids))
+        if not lst_candidates or not lst_select:
+            return []
+
+        in_geoms = self.__geoms(gdf)[lst_candidates]
+        select_geoms = self.__geoms(select)[lst_select]
+        distance = parse_distance(search_distance)
+        if distance:
+            select_geoms = self.shapely.buffer(select_geoms, distance)
+            select_geoms = select_geoms[~self.shapely.is_empty(select_geoms)]
+        tree = self.shapely.STRtree(select_geoms)
+
+        if overlap_type == 'HAVE_THEIR_CENTER_IN':
+            centers = self.shapely.centroid(in_geoms)
+            outside = ~self.shapely.within(centers, in_geoms)
+            centers[outside] = self.shapely.point_on_surface(in_geoms[outside])
+            i_in = tree.query(centers, predicate='intersects')[0]
+        elif overlap_type == 'CONTAINS':
+            i_in = tree.query(in_geoms, predicate='contains')[0]
+        elif overlap_type == 'INTERSECT':
+            i_in = tree.query(in_geoms, predicate='intersects')[0]
+        else:
+            raise Exception('Unsupported overlap type {}'.format(overlap_type))
+        return sorted(set(lst_candidates[i] for i in i_in))
+
+    def erase(self, in_features, erase_features, out_features):
+        gdf = self.read(in_features)
+        geoms, keep = self.__polygons(self.__difference(gdf, self.read(erase_features)))
+        out = self.gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=geoms, crs=gdf.crs)
+        self.write(out[keep], out_features)
+
+    def simplify(self, in_features, out_features, tolerance=None, grid_size=None):
+        # Layers whose polygons do not overlap are simplified as a coverage, so shared edges move together and no
+        # gaps or overlaps open between neighbours. Overlapping layers are simplified polygon by polygon, preserving
+        # the topology of each
+        gdf = self.read(in_features)
+        geoms = self.__geoms(gdf)
+        if grid_size:
+            geoms = self.shapely.set_precision(geoms, grid_size)
+        if tolerance:
+            valid = ~self.shapely.is_missing(geoms) & ~self.shapely.is_empty(geoms)
+            if hasattr(self.shapely, 'coverage_simplify') and self.shapely.coverage_is_valid(geoms[valid]):
+                geoms = geoms.copy()
+                geoms[valid] = self.shapely.coverage_simplify(geoms[valid], tolerance)
+            else:
+                geoms = self.shapely.simplify(geoms, tolerance, preserve_topology=True)
+        geoms, keep = self.__polygons(geoms)
+        out = self.gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=geoms, crs=gdf.crs)
+        self.write(out[keep], out_features)
+
+    def geometry_summary(self, in_features, group_field):
+        gdf = self.read(in_features)
+        table = self.pd.DataFrame({'group': gdf[group_field].values,
+                                   'vertices': self.shapely.get_num_coordinates(self.__geoms(gdf)),
+                                   'area': self.shapely.area(self.__geoms(gdf))})
+        summary = table.groupby('group', dropna=False)[['vertices', 'area']].sum()
+        return dict((value, (int(row.vertices), float(row.area))) for value, row in summary.iterrows())
+
+    def create_workspace(self, path):
+        # Containers are created by the first layer written to them
+        if not os.path.splitext(path)[1] and not os.path.exists(path):
+            os.makedirs(path)
+
+    def exists(self, path):
+        if self.__in_memory(path):
+            return path in self.dict_memory
+        file_path, layer = self.__location(path)
+        if layer:
+            return os.path.exists(file_path) and layer in [row[0] for row in self.pyogrio.list_layers(file_path)]
+        return os.path.exists(file_path)
+
+    def delete(self, path):
+        if self.__in_memory(path):
+            self.dict_memory.pop(path, None)
+            return
+        file_path, layer = self.__location(path)
+        if layer:
+            if self.exists(path):
+                if file_path.endswith('.gpkg'):
+                    self.__drop_gpkg_layer(file_path, layer)
+                else:
+                    try:
+                        from osgeo import ogr
+                    except ImportError:
+                        raise Exception('Deleting {} needs GDAL\'s Python bindings (osgeo)'.format(path))
+                    ds = ogr.Open(file_path, 1)
+                    ds.DeleteLayer(layer)
+                    ds = None
+        elif os.path.exists(file_path):
+            os.remove(file_path)
+
+    @staticmethod
+    def __drop_gpkg_layer(file_path, layer):
+        # A GeoPackage is an SQLite database, so a layer is dropped with its spatial index and registry rows without
+        # needing GDAL's Python bindings
+        import sqlite3
+        con = sqlite3.connect(file_path)
+        try:
+            row = con.execute('SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?',
+                              (layer,)).fetchone()
+            con.execute('DROP TABLE IF EXISTS "{}"'.format(layer))
+            if row:
+                con.execute('DROP TABLE IF EXISTS "rtree_{}_{}"'.format(layer, row[0]))
+            for table in ('gpkg_geometry_columns', 'gpkg_extensions', 'gpkg_ogr_contents', 'gpkg_contents'):
+                if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                    con.execute('DELETE FROM {} WHERE table_name = ?'.format(table), (layer,))
+            con.commit()
+        finally:
+            con.close()
+
+    def count(self, in_features):
+        if self.__in_memory(in_features):
+            return len(self.dict_memory[in_features])
+        file_path, layer = self.__location(in_features)
+        if file_path.endswith('.parquet'):
+            import pyarrow.parquet
+            return pyarrow.parquet.ParquetFile(file_path).metadata.num_rows
+        return self.pyogrio.read_info(file_path, layer=layer)['features']
+
+    def copy(self, in_features, out_features):
+        self.write(self.read(in_features), out_features)
+
+    def add_field(self, in_features, field_name, field_type, field_length=None, value=None):
+        gdf = self.read(in_features)
+        gdf[field_name] = value
+        self.write(gdf, in_features)
+
+    def delete_fields(self, in_features, lst_fields):
+        if lst_fields:
+            gdf = self.read(in_features)
+            self.write(gdf.drop(columns=[f for f in lst_fields if f in gdf.columns]), in_features)
+
+    def list_fields(self, in_features):
+        return list(self.read(in_features).columns)
+
+    def values(self, in_features, lst_fields, where_clause=None, lst_ids=None):
+        gdf = self.read(in_features)
+        lst_rows = self.__query(gdf, where_clause) if where_clause else list(range(len(gdf)))
+        if lst_ids is not None:
+            lst_rows = sorted(set(lst_rows) & set(lst_ids))
+        return [tuple(row) for row in gdf.iloc[lst_rows][lst_fields].itertuples(index=False)]
+
+    def geometries(self, in_features, lst_fields, where_clause=None):
+        gdf = self.read(in_features)
+        lst_rows = self.__query(gdf, where_clause) if where_clause else list(range(len(gdf)))
+        lst_wkbs = self.shapely.to_wkb(self.__geoms(gdf)[lst_rows]).tolist()
+        return [(fid, wkb) + tuple(row) for fid, wkb, row in
+                zip(lst_rows, lst_wkbs, gdf.iloc[lst_rows][lst_fields].itertuples(index=False))]
+
+    def batches(self, in_features, lst_fields, chunk_size, where_clause=None):
+        lst_columns = [f for f in lst_fields if not f.startswith('SHAPE@') and f != 'OID@']
+        # Where clauses can refer to any field, so every field is read when one is given
+        offset = 0
+        for gdf in self.__chunks(in_features, None if where_clause else lst_columns, chunk_size):
+            # Feature ids are positions in the whole layer, as they are for select
+            ids = self.np.arange(offset, offset + len(gdf))
+            offset += len(gdf)
+            if where_clause:
+                lst_rows = self.__query(gdf, where_clause)
+                gdf = gdf.iloc[lst_rows]
+                ids = ids[lst_rows]
+            if not len(gdf):
+                continue
+            table = self.pd.DataFrame(gdf[lst_columns])
+            for col in lst_columns:
+                # Text columns are object or, from pandas 3, str; anything not numeric reads as text
+                if not self.pd.api.types.is_numeric_dtype(table[col]):
+                    table[col] = table[col].astype(object).where(table[col].notnull(), '')
+                elif table[col].dtype.kind == 'f' or table[col].isnull().any():
+                    table[col] = table[col].fillna(-1)
+            if 'SHAPE@AREA' in lst_fields:
+                table['SHAPE@AREA'] = self.shapely.area(self.__geoms(gdf))
+            if 'SHAPE@LENGTH' in lst_fields:
+                table['SHAPE@LENGTH'] = self.shapely.length(self.__geoms(gdf))
+            if 'SHAPE@X' in lst_fields or 'SHAPE@Y' in lst_fields:
+                centroids = self.shapely.centroid(self.__geoms(gdf))
+                table['SHAPE@X'] = self.shapely.get_x(centroids)
+                table['SHAPE@Y'] = self.shapely.get_y(centroids)
+            if 'OID@' in lst_fields:
+                table['OID@'] = ids
+            yield table[lst_fields].to_records(index=False)
+
+    def __chunks(self, in_features, lst_columns, chunk_size):
+        # Geometry is always read, where clauses may refer to Shape_Area
+        if self.__in_memory(in_features):
+            gdf = self.dict_memory[in_features]
+            for start in range(0, len(gdf), chunk_size):
+                yield gdf.iloc[start:start + chunk_size]
+            return
+        file_path, layer = self.__location(in_features)
+        if file_path.endswith('.parquet'):
+            import pyarrow.parquet
+            parquet = pyarrow.parquet.ParquetFile(file_path)
+            lst_read = None if lst_columns is None else lst_columns + ['geometry']
+            for batch in parquet.iter_batches(batch_size=chunk_size, columns=lst_read):
+                table = batch.to_pandas()
+                yield self.gpd.GeoDataFrame(table.drop(columns='geometry'),
+                                            geometry=self.shapely.from_wkb(table['geometry'].values))
+            return
+        skip = 0
+        while True:
+            gdf = self.gpd.read_file(file_path, layer=layer, columns=lst_columns, skip_features=skip,
+                                     max_features=chunk_size)
+            if not len(gdf):
+                return
+            yield gdf
+            skip += chunk_size
+
+    def digests(self, in_features):
+        gdf = self.read(in_features)
+        wkbs = self.shapely.to_wkb(self.__geoms(gdf))
+        lst_rows = gdf.drop(columns=gdf.geometry.name).itertuples(index=False, name=None)
+        return dict((i, hashlib.md5(repr(row).encode('utf-8') + (wkb or b'')).hexdigest())
+                    for i, (row, wkb) in enumerate(zip(lst_rows, wkbs)))
+
+    def update_rows(self, in_features, lst_fields, update_row):
+        # Feature ids are positions in the layer, as they are for batches
+        gdf = self.read(in_features)
+        for field in lst_fields:
+            if field not in gdf.columns:
+                gdf[field] = None
+        table = gdf[lst_fields].astype(object)
+        table = table.where(table.notnull(), None)
+        lst_rows = [list(update_row(fid, list(row))) for fid, row in enumerate(table.itertuples(index=False))]
+        for i, field in enumerate(lst_fields):
+            gdf[field] = self.pd.Series([row[i] for row in lst_rows], index=gdf.index, dtype=object)
+        self.write(gdf, in_features)
+
+    def replace_rows(self, in_features, where_clause, new_features):
+        gdf = self.read(in_features)
+        mask = self.np.ones(len(gdf), dtype=bool)
+        mask[self.__query(gdf, where_clause)] = False
+        new = self.read(new_features)
+        new = new[[col for col in new.columns if col in gdf.columns]]
+        self.write(self.gpd.GeoDataFrame(self.pd.concat([gdf[mask], new], ignore_index=True), crs=gdf.crs),
+                   in_features)
+
+    def set_extent(self, in_features):
+        self.bbox = tuple(self.read(in_features).total_bounds)
+
+    def clear_extent(self):
+        self.bbox = None
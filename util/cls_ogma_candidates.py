@@ -0,0 +1,50 @@
+import heapq
+
+from collections import defaultdict
+
+
+class OGMACandidates:
+    # Greedy choice of replacement OGMA from a polygon adjacency list. Candidates are taken inoperable first, then by
+    # the boundary they share with OGMA, existing or already chosen, then by area. Choosing a candidate adds its
+    # boundary to its neighbours, so the choice grows out from the existing OGMA rather than scattering
+    def __init__(self, lst_pairs, lst_ogma):
+        self.dict_neighbours = defaultdict(dict)
+        for fid, nbr, length in lst_pairs:
+            self.dict_neighbours[fid][nbr] = self.dict_neighbours[fid].get(nbr, 0) + length
+        self.set_ogma = set(lst_ogma)
+        self.set_selected = set()
+
+    def shared(self, fid):
+        return sum(length for nbr, length in self.dict_neighbours[fid].items()
+                   if nbr in self.set_ogma or nbr in self.set_selected)
+
+    def fill(self, dict_candidates, need):
+        # dict_candidates is {id: (inoperable, area)}. Candidates are chosen until their area reaches need and
+        # returned as [(id, shared boundary when chosen)] in the order they were chosen
+        heap = []
+        dict_shared = {}
+        for fid, (inoperable, area) in dict_candidates.items():
+            if fid not in self.set_selected:
+                dict_shared[fid] = self.shared(fid)
+                heapq.heappush(heap, self.__key(fid, inoperable, area, dict_shared[fid]))
+
+        lst_selected = []
+        total = 0
+        while heap and total < need:
+            _, neg_shared, _, fid = heapq.heappop(heap)
+            # Entries pushed before a neighbour was chosen are stale
+            if fid in self.set_selected or -neg_shared != dict_shared[fid]:
+                continue
+            self.set_selected.add(fid)
+            lst_selected.append((fid, dict_shared[fid]))
+            total += dict_candidates[fid][1]
+            for nbr, length in self.dict_neighbours[fid].items():
+                if nbr in dict_shared and nbr not in self.set_selected:
+                    dict_shared[nbr] += length
+                    heapq.heappush(heap, self.__key(nbr, dict_candidates[nbr][0], dict_candidates[nbr][1],
+                                                    dict_shared[nbr]))
+        return lst_selected
+
+    @staticmethod
+    def __key(fid, inoperable, area, shared):
+        return 0 if inoperable else 1, -shared, -area, fid
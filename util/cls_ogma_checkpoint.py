@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+
+from collections import OrderedDict
+from datetime import datetime as dt
+
+
+class OGMACheckpoint:
+    def __init__(self, manifest_file, lst_stages, content_root, backend, logger):
+        # Stages are recorded in pipeline order; a stage is only current when every input matches what the stage
+        # that produced it recorded, and every output it was last to write still matches on disk
+        self.manifest_file = manifest_file
+        self.lst_stages = lst_stages
+        self.content_root = os.path.normcase(os.path.abspath(content_root))
+        self.backend = backend
+        self.logger = logger
+        self.dict_fingerprints = {}
+        self.manifest = {'as_of': None, 'stages': OrderedDict()}
+
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    manifest = json.load(f, object_pairs_hook=OrderedDict)
+                self.manifest['as_of'] = manifest.get('as_of')
+                self.manifest['stages'] = manifest.get('stages', OrderedDict())
+            except ValueError:
+                self.logger.warning('Checkpoint manifest {} is unreadable, starting fresh'.format(self.manifest_file))
+
+    def save(self):
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+
+    def fingerprint(self, path):
+        if path not in self.dict_fingerprints:
+            self.dict_fingerprints[path] = self.__fingerprint(path)
+        return self.dict_fingerprints[path]
+
+    def fingerprints(self, lst_paths):
+        return OrderedDict((path, self.fingerprint(path)) for path in lst_paths)
+
+    def forget(self, lst_paths):
+        for path in lst_paths:
+            self.dict_fingerprints.pop(path, None)
+
+    def __fingerprint(self, path):
+        if not path:
+            return None
+        if os.path.isfile(path):
+            md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    md5.update(chunk)
+            return md5.hexdigest()
+
+        # Layers are described through arcpy wherever it is installed, so a run resumed on another backend on the
+        # same machine still matches what was recorded
+        try:
+            import arcpy
+        except ImportError:
+            return self.__backend_fingerprint(path)
+        if not arcpy.Exists(path):
+            return None
+
+        # Local products are hashed on content; source tables on the network are only described, a full read of
+        # a province-wide layer would cost more than the stage it guards
+        desc = arcpy.Describe(path)
+        lst_fields = [field.name for field in arcpy.ListFields(path)
+                      if field.type not in ('OID', 'Geometry', 'Blob', 'Raster', 'GlobalID')]
+        md5 = hashlib.md5()
+        md5.update(str(arcpy.GetCount_management(path)[0]).encode('utf-8'))
+        md5.update(','.join(lst_fields).encode('utf-8'))
+        if hasattr(desc, 'extent') and desc.extent:
+            md5.update('{0.XMin:.3f},{0.YMin:.3f},{0.XMax:.3f},{0.YMax:.3f}'.format(desc.extent).encode('utf-8'))
+
+        if os.path.normcase(os.path.abspath(path)).startswith(self.content_root):
+            lst_cursor_fields = lst_fields + (['SHAPE@AREA'] if hasattr(desc, 'shapeType') else [])
+            if lst_cursor_fields:
+                with arcpy.da.SearchCursor(path, lst_cursor_fields) as s_cursor:
+                    for row in s_cursor:
+                        md5.update(repr(row).encode('utf-8'))
+        return md5.hexdigest()
+
+    def __backend_fingerprint(self, path):
+        # Sources the backend cannot open, such as SDE tables without arcpy, have no fingerprint and never match
+        try:
+            if not self.backend.exists(path):
+                return None
+            lst_fields = self.backend.list_fields(path)
+            count = self.backend.count(path)
+        except Exception:
+            return None
+        md5 = hashlib.md5()
+        md5.update(str(count).encode('utf-8'))
+        md5.update(','.join(lst_fields).encode('utf-8'))
+        if os.path.normcase(os.path.abspath(path)).startswith(self.content_root):
+            for digest in sorted(self.backend.digests(path).values()):
+                md5.update(digest.encode('utf-8'))
+        return md5.hexdigest()
+
+    def __producer(self, stage, path):
+        # Latest recorded stage before this one that wrote the path
+        producer = None
+        for name in self.lst_stages[:self.lst_stages.index(stage)]:
+            record = self.manifest['stages'].get(name)
+            if record and path in record['outputs']:
+                producer = record
+        return producer
+
+    def __rewritten(self, stage, path):
+        # True if this stage or any recorded later stage writes the path
+        for name in self.lst_stages[self.lst_stages.index(stage):]:
+            record = self.manifest['stages'].get(name)
+            if record and path in record['outputs']:
+                return True
+        return False
+
+    def is_current(self, stage, lst_inputs, dict_params):
+        record = self.manifest['stages'].get(stage)
+        if not record:
+            self.logger.info('No checkpoint for {}'.format(stage))
+            return False
+        if record['params'] != json.loads(json.dumps(dict_params)):
+            self.logger.info('Parameters changed for {}'.format(stage))
+            return False
+        if list(record['inputs'].keys()) != list(lst_inputs):
+            self.logger.info('Inputs changed for {}'.format(stage))
+            return False
+
+        for path in lst_inputs:
+            producer = self.__producer(stage, path)
+            if producer:
+                expected = producer['outputs'][path]
+                if not self.__rewritten(stage, path) and self.fingerprint(path) != expected:
+                    self.logger.info('{} was modified after it was produced'.format(path))
+                    return False
+            else:
+                expected = self.fingerprint(path)
+            if record['inputs'][path] != expected:
+                self.logger.info('Input {} changed for {}'.format(path, stage))
+                return False
+
+        for path in record['outputs']:
+            later = self.lst_stages[self.lst_stages.index(stage) + 1:]
+            if any(path in self.manifest['stages'].get(name, {}).get('outputs', {}) for name in later):
+                continue
+            if self.fingerprint(path) != record['outputs'][path]:
+                self.logger.info('Output {} of {} is missing or modified'.format(path, stage))
+                return False
+        return True
+
+    def produced(self, path):
+        # Fingerprint the latest recorded stage wrote for path, None if no recorded stage wrote it. Unlike
+        # fingerprint this reads only the manifest
+        fingerprint = None
+        for record in self.manifest['stages'].values():
+            if path in record['outputs']:
+                fingerprint = record['outputs'][path]
+        return fingerprint
+
+    def state(self, stage):
+        return self.manifest['stages'][stage]['state']
+
+    def invalidate(self, stage):
+        for name in self.lst_stages[self.lst_stages.index(stage):]:
+            self.manifest['stages'].pop(name, None)
+        self.save()
+
+    def record(self, stage, dict_input_fps, dict_params, lst_outputs, dict_state=None):
+        self.forget(lst_outputs)
+        self.manifest['stages'][stage] = OrderedDict([
+            ('completed', dt.now().strftime('%Y-%m-%d %H:%M:%S')),
+            ('params', dict_params),
+            ('inputs', dict_input_fps),
+            ('outputs', self.fingerprints(lst_outputs)),
+            ('state', dict_state or {})
+        ])
+        # Keep the manifest in pipeline order regardless of the order stages were recorded in
+        self.manifest['stages'] = OrderedDict((name, self.manifest['stages'][name]) for name in self.lst_stages
+                                              if name in self.manifest['stages'])
+        self.save()
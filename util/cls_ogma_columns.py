@@ -0,0 +1,126 @@
+import json
+import os
+
+from collections import OrderedDict
+from util.cls_ogma_lazy import OGMALazyModule
+
+np = OGMALazyModule('numpy')
+
+
+class OGMAColumnStore:
+    # Fields of a layer kept as one .npy file each and memory mapped on load, so a later read neither parses nor
+    # copies them. Text fields are dictionary encoded: the file holds int32 codes into the distinct values listed in
+    # the manifest. The store is only used while the fingerprint of the layer it was built from still matches, or is
+    # updated in place when only some of the layer's rows were rebuilt since
+    manifest_name = 'columns.json'
+
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        self.manifest = None
+        manifest_file = os.path.join(self.path, self.manifest_name)
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, 'r') as f:
+                    self.manifest = json.load(f, object_pairs_hook=OrderedDict)
+            except ValueError:
+                self.logger.warning('Column store manifest {} is unreadable, rebuilding'.format(manifest_file))
+
+    def current(self, fingerprint, lst_fields):
+        return bool(self.manifest) and fingerprint is not None and self.manifest['fingerprint'] == fingerprint and \
+            all(field in self.manifest['fields'] for field in lst_fields)
+
+    def built_after(self, snapshot, lst_fields):
+        # True when the store holds lst_fields as they were after the refresh that saved snapshot
+        return bool(self.manifest) and snapshot is not None and self.manifest.get('snapshot') == snapshot and \
+            all(field in self.manifest['fields'] for field in lst_fields)
+
+    def mark(self, snapshot):
+        # Records that the store, still current, also holds the layer as it was after the refresh that saved snapshot
+        if self.manifest.get('snapshot') != snapshot:
+            self.manifest['snapshot'] = snapshot
+            with open(os.path.join(self.path, self.manifest_name), 'w') as f:
+                json.dump(self.manifest, f, indent=2)
+
+    def build(self, batches, lst_fields, fingerprint, snapshot=None):
+        # batches yields record arrays holding lst_fields, as backend.batches does
+        dict_chunks = OrderedDict((field, []) for field in lst_fields)
+        dict_codes = dict((field, OrderedDict()) for field in lst_fields)
+        rows = self.__read(batches, lst_fields, dict_chunks, dict_codes)
+        self.__write(dict_chunks, dict_codes, fingerprint, snapshot)
+        self.logger.info('Stored {:,} rows of {} fields in {}'.format(rows, len(lst_fields), self.path))
+
+    def update(self, batches, lst_fields, fingerprint, snapshot, field, lst_values):
+        # Drops the rows whose text field holds one of lst_values and appends those batches yields, which replace
+        # them in the layer. Existing codes keep their meaning, new values are coded after them
+        drop = np.isin(np.load(self.__file(field)), self.codes(field, lst_values))
+        dict_chunks = OrderedDict((name, [np.load(self.__file(name))[~drop]]) for name in lst_fields)
+        dict_codes = dict((name, OrderedDict((value, i) for i, value in enumerate(self.values(name) or [])))
+                          for name in lst_fields)
+        rows = self.__read(batches, lst_fields, dict_chunks, dict_codes)
+        self.__write(dict_chunks, dict_codes, fingerprint, snapshot)
+        self.logger.info('Replaced {:,} rows with {:,} in {}'.format(int(drop.sum()), rows, self.path))
+
+    @staticmethod
+    def __read(batches, lst_fields, dict_chunks, dict_codes):
+        rows = 0
+        for batch in batches:
+            rows += len(batch)
+            for field in lst_fields:
+                column = np.asarray(batch[field])
+                if column.dtype.kind in ('U', 'S', 'O'):
+                    values, inverse = np.unique(column.astype(np.str_), return_inverse=True)
+                    codes = dict_codes[field]
+                    lookup = np.array([codes.setdefault(value, len(codes)) for value in values.tolist()],
+                                      dtype='int32')
+                    column = lookup[inverse.reshape(-1)]
+                dict_chunks[field].append(column)
+        return rows
+
+    def __write(self, dict_chunks, dict_codes, fingerprint, snapshot):
+        # The manifest goes last so an interrupted write is never taken for a complete one. Columns are written
+        # under new names, a column still memory mapped by an earlier read cannot be overwritten on Windows
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        manifest_file = os.path.join(self.path, self.manifest_name)
+        if os.path.exists(manifest_file):
+            os.remove(manifest_file)
+        generation = (self.manifest or {}).get('generation', 0) + 1
+        lst_old = [os.path.join(self.path, entry['file']) for entry in self.manifest['fields'].values()] \
+            if self.manifest else []
+        rows = 0
+        manifest = OrderedDict([('fingerprint', fingerprint), ('snapshot', snapshot), ('generation', generation),
+                                ('rows', 0), ('fields', OrderedDict())])
+        for i, (field, lst_chunks) in enumerate(dict_chunks.items()):
+            file_name = 'column_{}_{}.npy'.format(generation, i)
+            column = np.concatenate(lst_chunks) if lst_chunks else np.zeros(0, dtype='int32')
+            rows = len(column)
+            np.save(os.path.join(self.path, file_name), column)
+            manifest['fields'][field] = OrderedDict([('file', file_name),
+                                                     ('values', list(dict_codes[field].keys()) if dict_codes[field]
+                                                      else None)])
+        manifest['rows'] = rows
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        self.manifest = manifest
+        for old_file in lst_old:
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+
+    def __file(self, field):
+        return os.path.join(self.path, self.manifest['fields'][field]['file'])
+
+    def column(self, field):
+        # Codes for text fields, values for the rest, memory mapped read only
+        return np.load(self.__file(field), mmap_mode='r')
+
+    def values(self, field):
+        # Distinct values of a text field by code, None for other fields
+        return self.manifest['fields'][field]['values']
+
+    def codes(self, field, lst_values):
+        # Codes of those of lst_values that occur in a text field
+        lst_all = self.values(field)
+        return [lst_all.index(value) for value in lst_values if value in lst_all]
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from util.cls_ogma_lazy import OGMALazyModule
+
+Environment = OGMALazyModule('environment', attribute='Environment')
+
+
+class OGMAConnectionManager:
+    # Connection files live in a folder unique to this manager, so concurrent runs never overwrite or delete each
+    # other's connections. A connection is created on its first acquire and deleted when the last holder releases
+    # it; worker processes are handed the connection file paths and read through them without acquiring
+    def __init__(self, username, password, logger, location=None):
+        self.username = username
+        self.password = password
+        self.logger = logger
+        self.location = location or os.path.join(tempfile.gettempdir(),
+                                                 'ogma_connections_{}_{}'.format(os.getpid(), uuid.uuid4().hex[:8]))
+        self.dict_paths = {}
+        self.dict_refs = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def acquire(self, name):
+        with self.lock:
+            if name not in self.dict_paths:
+                if not os.path.exists(self.location):
+                    os.makedirs(self.location)
+                self.dict_paths[name] = self.__create(name)
+                self.dict_refs[name] = 0
+            self.dict_refs[name] += 1
+            return self.dict_paths[name]
+
+    def release(self, name):
+        with self.lock:
+            if name not in self.dict_refs:
+                return
+            self.dict_refs[name] -= 1
+            if self.dict_refs[name] <= 0:
+                self.__delete(name)
+
+    def close(self):
+        with self.lock:
+            for name in list(self.dict_paths.keys()):
+                self.logger.debug('Closing {} connection with {} holder(s)'.format(name, self.dict_refs[name]))
+                self.__delete(name)
+            shutil.rmtree(self.location, ignore_errors=True)
+
+    def __create(self, name):
+        self.logger.info('Creating {} connection in {}'.format(name, self.location))
+        if name == 'lrm':
+            return Environment.create_lrm_connection(location=self.location, lrm_user_name='map_view_14',
+                                                     lrm_password='interface', logger=self.logger)
+        elif name == 'bcgw':
+            return Environment.create_bcgw_connection(location=self.location, bcgw_user_name=self.username,
+                                                      bcgw_password=self.password, logger=self.logger)
+        raise Exception('Unknown connection {}'.format(name))
+
+    def __delete(self, name):
+        if name == 'lrm':
+            Environment.delete_lrm_connection(location=self.location, logger=self.logger)
+        elif name == 'bcgw':
+            Environment.delete_bcgw_connection(location=self.location, logger=self.logger)
+        del self.dict_paths[name]
+        del self.dict_refs[name]
@@ -0,0 +1,87 @@
+import json
+import os
+
+from collections import Counter
+from collections import OrderedDict
+from datetime import datetime as dt
+
+
+class OGMAIncremental:
+    # Keeps a copy of each layer the resultant is built from as it was when the resultant was last refreshed.
+    # Features are compared on a digest of their attributes and geometry, so an edited feature shows up as one
+    # removed from the snapshot and one added to the current layer
+    def __init__(self, backend, workspace, manifest_file, logger):
+        self.backend = backend
+        self.workspace = workspace
+        self.manifest_file = manifest_file
+        self.logger = logger
+        self.manifest = {'id': None, 'params': None, 'as_of': None, 'layers': OrderedDict()}
+
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    manifest = json.load(f, object_pairs_hook=OrderedDict)
+                self.manifest['id'] = manifest.get('id')
+                self.manifest['params'] = manifest.get('params')
+                self.manifest['as_of'] = manifest.get('as_of')
+                self.manifest['layers'] = manifest.get('layers', OrderedDict())
+            except ValueError:
+                self.logger.warning('Snapshot manifest {} is unreadable, starting fresh'.format(self.manifest_file))
+
+    def snapshot(self, name):
+        return os.path.join(self.workspace, name.replace(' ', '_'))
+
+    def available(self, dict_params, lst_names):
+        # A snapshot can only be diffed against when it was taken with the same parameters and holds every layer
+        if not self.manifest['params']:
+            self.logger.info('No snapshot from a previous run')
+            return False
+        if self.manifest['params'] != json.loads(json.dumps(dict_params)):
+            self.logger.info('Parameters changed since the snapshot was taken')
+            return False
+        lst_missing = [name for name in lst_names
+                       if name not in self.manifest['layers'] or not self.backend.exists(self.snapshot(name))]
+        if lst_missing:
+            self.logger.info('Snapshot is missing {}'.format(', '.join(lst_missing)))
+            return False
+        return True
+
+    def changed(self, name, in_features):
+        # Ids of the features in in_features the snapshot does not have, and of the snapshot features in_features
+        # no longer has
+        dict_new = self.backend.digests(in_features)
+        dict_old = self.backend.digests(self.snapshot(name))
+        return self.__surplus(dict_new, dict_old), self.__surplus(dict_old, dict_new)
+
+    @staticmethod
+    def __surplus(dict_digests, dict_other):
+        # Identical features can occur more than once, each one is matched at most once
+        remaining = Counter(dict_other.values())
+        lst_ids = []
+        for fid in sorted(dict_digests):
+            if remaining[dict_digests[fid]] > 0:
+                remaining[dict_digests[fid]] -= 1
+            else:
+                lst_ids.append(fid)
+        return lst_ids
+
+    def save(self, dict_layers, dict_params, as_of):
+        # The manifest is cleared first so an interrupted save is never mistaken for a complete snapshot. Each save
+        # gets a new id, so products of the resultant can tell which refresh they were built after
+        self.manifest = {'id': None, 'params': None, 'as_of': None, 'layers': OrderedDict()}
+        self.__write()
+        self.backend.create_workspace(self.workspace)
+        for name, path in dict_layers.items():
+            self.logger.info('Snapshotting {}'.format(name))
+            if self.backend.exists(self.snapshot(name)):
+                self.backend.delete(self.snapshot(name))
+            self.backend.copy(in_features=path, out_features=self.snapshot(name))
+            self.manifest['layers'][name] = path
+        self.manifest['id'] = dt.now().strftime('%Y%m%d%H%M%S%f')
+        self.manifest['params'] = dict_params
+        self.manifest['as_of'] = as_of
+        self.__write()
+
+    def __write(self):
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
@@ -0,0 +1,32 @@
+import importlib
+import threading
+
+
+class OGMALazyModule:
+    # Stands in for a module, or a single attribute of one, and imports it on first use. arcpy checks out a
+    # licence on import, so deferring it keeps --help and runs that never reach a geoprocessing call fast
+    __lock = threading.Lock()
+
+    def __init__(self, name, attribute=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_attribute'] = attribute
+        self.__dict__['_target'] = None
+
+    def _load(self):
+        if self.__dict__['_target'] is None:
+            with OGMALazyModule.__lock:
+                if self.__dict__['_target'] is None:
+                    target = importlib.import_module(self._name)
+                    if self._attribute:
+                        target = getattr(target, self._attribute)
+                    self.__dict__['_target'] = target
+        return self.__dict__['_target']
+
+    def __getattr__(self, item):
+        return getattr(self._load(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self._load(), key, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+
+from collections import OrderedDict
+from util.cls_ogma_lazy import OGMALazyModule
+
+gpd = OGMALazyModule('geopandas')
+pd = OGMALazyModule('pandas')
+
+
+class OGMAParquetStore:
+    # A layer kept as GeoParquet with one hive style partition per value of partition_field, e.g.
+    # LANDSCAPE_UNIT_NAME=Moose/part-0.parquet. Rows in a partition are written in Hilbert curve order so every row
+    # group covers a compact area, and each row group carries bbox statistics. The bounds of every partition and row
+    # group are kept in _index.json, the spatial index read uses to open only the partitions a query touches
+    index_name = '_index.json'
+
+    def __init__(self, path, partition_field, logger, row_group_size=10000):
+        self.path = path
+        self.partition_field = partition_field
+        self.logger = logger
+        self.row_group_size = row_group_size
+        self.index = OrderedDict()
+        index_file = os.path.join(self.path, self.index_name)
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r') as f:
+                    self.index = json.load(f, object_pairs_hook=OrderedDict)
+            except ValueError:
+                self.logger.warning('Parquet index {} is unreadable, starting fresh'.format(index_file))
+
+    def partition(self, value):
+        from urllib.parse import quote
+        return '{}={}'.format(self.partition_field, quote(str(value), safe=' '))
+
+    def clear(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self.index = OrderedDict()
+
+    def write(self, gdf, value):
+        # Replaces the partition for value with gdf
+        self.remove(value)
+        if not len(gdf):
+            return
+        partition_dir = os.path.join(self.path, self.partition(value))
+        os.makedirs(partition_dir)
+        # The partition value is carried by the folder name, as hive partitioned readers expect
+        gdf = gdf.drop(columns=[f for f in gdf.columns if f == self.partition_field])
+        gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()].reset_index(drop=True)
+        gdf.to_parquet(os.path.join(partition_dir, 'part-0.parquet'), index=False, write_covering_bbox=True,
+                       row_group_size=self.row_group_size, compression='zstd')
+        lst_row_groups = [[float(v) for v in gdf.iloc[start:start + self.row_group_size].total_bounds]
+                          for start in range(0, len(gdf), self.row_group_size)]
+        self.index[str(value)] = OrderedDict([
+            ('file', '{}/part-0.parquet'.format(self.partition(value))),
+            ('rows', len(gdf)),
+            ('bounds', [float(v) for v in gdf.total_bounds]),
+            ('row_groups', lst_row_groups)
+        ])
+
+    def remove(self, value):
+        partition_dir = os.path.join(self.path, self.partition(value))
+        if os.path.exists(partition_dir):
+            shutil.rmtree(partition_dir)
+        self.index.pop(str(value), None)
+
+    def save(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, self.index_name), 'w') as f:
+            json.dump(self.index, f, indent=2)
+
+    def read(self, lst_values=None, bbox=None, lst_columns=None):
+        # Rows of the given partitions, all by default, that fall within bbox (minx, miny, maxx, maxy). Partitions
+        # outside bbox are skipped on the index, row groups outside it on their bbox statistics
+        lst_gdfs = []
+        for value, entry in self.index.items():
+            if lst_values is not None and value not in [str(v) for v in lst_values]:
+                continue
+            if bbox and not self.__overlaps(entry['bounds'], bbox):
+                continue
+            gdf = gpd.read_parquet(os.path.join(self.path, entry['file']), columns=lst_columns, bbox=bbox)
+            gdf[self.partition_field] = value
+            lst_gdfs.append(gdf)
+        if not lst_gdfs:
+            return None
+        return gpd.GeoDataFrame(pd.concat(lst_gdfs, ignore_index=True), crs=lst_gdfs[0].crs)
+
+    @staticmethod
+    def __overlaps(bounds, bbox):
+        return bounds[0] <= bbox[2] and bbox[0] <= bounds[2] and bounds[1] <= bbox[3] and bbox[1] <= bounds[3]
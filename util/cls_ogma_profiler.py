@@ -0,0 +1,135 @@
+import json
+import os
+import sys
+import threading
+import time
+
+
+def peak_rss():
+    # Peak resident set size of this process in MB, or None when it cannot be measured. psutil only reports the
+    # peak on Windows; elsewhere getrusage does, in KB on Linux and bytes on macOS
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1048576.0, 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def feature_count(backend, lst_features):
+    count = 0
+    for features in lst_features:
+        try:
+            count += backend.count(features)
+        except Exception:
+            return None
+    return count
+
+
+class OGMAProfiler:
+    def __init__(self, enabled, logger, backend):
+        # Feature counts are read through the backend the traced calls run on
+        self.enabled = enabled
+        self.logger = logger
+        self.backend = backend
+        self.lst_events = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.pid = os.getpid()
+
+    def trace(self, name, category='gp', in_features=None, out_features=None):
+        if not self.enabled:
+            return self.NullTrace()
+        return self.Trace(profiler=self, name=name, category=category, in_features=in_features,
+                          out_features=out_features)
+
+    def add_event(self, dict_event):
+        with self.lock:
+            self.lst_events.append(dict_event)
+
+    def write(self, summary_file, trace_file):
+        if not self.enabled:
+            return
+        lst_events = sorted(self.lst_events, key=lambda e: e['start'])
+        dict_stages = {}
+        for event in lst_events:
+            if event['category'] == 'stage':
+                dict_stages[event['name']] = {'wall': event['wall'], 'cpu': event['cpu'],
+                                              'peak_rss_mb': event['peak_rss_mb']}
+        with open(summary_file, 'w') as f:
+            json.dump({'stages': dict_stages, 'events': lst_events}, f, indent=2)
+
+        # Chrome trace format, open with chrome://tracing or ui.perfetto.dev
+        lst_trace = []
+        for event in lst_events:
+            lst_trace.append({'name': event['name'], 'cat': event['category'], 'ph': 'X', 'pid': self.pid,
+                              'tid': event['thread'], 'ts': int(event['start'] * 1000000),
+                              'dur': int(event['wall'] * 1000000),
+                              'args': dict((k, event[k]) for k in ('cpu', 'peak_rss_mb', 'count_in', 'count_out',
+                                                                   'rows_per_sec'))})
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': lst_trace, 'displayTimeUnit': 'ms'}, f)
+        self.logger.info('Profile written to {} and {}'.format(summary_file, trace_file))
+
+    class Trace:
+        def __init__(self, profiler, name, category, in_features, out_features):
+            self.profiler = profiler
+            self.name = name
+            self.category = category
+            self.in_features = self.as_list(in_features)
+            self.out_features = self.as_list(out_features)
+            self.rows = None
+            self.count_in = None
+            self.wall_start = None
+            self.cpu_start = None
+
+        @staticmethod
+        def as_list(features):
+            if features is None:
+                return []
+            return list(features) if isinstance(features, (list, tuple)) else [features]
+
+        def cpu_time(self):
+            # A stage fans work out to other threads, a single call runs on the calling thread
+            return time.process_time() if self.category == 'stage' else time.thread_time()
+
+        def __enter__(self):
+            self.count_in = feature_count(self.profiler.backend, self.in_features) if self.in_features else None
+            self.wall_start = time.time()
+            self.cpu_start = self.cpu_time()
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            wall = time.time() - self.wall_start
+            cpu = self.cpu_time() - self.cpu_start
+            count_out = feature_count(self.profiler.backend, self.out_features) \
+                if self.out_features and not exc_type else None
+            rows = self.rows if self.rows is not None else self.count_in
+            self.profiler.add_event({
+                'name': self.name,
+                'category': self.category,
+                'thread': threading.current_thread().ident,
+                'start': round(self.wall_start - self.profiler.start, 6),
+                'wall': round(wall, 6),
+                'cpu': round(cpu, 6),
+                'peak_rss_mb': peak_rss(),
+                'count_in': self.count_in,
+                'count_out': count_out,
+                'rows_per_sec': round(rows / wall, 1) if rows and wall > 0 else None,
+                'failed': exc_type is not None
+            })
+            return False
+
+    class NullTrace:
+        rows = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            return False
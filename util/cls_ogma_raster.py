@@ -0,0 +1,51 @@
+import math
+
+from util.cls_ogma_lazy import OGMALazyModule
+
+np = OGMALazyModule('numpy')
+features = OGMALazyModule('rasterio.features')
+transform = OGMALazyModule('rasterio.transform')
+box = OGMALazyModule('shapely', attribute='box')
+
+
+class OGMARasterGrid:
+    # Square cells of cell_size metres over bounds, processed a tile at a time so memory is bounded by the tile
+    # rather than the extent. Layers are burned as the position of the feature covering each cell centre, so any of
+    # their attributes can be gathered onto the cells; where features overlap the last one drawn wins
+    def __init__(self, bounds, cell_size, tile_cells=1024):
+        self.minx, self.miny, self.maxx, self.maxy = bounds
+        self.cell_size = cell_size
+        self.tile_cells = tile_cells
+        self.width = int(math.ceil((self.maxx - self.minx) / cell_size))
+        self.height = int(math.ceil((self.maxy - self.miny) / cell_size))
+        self.cell_area = cell_size * cell_size
+
+    def tiles(self):
+        # (bounds, shape, transform) of each tile, row by row from the top left
+        for row in range(0, self.height, self.tile_cells):
+            for col in range(0, self.width, self.tile_cells):
+                rows = min(self.tile_cells, self.height - row)
+                cols = min(self.tile_cells, self.width - col)
+                left = self.minx + col * self.cell_size
+                top = self.maxy - row * self.cell_size
+                yield (left, top - rows * self.cell_size, left + cols * self.cell_size, top), (rows, cols), \
+                    transform.from_origin(left, top, self.cell_size, self.cell_size)
+
+    @staticmethod
+    def burn(gdf, tile):
+        # Position in gdf of the feature covering each cell of the tile, -1 where there is none. Only the features
+        # the spatial index finds in the tile are drawn
+        bounds, shape, tile_transform = tile
+        lst_positions = gdf.sindex.query(box(*bounds), predicate='intersects')
+        if not len(lst_positions):
+            return np.full(shape, -1, dtype='int32')
+        geoms = gdf.geometry.values
+        return features.rasterize(((geoms[i], int(i)) for i in sorted(lst_positions)), out_shape=shape,
+                                  transform=tile_transform, fill=-1, dtype='int32')
+
+    @staticmethod
+    def gather(values, ids, null):
+        # Attribute values of the burned features, null where a cell has none
+        if not len(values):
+            return np.full(ids.shape, null)
+        return np.where(ids >= 0, values[np.maximum(ids, 0)], null)
@@ -0,0 +1,34 @@
+from util.cls_ogma_lazy import OGMALazyModule
+
+np = OGMALazyModule('numpy')
+
+
+class OGMARuleTable:
+    # Ordered rules of (value, condition); the first rule whose condition holds decides the value, as an if/elif
+    # chain would. A condition takes the column arrays of a batch by field name and returns a boolean mask, so a
+    # batch is classified with a few array operations whatever its size
+    def __init__(self, lst_fields, default=None):
+        self.lst_fields = lst_fields
+        self.default = default
+        self.lst_rules = []
+
+    def add_rule(self, value, condition):
+        self.lst_rules.append((value, condition))
+        return self
+
+    def classify(self, batch):
+        # batch is a record array or a dict of equal length arrays. Text columns read as unicode so the np.char
+        # functions apply; batches hold nulls as '' and -1
+        dict_columns = {}
+        for field in self.lst_fields:
+            column = np.asarray(batch[field])
+            dict_columns[field] = column.astype(np.str_) if column.dtype.kind == 'O' else column
+        size = len(dict_columns[self.lst_fields[0]])
+
+        values = np.full(size, self.default, dtype=object)
+        unassigned = np.ones(size, dtype=bool)
+        for value, condition in self.lst_rules:
+            mask = unassigned & np.asarray(condition(dict_columns), dtype=bool)
+            values[mask] = value
+            unassigned &= ~mask
+        return values
@@ -0,0 +1,111 @@
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class OGMAScheduler:
+    def __init__(self, workers, logger):
+        self.workers = max(1, int(workers))
+        self.logger = logger
+        self.dict_nodes = OrderedDict()
+        self.start = None
+
+    def add_node(self, name, func, lst_deps=None):
+        self.dict_nodes[name] = self.Node(name=name, func=func, lst_deps=lst_deps or [])
+
+    def run(self):
+        for node in self.dict_nodes.values():
+            for dep in node.lst_deps:
+                if dep not in self.dict_nodes:
+                    raise Exception('Node {} depends on unknown node {}'.format(node.name, dep))
+
+        lst_pending = list(self.dict_nodes.keys())
+        lst_done = []
+        dict_running = {}
+        error = None
+        self.start = time.time()
+
+        # Nodes are submitted in declaration order as soon as their dependencies finish, so with a single worker
+        # the graph runs exactly in the order it was declared
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while lst_pending or dict_running:
+                if not error:
+                    for name in [n for n in lst_pending if all(d in lst_done for d in self.dict_nodes[n].lst_deps)]:
+                        if len(dict_running) >= self.workers:
+                            break
+                        lst_pending.remove(name)
+                        dict_running[executor.submit(self.__run_node, self.dict_nodes[name])] = name
+                if not dict_running:
+                    if error:
+                        break
+                    raise Exception('Dependency cycle between {}'.format(', '.join(lst_pending)))
+
+                finished, _ = wait(list(dict_running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = dict_running.pop(future)
+                    try:
+                        future.result()
+                        lst_done.append(name)
+                    except Exception as e:
+                        self.logger.error('{} failed: {}'.format(name, e))
+                        error = error or e
+        if error:
+            raise error
+
+    def __run_node(self, node):
+        self.logger.debug('Starting {}'.format(node.name))
+        node.start = time.time() - self.start
+        node.func()
+        node.end = time.time() - self.start
+
+    def critical_path(self):
+        # Longest chain of dependent node durations through the graph
+        dict_finish = {}
+        dict_previous = {}
+        for name, node in self.dict_nodes.items():
+            if node.end is None:
+                continue
+            previous = None
+            for dep in node.lst_deps:
+                if dep in dict_finish and (previous is None or dict_finish[dep] > dict_finish[previous]):
+                    previous = dep
+            dict_finish[name] = node.end - node.start + (dict_finish[previous] if previous else 0)
+            dict_previous[name] = previous
+
+        if not dict_finish:
+            return [], 0
+        name = max(dict_finish, key=dict_finish.get)
+        total = dict_finish[name]
+        lst_path = []
+        while name:
+            lst_path.insert(0, name)
+            name = dict_previous[name]
+        return lst_path, total
+
+    def report(self, report_file=None):
+        lst_path, total = self.critical_path()
+        wall = max([node.end for node in self.dict_nodes.values() if node.end is not None] or [0])
+        lst_lines = ['Wall time: {:.1f}s with {} worker(s)'.format(wall, self.workers),
+                     'Critical path: {:.1f}s'.format(total)]
+        for name in lst_path:
+            node = self.dict_nodes[name]
+            lst_lines.append('  {:<40} {:>8.1f}s'.format(name, node.end - node.start))
+        lst_lines.append('All nodes:')
+        for node in sorted([n for n in self.dict_nodes.values() if n.end is not None], key=lambda n: n.start):
+            lst_lines.append('  {:<40} start {:>8.1f}s  end {:>8.1f}s{}'.format(
+                node.name, node.start, node.end, '  *' if node.name in lst_path else ''))
+
+        for line in lst_lines:
+            self.logger.info(line)
+        if report_file:
+            with open(report_file, 'w') as f:
+                f.write('\n'.join(lst_lines) + '\n')
+
+    class Node:
+        def __init__(self, name, func, lst_deps):
+            self.name = name
+            self.func = func
+            self.lst_deps = lst_deps
+            self.start = None
+            self.end = None
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from collections import OrderedDict
+
+
+class OGMAScratch:
+    # Intermediate feature classes are kept in the backend's memory workspace while their estimated size fits the
+    # budget and spill to a workspace on local disk beyond it. Nothing handed out here is written to the output share
+    def __init__(self, backend, budget_mb, logger, local_dir=None, bytes_per_feature=4096):
+        self.backend = backend
+        self.budget_mb = budget_mb
+        self.logger = logger
+        self.local_dir = local_dir or tempfile.gettempdir()
+        self.bytes_per_feature = bytes_per_feature
+        self.scratch_dir = None
+        self.dict_sizes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, name, lst_inputs, feature_count=0):
+        # The size of an intermediate is estimated from the feature count of the inputs it is built from, plus
+        # feature_count for what the caller already knows it will hold, such as a selection by feature ids
+        estimate = feature_count * self.bytes_per_feature / 1048576.0
+        for in_features in lst_inputs:
+            estimate += self.backend.count(in_features) * self.bytes_per_feature / 1048576.0
+
+        with self.lock:
+            unique_name = '{}_{}'.format(name, uuid.uuid4().hex[:8])
+            if self.memory_mb() + estimate <= self.budget_mb:
+                path = os.path.join(self.backend.memory_workspace, unique_name)
+            else:
+                path = os.path.join(self.__disk_workspace(), unique_name)
+                self.logger.debug('{} spills to {}, about {:.0f} MB'.format(name, path, estimate))
+            self.dict_sizes[path] = estimate
+        return path
+
+    def memory_mb(self):
+        return sum(size for path, size in self.dict_sizes.items()
+                   if os.path.dirname(path) == self.backend.memory_workspace)
+
+    def __disk_workspace(self):
+        if self.scratch_dir is None:
+            self.scratch_dir = tempfile.mkdtemp(prefix='ogma_scratch_', dir=self.local_dir)
+            self.backend.create_workspace(os.path.join(self.scratch_dir, self.backend.scratch_workspace))
+        return os.path.join(self.scratch_dir, self.backend.scratch_workspace)
+
+    def delete(self, path):
+        if self.backend.exists(path):
+            self.backend.delete(path)
+        with self.lock:
+            self.dict_sizes.pop(path, None)
+
+    def close(self):
+        for path in list(self.dict_sizes.keys()):
+            self.delete(path)
+        if self.scratch_dir:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            self.scratch_dir = None
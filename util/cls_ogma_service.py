@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+
+class OGMAQueryService:
+    # Answers area and target queries over the statistics of a run as JSON on a local port. Requests are GETs:
+    #   /fields                                          the fields records can be filtered and grouped on
+    #   /area?ndt=NDT1&zone=ESSFwc&age_type=OLD          area of the matching records, group_by=lu,op_area rolls up
+    #   /targets?lu=Moose&level=OPERATING_AREA           mature + old and old against target, as in the report
+    # Filters take comma separated values and ignore case; years=N queries the statistics projected N years ahead.
+    # Answers are kept in an LRU cache and queries run on a thread pool, so a slow query does not hold up the rest
+    def __init__(self, dict_records, lst_fields, summarize, logger, cache_size=256, workers=4):
+        # dict_records is {years ahead: [record]}, 0 for now; each record holds lst_fields and ends with its area.
+        # summarize(years) returns the target rows for those statistics as dicts
+        self.dict_records = dict_records
+        self.lst_fields = lst_fields
+        self.summarize = summarize
+        self.logger = logger
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def serve(self, host='127.0.0.1', port=8080):
+        try:
+            asyncio.run(self.__serve(host, port))
+        except KeyboardInterrupt:
+            self.logger.info('Query service stopped')
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def __serve(self, host, port):
+        server = await asyncio.start_server(self.__handle, host, port)
+        self.logger.info('Query service listening on http://{}:{}/'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def __handle(self, reader, writer):
+        status, body = 200, None
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            method, target = request_line.split(' ')[:2]
+            if method != 'GET':
+                status, body = 405, {'error': 'Only GET is supported'}
+            else:
+                body = await self.answer(target)
+        except KeyError as e:
+            status, body = 404, {'error': 'Unknown query {}'.format(e)}
+        except ValueError as e:
+            status, body = 400, {'error': str(e)}
+        except Exception as e:
+            self.logger.error('Query failed: {}'.format(e))
+            status, body = 500, {'error': str(e)}
+
+        data = json.dumps(body, indent=2).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n'
+                     '\r\n'.format(status, {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                                            500: 'Internal Server Error'}[status], len(data)).encode('latin-1'))
+        writer.write(data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def answer(self, target):
+        parts = urlsplit(target)
+        path = parts.path.strip('/')
+        dict_params = dict((key, ','.join(values)) for key, values in parse_qs(parts.query).items())
+        key = (path, tuple(sorted(dict_params.items())))
+        if path == 'fields':
+            return self.query(path, dict_params)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, self.query, path, dict_params)
+        self.cache[key] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def query(self, path, dict_params):
+        dict_params = dict(dict_params)
+        try:
+            years = int(dict_params.pop('years', 0) or 0)
+        except ValueError:
+            raise ValueError('years has to be a whole number')
+        if years not in self.dict_records:
+            raise ValueError('No statistics {} years ahead, there are {}'.format(
+                years, ', '.join(str(y) for y in sorted(self.dict_records))))
+
+        if path == 'fields':
+            return {'fields': self.lst_fields[:-1], 'years': sorted(self.dict_records),
+                    'cache': {'size': len(self.cache), 'hits': self.hits, 'misses': self.misses}}
+        elif path == 'area':
+            lst_group = [f.strip() for f in dict_params.pop('group_by', '').split(',') if f.strip()]
+            lst_filters = [(self.lst_fields.index(field), values)
+                           for field, values in self.__filters(dict_params, self.lst_fields[:-1])]
+            for field in lst_group:
+                if field not in self.lst_fields[:-1]:
+                    raise ValueError('Cannot group by {}'.format(field))
+            lst_group_idx = [self.lst_fields.index(field) for field in lst_group]
+            dict_area = OrderedDict()
+            total = 0
+            for record in self.dict_records[years]:
+                if all(str(record[i]).upper() in values for i, values in lst_filters):
+                    group = tuple(record[i] for i in lst_group_idx)
+                    dict_area[group] = dict_area.get(group, 0) + record[-1]
+                    total += record[-1]
+            lst_rows = [dict(list(zip(lst_group, group)) + [('area_ha', round(area, 4))])
+                        for group, area in sorted(dict_area.items(), key=lambda item: [str(v) for v in item[0]])]
+            return {'years': years, 'filters': dict_params, 'group_by': lst_group, 'total_ha': round(total, 4),
+                    'rows': lst_rows}
+        elif path == 'targets':
+            lst_rows = self.summarize(years)
+            lst_filters = self.__filters(dict_params, list(lst_rows[0].keys()) if lst_rows else [])
+            return {'years': years, 'filters': dict_params,
+                    'rows': [row for row in lst_rows
+                             if all(str(row[field]).upper() in values for field, values in lst_filters)]}
+        raise KeyError(path)
+
+    @staticmethod
+    def __filters(dict_params, lst_fields):
+        lst_filters = []
+        for field, value in dict_params.items():
+            if field not in lst_fields:
+                raise ValueError('Cannot filter on {}, use one of {}'.format(field, ', '.join(lst_fields)))
+            lst_filters.append((field, set(v.strip().upper() for v in value.split(','))))
+        return lst_filters
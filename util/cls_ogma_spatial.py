@@ -0,0 +1,58 @@
+from util.cls_ogma_lazy import OGMALazyModule
+
+np = OGMALazyModule('numpy')
+shapely = OGMALazyModule('shapely')
+
+
+class OGMASpatialLayer:
+    # Features of a layer held in process as shapely geometries under an STRtree, with their feature ids and
+    # attributes, so location predicates against other layers are evaluated for all features at once instead of
+    # through a chain of layer selections
+    def __init__(self, lst_ids, geoms, dict_values):
+        self.lst_ids = lst_ids
+        self.geoms = geoms
+        self.dict_values = dict_values
+        self.tree = shapely.STRtree(geoms)
+
+    @classmethod
+    def from_rows(cls, lst_rows, lst_fields):
+        # lst_rows are (feature id, WKB, *lst_fields), as backend.geometries returns them
+        geoms = shapely.from_wkb(np.array([bytes(row[1]) if row[1] else None for row in lst_rows], dtype=object))
+        dict_values = dict((field, np.array([row[i + 2] for row in lst_rows], dtype=object))
+                           for i, field in enumerate(lst_fields))
+        return cls(lst_ids=[row[0] for row in lst_rows], geoms=geoms, dict_values=dict_values)
+
+    def __len__(self):
+        return len(self.lst_ids)
+
+    def values(self, field):
+        return self.dict_values[field]
+
+    def subset(self, mask):
+        return OGMASpatialLayer(lst_ids=[fid for fid, keep in zip(self.lst_ids, mask) if keep],
+                                geoms=self.geoms[mask],
+                                dict_values=dict((field, values[mask]) for field, values in self.dict_values.items()))
+
+    def buffer(self, distance):
+        # A negative distance shrinks the features, as a negative search distance does; features that vanish are
+        # dropped
+        geoms = shapely.buffer(self.geoms, distance)
+        return OGMASpatialLayer(lst_ids=self.lst_ids, geoms=geoms, dict_values=self.dict_values) \
+            .subset(~shapely.is_empty(geoms))
+
+    def centres(self):
+        # Centroids, or a point inside the feature where the centroid falls outside it, as HAVE_THEIR_CENTER_IN uses
+        centres = shapely.centroid(self.geoms)
+        outside = ~shapely.within(centres, self.geoms)
+        centres[outside] = shapely.point_on_surface(self.geoms[outside])
+        return centres
+
+    def hits(self, geoms, predicate):
+        # True for each of geoms where predicate(geom, feature) holds for at least one feature of the layer
+        mask = np.zeros(len(geoms), dtype=bool)
+        if len(self) and len(geoms):
+            mask[self.tree.query(geoms, predicate=predicate)[0]] = True
+        return mask
+
+    def ids(self, mask):
+        return [fid for fid, keep in zip(self.lst_ids, mask) if keep]
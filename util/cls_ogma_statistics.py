@@ -1,6 +1,21 @@
+import hashlib
+import json
+
 from collections import defaultdict
 
 
+def canonical_form(value):
+    # Nested statistics as plain lists with the keys sorted and areas rounded, so the same rows give the same form
+    # whatever order they were added in
+    if isinstance(value, dict):
+        return [[key, canonical_form(value[key])] for key in sorted(value, key=str)]
+    if hasattr(value, '__dict__'):
+        return canonical_form(vars(value))
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
 class OGMAStatistics:
     def __init__(self):
         self.nat_disturbance = defaultdict(self.NatDisturbance)
@@ -16,6 +31,9 @@ class OGMAStatistics:
             self.area += self.nat_disturbance[val].area
         return self.area
 
+    def digest(self):
+        return hashlib.md5(json.dumps(canonical_form(self)).encode('utf-8')).hexdigest()
+
     class NatDisturbance:
         def __init__(self):
             self.zone = defaultdict(self.Zone)
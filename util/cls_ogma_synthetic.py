@@ -0,0 +1,196 @@
+import arcpy
+import csv
+import math
+import os
+import random
+
+from datetime import datetime as dt
+
+
+class OGMASynthetic:
+    # Deterministic stand-in for the analysis inputs, laid out on a grid of 1 ha square polygons so that a scale
+    # of n polygons covers n hectares
+    cell_size = 100
+    origin_x = 1400000
+    origin_y = 500000
+    lr_plan = 'Okanagan Shuswap Land and Resource Management Plan'
+    dict_bec = {
+        'NDT1': ['ESSFwc', 'ICHwk'],
+        'NDT2': ['ICHmw', 'ESSFwm'],
+        'NDT3': ['MSdm', 'ICHdw', 'SBSmm'],
+        'NDT4': ['IDFdk', 'PPxh']
+    }
+
+    def __init__(self, workspace, n_polygons, seed, logger):
+        self.workspace = workspace
+        self.n_polygons = int(n_polygons)
+        self.seed = seed
+        self.logger = logger
+        self.gdb = os.path.join(self.workspace, 'synthetic_{}_{}.gdb'.format(self.n_polygons, self.seed))
+        self.target_file = os.path.join(self.workspace, 'synthetic_targets_{}.csv'.format(self.seed))
+        self.sr = arcpy.SpatialReference(3005)
+
+        self.n_cols = int(math.ceil(math.sqrt(self.n_polygons)))
+        self.n_rows = int(math.ceil(self.n_polygons / float(self.n_cols)))
+        self.n_lu_side = max(2, min(6, int(math.sqrt(self.n_polygons / 50000.0)) + 1))
+
+        self.fc_lu = os.path.join(self.gdb, 'landscape_unit')
+        self.fc_aoi = os.path.join(self.gdb, 'aoi')
+        self.fc_lr_plans = os.path.join(self.gdb, 'lr_plans')
+        self.fc_beo = os.path.join(self.gdb, 'beo')
+        self.fc_ogma = os.path.join(self.gdb, 'ogma')
+        self.fc_operability = os.path.join(self.gdb, 'operability')
+        self.fc_cutblocks = os.path.join(self.gdb, 'consolidated_cutblocks')
+        self.fc_resultant = os.path.join(self.gdb, 'resultant')
+
+    def exists(self):
+        return all(arcpy.Exists(fc) for fc in [self.fc_lu, self.fc_aoi, self.fc_lr_plans, self.fc_beo, self.fc_ogma,
+                                                self.fc_operability, self.fc_cutblocks, self.fc_resultant]) and \
+            os.path.exists(self.target_file)
+
+    def generate(self):
+        if self.exists():
+            self.logger.info('Using existing synthetic data {}'.format(self.gdb))
+            return
+        self.logger.info('Generating {:,} synthetic polygons in {}'.format(self.n_polygons, self.gdb))
+        if not os.path.exists(self.workspace):
+            os.makedirs(self.workspace)
+        if arcpy.Exists(self.gdb):
+            arcpy.Delete_management(in_data=self.gdb)
+        arcpy.CreateFileGDB_management(out_folder_path=self.workspace, out_name=os.path.basename(self.gdb))
+
+        rnd = random.Random(self.seed)
+        self.__landscape_units(rnd)
+        self.__extent_polygon(self.fc_aoi, [])
+        self.__extent_polygon(self.fc_lr_plans, [('STRGC_LAND_RSRCE_PLAN_NAME', 'TEXT', 75, self.lr_plan)])
+        self.__beo()
+        self.__patches(rnd, self.fc_ogma, [('STATUS', 'TEXT', 25, 'OGMA')], 0.08)
+        self.__patches(rnd, self.fc_operability, [('OPERABLE', 'TEXT', 25, 'OPERABLE')], 0.45)
+        self.__patches(rnd, self.fc_cutblocks, [('HARVEST_YEAR', 'SHORT', None, None)], 0.12)
+        self.__resultant(rnd)
+        self.__targets()
+
+    def __create(self, fc, lst_fields):
+        arcpy.CreateFeatureclass_management(out_path=os.path.dirname(fc), out_name=os.path.basename(fc),
+                                            geometry_type='POLYGON', spatial_reference=self.sr)
+        for name, field_type, length, _ in lst_fields:
+            arcpy.AddField_management(in_table=fc, field_name=name, field_type=field_type, field_length=length)
+
+    def __square(self, col, row, width=1, height=1):
+        x = self.origin_x + col * self.cell_size
+        y = self.origin_y + row * self.cell_size
+        w = width * self.cell_size
+        h = height * self.cell_size
+        return 'POLYGON (({0} {1}, {0} {3}, {2} {3}, {2} {1}, {0} {1}))'.format(x, y, x + w, y + h)
+
+    def lu_index(self, col, row):
+        return (row * self.n_lu_side // self.n_rows) * self.n_lu_side + col * self.n_lu_side // self.n_cols
+
+    def lu_name(self, i_lu):
+        return 'Synthetic {:02d}'.format(i_lu + 1)
+
+    def ndt(self, row):
+        return sorted(self.dict_bec.keys())[row * len(self.dict_bec) // self.n_rows]
+
+    def zone(self, col, row):
+        lst_zones = self.dict_bec[self.ndt(row)]
+        return lst_zones[(col * len(lst_zones)) // self.n_cols]
+
+    def beo(self, i_lu):
+        return ['Low', 'Intermediate', 'High'][i_lu % 3]
+
+    def __landscape_units(self, rnd):
+        lst_fields = [('LANDSCAPE_UNIT_NAME', 'TEXT', 50, None), ('LANDSCAPE_UNIT_NUMBER', 'TEXT', 10, None),
+                      ('LANDSCAPE_UNIT_PROVID', 'LONG', None, None), ('BIODIVERSITY_EMPHASIS_OPTION', 'TEXT', 20, None)]
+        self.__create(self.fc_lu, lst_fields)
+        with arcpy.da.InsertCursor(self.fc_lu, [f[0] for f in lst_fields] + ['SHAPE@WKT']) as i_cursor:
+            for j in range(self.n_lu_side):
+                for i in range(self.n_lu_side):
+                    i_lu = j * self.n_lu_side + i
+                    col = i * self.n_cols // self.n_lu_side
+                    row = j * self.n_rows // self.n_lu_side
+                    width = (i + 1) * self.n_cols // self.n_lu_side - col
+                    height = (j + 1) * self.n_rows // self.n_lu_side - row
+                    i_cursor.insertRow([self.lu_name(i_lu), 'S{:02d}'.format(i_lu + 1), 9000 + i_lu, self.beo(i_lu),
+                                        self.__square(col, row, width, height)])
+
+    def __extent_polygon(self, fc, lst_fields):
+        self.__create(fc, lst_fields)
+        with arcpy.da.InsertCursor(fc, [f[0] for f in lst_fields] + ['SHAPE@WKT']) as i_cursor:
+            i_cursor.insertRow([f[3] for f in lst_fields] + [self.__square(0, 0, self.n_cols, self.n_rows)])
+
+    def __beo(self):
+        lst_fields = [('NATURAL_DISTURBANCE', 'TEXT', 10, None), ('MAP_LABEL', 'TEXT', 20, None),
+                      ('LANDSCAPE_UNIT_NAME', 'TEXT', 50, None), ('BIODIVERSITY_EMPHASIS_OPTION', 'TEXT', 20, None)]
+        self.__create(self.fc_beo, lst_fields)
+        with arcpy.da.InsertCursor(self.fc_beo, [f[0] for f in lst_fields] + ['SHAPE@WKT']) as i_cursor:
+            for row in range(0, self.n_rows, max(1, self.n_rows // 40)):
+                for col in range(0, self.n_cols, max(1, self.n_cols // 40)):
+                    i_lu = self.lu_index(col, row)
+                    i_cursor.insertRow([self.ndt(row), self.zone(col, row), self.lu_name(i_lu), self.beo(i_lu),
+                                        self.__square(col, row, max(1, self.n_cols // 40),
+                                                      max(1, self.n_rows // 40))])
+
+    def __patches(self, rnd, fc, lst_fields, coverage):
+        # Square patches of 4 to 25 ha scattered until roughly the requested share of the grid is covered
+        self.__create(fc, lst_fields)
+        target = coverage * self.n_polygons
+        covered = 0
+        with arcpy.da.InsertCursor(fc, [f[0] for f in lst_fields] + ['SHAPE@WKT']) as i_cursor:
+            while covered < target:
+                size = rnd.randint(2, 5)
+                col = rnd.randint(0, max(0, self.n_cols - size))
+                row = rnd.randint(0, max(0, self.n_rows - size))
+                values = [f[3] if f[3] is not None else rnd.randint(1960, 2023) for f in lst_fields]
+                i_cursor.insertRow(values + [self.__square(col, row, size, size)])
+                covered += size * size
+
+    def __resultant(self, rnd):
+        lst_fields = [('LANDSCAPE_UNIT_NAME', 'TEXT', 50), ('LANDSCAPE_UNIT_NUMBER', 'TEXT', 10),
+                      ('BIODIVERSITY_EMPHASIS_OPTION', 'TEXT', 20), ('NATURAL_DISTURBANCE', 'TEXT', 10),
+                      ('MAP_LABEL', 'TEXT', 20), ('STATUS', 'TEXT', 25), ('OPERABLE', 'TEXT', 25),
+                      ('OPERATING_AREA', 'TEXT', 50), ('PROJ_AGE_1', 'SHORT', None), ('PROJECTED_DATE', 'DATE', None),
+                      ('CC_STATUS', 'TEXT', 20), ('CC_HARVEST_DATE', 'TEXT', 20), ('BCLCS_LEVEL_1', 'TEXT', 1),
+                      ('BCLCS_LEVEL_2', 'TEXT', 1), ('BCLCS_LEVEL_3', 'TEXT', 1), ('BCLCS_LEVEL_4', 'TEXT', 2),
+                      ('FOR_MGMT_LAND_BASE_IND', 'TEXT', 1), ('LINE_7B_DISTURBANCE_HISTORY', 'TEXT', 10),
+                      ('CROWN_CLOSURE', 'SHORT', None), ('LINE_7_ACTIVITY_HIST_SYMBOL', 'TEXT', 1)]
+        self.__create(self.fc_resultant, [f + (None,) for f in lst_fields])
+
+        lst_oas = ['Synthetic OA {}'.format(c) for c in 'ABCD']
+        with arcpy.da.InsertCursor(self.fc_resultant, [f[0] for f in lst_fields] + ['SHAPE@WKT']) as i_cursor:
+            for i in range(self.n_polygons):
+                col = i % self.n_cols
+                row = i // self.n_cols
+                i_lu = self.lu_index(col, row)
+
+                bclcs_1 = 'V' if rnd.random() < 0.9 else 'N'
+                bclcs_2 = 'T' if bclcs_1 == 'V' and rnd.random() < 0.88 else 'N'
+                bclcs_3 = rnd.choice(['U', 'U', 'U', 'W', 'A']) if bclcs_2 == 'N' else 'U'
+                bclcs_4 = rnd.choice(['TC', 'TM', 'TB']) if bclcs_2 == 'T' else rnd.choice(['ST', 'SL', 'HE', 'RO'])
+                line_7b = rnd.choice([None, None, None, 'L1985', 'B2003', 'I1998'])
+                cc_status = rnd.choice(['', '', '', '', '', '', 'HARVESTED', 'RESERVE'])
+                harvest_date = '{}-{:02d}-{:02d}'.format(rnd.randint(1970, 2023), rnd.randint(1, 12),
+                                                         rnd.randint(1, 28)) if cc_status == 'HARVESTED' else ''
+
+                i_cursor.insertRow([
+                    self.lu_name(i_lu), 'S{:02d}'.format(i_lu + 1), self.beo(i_lu), self.ndt(row),
+                    self.zone(col, row), 'OGMA' if rnd.random() < 0.08 else '',
+                    'OPERABLE' if rnd.random() < 0.45 else '',
+                    lst_oas[(col * len(lst_oas)) // self.n_cols] if rnd.random() < 0.7 else '',
+                    rnd.randint(1, 400) if rnd.random() < 0.95 else None,
+                    dt(rnd.randint(2005, 2022), 1, 1), cc_status, harvest_date, bclcs_1, bclcs_2, bclcs_3, bclcs_4,
+                    'Y' if rnd.random() < 0.85 else 'N', line_7b, rnd.randint(0, 90),
+                    '$' if rnd.random() < 0.03 else None, self.__square(col, row)])
+
+    def __targets(self):
+        dict_ages = {'NDT1': (120, 250), 'NDT2': (120, 250), 'NDT3': (100, 140), 'NDT4': (100, 250)}
+        dict_targets = {'LOW': (17, 9), 'INTERMEDIATE': (34, 9), 'HIGH': (51, 13)}
+        with open(self.target_file, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['LAND_RESOURCE_PLAN', 'NATURAL_DISTURBANCE', 'MAP_LABEL', 'BIODIVERSITY_EMPHASIS_OPTION',
+                             'MATURE', 'OLD', 'TARGET_MATURE_OLD', 'TARGET_OLD'])
+            for ndt in sorted(self.dict_bec):
+                for zone in self.dict_bec[ndt]:
+                    for beo in sorted(dict_targets):
+                        writer.writerow(['OKANAGAN SHUSWAP', ndt, zone.upper(), beo, dict_ages[ndt][0],
+                                         dict_ages[ndt][1], dict_targets[beo][0], dict_targets[beo][1]])